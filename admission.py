@@ -0,0 +1,110 @@
+"""
+Fair, bounded access to a shared resource (an Ollama model) for many users.
+
+FairGate admits at most `limit` requests at once. The others wait in one FIFO
+queue per key (user), and freed slots go round-robin across the keys, so a user
+with many requests in flight cannot starve the rest. Admission control refuses
+a request (Overloaded) when `max_waiting` requests are already queued, or when
+it has waited longer than `timeout` seconds.
+"""
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """The request was refused instead of queued; the caller should retry later."""
+
+
+class FairGate:
+    def __init__(self, limit, max_waiting=256, timeout=None):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waiting = OrderedDict()   # key -> deque of tickets (threading.Event), in round-robin order
+        self._waiting_count = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, key):
+        """Holds one of the `limit` slots for the duration of the block."""
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, key):
+        with self._lock:
+            if self.active < self.limit and not self._waiting:
+                self.active += 1
+                self.admitted += 1
+                return
+            if self._waiting_count >= self.max_waiting:
+                self.rejected += 1
+                raise Overloaded(f"{self._waiting_count} requests are already waiting")
+            ticket = threading.Event()
+            self._waiting.setdefault(key, deque()).append(ticket)
+            self._waiting_count += 1
+
+        if ticket.wait(self.timeout):
+            return
+        with self._lock:
+            if ticket.is_set():  # admitted just as the wait timed out
+                return
+            tickets = self._waiting[key]
+            tickets.remove(ticket)
+            if not tickets:
+                del self._waiting[key]
+            self._waiting_count -= 1
+            self.rejected += 1
+        raise Overloaded(f"no slot became free within {self.timeout:g} s")
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            while self.active < self.limit and self._waiting:
+                key, tickets = next(iter(self._waiting.items()))
+                ticket = tickets.popleft()
+                if tickets:
+                    self._waiting.move_to_end(key)  # the next slot goes to another user
+                else:
+                    del self._waiting[key]
+                self._waiting_count -= 1
+                self.active += 1
+                self.admitted += 1
+                ticket.set()
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "active": self.active, "waiting": self._waiting_count,
+                    "admitted": self.admitted, "rejected": self.rejected}
+
+
+class ModelGates:
+    """One FairGate per model name, all with the same settings."""
+
+    def __init__(self, limit, max_waiting=256, timeout=None):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    def gate(self, model):
+        with self._lock:
+            gate = self._gates.get(model)
+            if gate is None:
+                gate = self._gates[model] = FairGate(self.limit, self.max_waiting, self.timeout)
+            return gate
+
+    def slot(self, model, key):
+        return self.gate(model).slot(key)
+
+    def stats(self):
+        with self._lock:
+            gates = dict(self._gates)
+        return {model: gate.stats() for model, gate in gates.items()}
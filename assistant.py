@@ -1,60 +1,70 @@
-import subprocess 
 import os
-import requests
+import http_client
+import stt
+from history import ChatHistory
+from intent_router import IntentRouter
+from tool_executor import ToolExecutor
+from tool_calls import ToolCallExtractor, extract_tool_calls, tool_call_schema, validate_tool_calls
+from tool_summaries import ToolSummaries
+import response_cache
+import routine_store
+import tracing
+import tts
+import reminders
+import capabilities
 import json
-from datetime import datetime, time
+import sys
+from datetime import datetime, time, timedelta
 import re
-import random
-import time as time_lib 
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+import heapq
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
 
 # =========================================================
 # CRITICAL FIX: Robust Safely Handled Imports & State
 # =========================================================
 
-# Initialize modules to None for safety
-sr = None
-pyjokes = None
-torch = None
-torchaudio = None
-numpy = None
-whisper = None
+# The speech stack (speech_recognition, whisper, torch, numpy) and pyjokes are imported on
+# first use, so written mode starts without paying for them. These probe availability only.
+def speech_recognition_available():
+    return capabilities.module_available("speech_recognition")
 
-# State variables
-SPEECH_RECOGNITION_AVAILABLE = False
-PYJOKES_AVAILABLE = False
-WHISPER_AVAILABLE = False
+def whisper_available():
+    return capabilities.all_available("whisper", "torch", "numpy")
+
+def pyjokes_available():
+    return capabilities.module_available("pyjokes")
+
+_CAPABILITY_PROBES = {
+    "SPEECH_RECOGNITION_AVAILABLE": speech_recognition_available,
+    "WHISPER_AVAILABLE": whisper_available,
+    "PYJOKES_AVAILABLE": pyjokes_available,
+}
+
+def __getattr__(name):
+    # assistant.WHISPER_AVAILABLE and friends are evaluated when first read
+    if name in _CAPABILITY_PROBES:
+        return _CAPABILITY_PROBES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Global state for input mode
 CURRENT_MODE = 'W' # Start in Written mode for ease of testing
 
-# --- Speech Recognition Component ---
-try:
-    import speech_recognition as sr
-    SPEECH_RECOGNITION_AVAILABLE = True
-except ImportError:
-    print("Warning: Failed to import SpeechRecognition. Legacy STT unavailable.")
-    
-# --- Pyjokes Component ---
-try:
-    import pyjokes
-    PYJOKES_AVAILABLE = True
-except ImportError:
-    print("Warning: Failed to import pyjokes. Joke command unavailable.")
-
-# --- Whisper and PyTorch Components ---
-try:
-    import torch
-    import torchaudio
-    import numpy
-    import whisper 
-    WHISPER_AVAILABLE = True
-except ImportError:
-    print("Warning: Failed to import Whisper components. Voice command functionality may be limited.")
-
 # ==============================
 # 1. WHISPER CONFIGURATION
 # ==============================
 WHISPER_MODEL = None
+WHISPER_MODEL_SIZE = "base"   # "tiny" is fastest on a Pi, "small" is most accurate
+WHISPER_INT8 = False          # int8 dynamic quantization for faster CPU inference
+WHISPER_WARMUP = True         # run a short dummy transcription after loading
+WHISPER_CONTINUOUS = True     # keep the mic open behind a VAD and transcribe while the user speaks
+                              # (switched off automatically if the microphone cannot be opened)
+_CONTINUOUS_LISTENER = None
+WHISPER_MANAGER = stt.WhisperModelManager(WHISPER_MODEL_SIZE, quantize=WHISPER_INT8, warmup=WHISPER_WARMUP)
 # ============================================
 
 # +++ 2. OLLAMA CONFIGURATION (UPDATED) +++
@@ -62,6 +72,51 @@ WHISPER_MODEL = None
 OLLAMA_API_URL = "http://localhost:11434/api/chat"
 # --- CRITICAL CHANGE: Switched from "llama3" to your custom model ---
 OLLAMA_MODEL = "ishu-companion" 
+# Stream tokens to the console and speak each sentence while the rest is still generating
+OLLAMA_STREAM = True
+# Keep the model (and its KV cache) loaded between turns; every request must use the same
+# num_ctx, otherwise Ollama reloads the model.
+OLLAMA_KEEP_ALIVE = "30m"
+OLLAMA_OPTIONS = {"num_ctx": 4096}
+OLLAMA_SHOW_METRICS = False   # print each reply's prompt-eval/eval timings (to stderr); always traced
+# Timing fields of the last completed Ollama response (see _record_ollama_metrics)
+OLLAMA_METRICS = {}
+# Mirrors 'PARAMETER temperature' in the Modelfile; used to decide what is safe to cache
+OLLAMA_MODEL_TEMPERATURE = 0.6
+
+# --- Tiered model routing ---
+# Routine turns the intent router cannot answer locally go to this small, fast model first. Its output
+# is constrained by a JSON schema built from TOOL_MAPPER (Ollama's `format`), so the tool calls always
+# parse. Conversation (stories, support, B.Tech help) stays on OLLAMA_MODEL. None disables the tier.
+# Ollama keeps both models loaded if OLLAMA_MAX_LOADED_MODELS allows it.
+OLLAMA_TOOL_MODEL = None      # e.g. "qwen2.5:1.5b-instruct"
+OLLAMA_TOOL_OPTIONS = {"temperature": 0, "num_predict": 256}
+# Turns of recent conversation shown to the tool model, for follow-ups like "remove that one too"
+TOOL_MODEL_CONTEXT_MESSAGES = 4
+TOOL_MODEL_PROMPT = """
+You select tools for a daily-routine assistant. Reply with the tool calls that carry out the user's
+request, using 24-hour HH:MM times. Tools:
+- get_routine(): the whole daily routine.
+- get_task_by_time(query_time [optional]): the activity at one point in time; omit query_time for "now".
+- add_routine_entry(start, end, activity): add an activity.
+- remove_routine_entry(activity_keyword): remove the activities whose name contains the keyword.
+To change an activity, remove it and add it again. If the request does not need any tool
+(chat, jokes, stories, study help), reply with an empty list of tool_calls.
+"""
+
+# --- Response cache for deterministic LLM calls ---
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 6 * 60 * 60              # seconds
+RESPONSE_CACHE_DB = None                      # e.g. "response_cache.sqlite3" to keep entries across restarts
+RESPONSE_CACHE_NONZERO_TEMPERATURE = False    # opt in to caching sampled (temperature > 0) replies
+# Span timings and counters for every turn (see tracing.py for --trace / --metrics-port / --profile)
+TRACER = tracing.Tracer()
+
+RESPONSE_CACHE = response_cache.ResponseCache(
+    max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, db_path=RESPONSE_CACHE_DB,
+    cache_nonzero_temperature=RESPONSE_CACHE_NONZERO_TEMPERATURE, default_temperature=OLLAMA_MODEL_TEMPERATURE,
+) if RESPONSE_CACHE_ENABLED else None
 
 # NOTE: The full prompt is now managed in the Modelfile, but we keep the structure here for history fallbacks.
 OLLAMA_SYSTEM_PROMPT = """
@@ -81,85 +136,157 @@ The available tools and their required arguments are:
 If the request is NOT a tool call (e.g., asking a general question, asking for a joke, or when provided with tool results), 
 answer the question directly and concisely as Ishu.
 """
+# --- Chat history budget (approximate tokens re-sent to Ollama every turn) ---
+HISTORY_TOKEN_BUDGET = 2048
+HISTORY_SUMMARY_TOKENS = 256
 # ============================================
 
+# --- Text-to-speech ---
+TTS_ENGINE = "auto"      # "auto", "say" (macOS), "espeak" (espeak-ng, e.g. on a Pi), "file" or "none"
+TTS_FILE_PATH = None     # with "file" (or set under "auto"), utterances are appended here instead of spoken
+SPEECH_WORKER = None
+
 # --- File Paths (CRITICAL FIX: Use simple relative path for FLAT structure) ---
 # Assuming all files are in the same directory as assistant.py
 ROUTINE_FILE_PATH = "routine.json"
 FAVORITES_FILE_PATH = "favorites.json"
+# Routine edits are appended to routine.json.journal; after this many batches it is folded into routine.json
+ROUTINE_COMPACT_EVERY = 200
+# "json" keeps the routine in ROUTINE_FILE_PATH; "sqlite" uses an indexed database for very large routines
+# (imported from ROUTINE_FILE_PATH the first time the database is empty)
+ROUTINE_BACKEND = "json"
+ROUTINE_DB_PATH = "routine.db"
+# Announce "<activity> starts now" / "ends now" at every routine transition (background scheduler)
+ANNOUNCE_ROUTINE = False
+REMINDER_SCHEDULER = None
+
+# --- Server mode (server.py) ---
+# The user a request runs for (see user_context); None is the local user with the paths above
+_USER = contextvars.ContextVar("ishu_user", default=None)
+# admission.ModelGates shared by every session: fair, bounded access to each Ollama model (None: no limit)
+OLLAMA_GATES = None
 
 
 # ========== Helper functions ==========
 
-def speak(text, blocking=False):
+class UserContext:
+    def __init__(self, user_id, routine_file_path, routine_db_path):
+        self.user_id = user_id
+        self.routine_file_path = routine_file_path
+        self.routine_db_path = routine_db_path
+
+
+@contextmanager
+def user_context(user_id, routine_file_path, routine_db_path=None):
     """
-    Handles text-to-speech using the fast, local Mac 'say' command via subprocess.
+    Runs the enclosed code for one user: routine tools read and edit that user's files, and
+    LLM requests queue under that user's name. Tool calls started inside inherit the context.
     """
-    print(f"Ishu says: {text}")
-    
-    # --- MAC/DARWIN TTS ---
-    is_mac = os.name == "posix" and os.uname().sysname == "Darwin"
+    if routine_db_path is None:
+        routine_db_path = os.path.splitext(routine_file_path)[0] + ".db"
+    token = _USER.set(UserContext(user_id, routine_file_path, routine_db_path))
+    try:
+        yield _USER.get()
+    finally:
+        _USER.reset(token)
 
-    if is_mac:
-        try:
-            command = ['say', text]
-            if blocking:
-                # Waits for the speech to finish (blocking)
-                subprocess.run(command)
-            else:
-                # Starts the speech and moves on (non-blocking)
-                subprocess.Popen(command) 
-        except FileNotFoundError:
-            print("Warning: Mac 'say' command not found. Speech failed.")
-            print("TTS currently configured for macOS 'say' command. Speech unavailable.")
-
-    # --- RASPBERRY PI/LINUX TTS Placeholder ---
-    elif os.uname().sysname == "Linux" and ("arm" in os.uname().machine or "aarch64" in os.uname().machine):
-        # NOTE: Placeholder for Pi-compatible TTS engine (e.g., Piper/PicoTTS)
-        print("Pi/Linux environment detected. TTS engine (Piper/Pico) needs to be configured and uncommented.")
-            
-    # Placeholder/Error message for non-Mac/Pi environments
-    else:
-        print("TTS currently configured for macOS 'say' command. Speech unavailable.")
 
+def current_user_id():
+    user = _USER.get()
+    return user.user_id if user else "local"
 
-def listen_whisper():
-    """Records audio and uses Whisper for high-accuracy transcription."""
-    global WHISPER_MODEL 
 
-    if not WHISPER_AVAILABLE or not SPEECH_RECOGNITION_AVAILABLE:
-        return "Required speech modules (Whisper/SpeechRecognition) failed to load."
+def routine_file_path():
+    user = _USER.get()
+    return user.routine_file_path if user else ROUTINE_FILE_PATH
+
+
+def routine_db_path():
+    user = _USER.get()
+    return user.routine_db_path if user else ROUTINE_DB_PATH
+
+
+def get_speech_worker():
+    """Creates the TTS worker on first use; the engine is detected once, not per utterance."""
+    global SPEECH_WORKER
+    if SPEECH_WORKER is None:
+        engine = tts.detect_engine(TTS_ENGINE, TTS_FILE_PATH)
+        if engine.name == "none":
+            print("No TTS engine found (macOS 'say' or espeak-ng). Replies will only be printed.")
+        SPEECH_WORKER = tts.SpeechWorker(engine)
+    return SPEECH_WORKER
+
+
+def _echo(*args, **kwargs):
+    """Prints reply text on the console for the local user; server turns (see user_context) stay off it."""
+    if _USER.get() is None:
+        print(*args, **kwargs)
+
+
+def speak(text, blocking=False, echo=True):
+    """
+    Queues text on the TTS worker, so utterances are spoken in order and never overlap.
+    With blocking=True, waits until it has been spoken (or interrupted).
+    Pass echo=False when the text was already printed (e.g. streamed token by token).
+    """
+    if echo:
+        _echo(f"Ishu says: {text}")
+    with TRACER.span("speak"):
+        get_speech_worker().speak(text, wait=blocking)
+
+
+def wait_for_speech():
+    """Blocks until everything queued on the TTS worker has been spoken (or interrupted)."""
+    get_speech_worker().speak("", wait=True)
+
+
+def stop_speaking():
+    """Barge-in: drops queued speech and cuts off the current utterance."""
+    if SPEECH_WORKER is not None:
+        SPEECH_WORKER.interrupt()
+
+
+def preload_whisper():
+    """Starts loading Whisper in the background so it is warm by the first spoken command."""
+    if whisper_available() and speech_recognition_available():
+        WHISPER_MANAGER.start()
+
+
+def _ensure_whisper_model():
+    """Waits for the background Whisper load; returns False if the model cannot be used."""
+    global WHISPER_MODEL 
 
     if WHISPER_MODEL is None:
-        try:
-            print("Lazily loading Whisper model...")
-            WHISPER_MODEL = whisper.load_model("base") 
-        except Exception as e:
-            print(f"Error loading Whisper model: {e}")
-            WHISPER_MODEL = False # Mark as failed
-            return "Whisper model failed to load during runtime."
-    
-    # Proceed with listening
+        if not WHISPER_MANAGER.is_ready():
+            print("Waiting for the Whisper model to finish loading...")
+        model = WHISPER_MANAGER.wait()
+        WHISPER_MODEL = model if model is not None else False # False marks a failed load
+    return bool(WHISPER_MODEL)
+
+
+def record_audio():
+    """Records one utterance from the microphone; returns sr.AudioData or None on timeout."""
+    import speech_recognition as sr
+
     r = sr.Recognizer()
-    temp_audio_file = "temp_audio.wav" 
-    with sr.Microphone() as source:
+    with TRACER.span("stt.record"), sr.Microphone() as source:
         print("Whisper Listening...")
         r.adjust_for_ambient_noise(source)
         try:
-            audio = r.listen(source, timeout=5, phrase_time_limit=15)
+            return r.listen(source, timeout=5, phrase_time_limit=15)
         except sr.WaitTimeoutError:
             print("No speech detected within the timeout period.")
-            return ""
-            
-    try:
-        # Save the recorded audio to a temporary file
-        with open(temp_audio_file, "wb") as f:
-            f.write(audio.get_wav_data())
+            return None
+
 
-        # 2. Use Whisper to transcribe the file
+def transcribe_audio(audio):
+    """Transcribes recorded audio with Whisper, entirely in memory."""
+    try:
         if WHISPER_MODEL:
             print("Transcribing with Whisper...")
-            result = WHISPER_MODEL.transcribe(temp_audio_file, fp16=False) 
+            with TRACER.span("stt.transcribe"):
+                samples = stt.audio_data_to_array(audio)
+                result = WHISPER_MODEL.transcribe(samples, fp16=False) 
             text = result["text"].strip()
             print(f"User said: {text}")
             return text
@@ -170,9 +297,50 @@ def listen_whisper():
     except Exception as e:
         print(f"Whisper/Audio error; {e}")
         return ""
-    finally:
-        if os.path.exists(temp_audio_file):
-            os.remove(temp_audio_file)
+
+
+def listen_continuous():
+    """Returns the next utterance from the always-open, VAD-driven microphone stream."""
+    global _CONTINUOUS_LISTENER, WHISPER_CONTINUOUS
+
+    if _CONTINUOUS_LISTENER is None:
+        listener = stt.ContinuousListener(
+            lambda: WHISPER_MODEL, on_partial=lambda text: print(f"(hearing) {text}")
+        )
+        try:
+            listener.open()
+        except Exception as e:
+            print(f"Continuous listening is unavailable ({e}); recording each query instead.")
+            WHISPER_CONTINUOUS = False
+            return listen_recorded()
+        _CONTINUOUS_LISTENER = listener
+    try:
+        with TRACER.span("stt.listen_continuous"):
+            return _CONTINUOUS_LISTENER.listen()
+    except Exception as e:
+        print(f"Whisper/Audio error; {e}")
+        return ""
+
+
+def listen_whisper():
+    """Records audio and uses Whisper for high-accuracy transcription."""
+    if not whisper_available() or not speech_recognition_available():
+        return "Required speech modules (Whisper/SpeechRecognition) failed to load."
+
+    if not _ensure_whisper_model():
+        return "Whisper model failed to load during runtime."
+    
+    if WHISPER_CONTINUOUS:
+        return listen_continuous()
+    return listen_recorded()
+
+
+def listen_recorded():
+    """Records one phrase at the microphone's native rate and transcribes it (resampled for Whisper)."""
+    audio = record_audio()
+    if audio is None:
+        return ""
+    return transcribe_audio(audio)
 
 
 def listen_written():
@@ -192,29 +360,300 @@ def select_initial_mode():
         else:
             print("Invalid input. Please enter S or W.")
 
+# Parsed JSON documents keyed by path: {path: (file signature, document)}
+_JSON_CACHE = {}
+
+def _file_signature(filename):
+    """Returns (mtime_ns, size) for a file, or None if it cannot be stat'ed."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
 def load_json(filename, default):
+    """
+    Loads a JSON document, re-parsing the file only when its mtime/size changed.
+    The returned object is shared with the cache; only mutate it if you save_json it right after.
+    """
+    signature = _file_signature(filename)
+    if signature is None:
+        _JSON_CACHE.pop(filename, None)
+        return default
+
+    cached = _JSON_CACHE.get(filename)
+    if cached and cached[0] == signature:
+        return cached[1]
+
     try:
-        if os.path.exists(filename):
-            with open(filename, "r") as f:
-                return json.load(f)
+        with open(filename, "r") as f:
+            obj = json.load(f)
     except Exception:
-        pass
-    return default
+        return default
+    _JSON_CACHE[filename] = (signature, obj)
+    return obj
 
 def save_json(filename, obj):
     try:
         os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
-        with open(filename, "w") as f:
+        # Write to a temp file and swap it in, so readers never see a half-written file
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, "w") as f:
             json.dump(obj, f, indent=4)
+        os.replace(temp_filename, filename)
     except Exception as e:
+        _JSON_CACHE.pop(filename, None)
         print(f"Error saving JSON: {e}")
+        return False
+    # Write-through: the next load_json of this file is served from memory.
+    _JSON_CACHE[filename] = (_file_signature(filename), obj)
+    return True
+
+# This regex looks for a line break (\n) followed by optional whitespace (\s*) and
+# then either 'User:' or 'Assistant:' -- the start of an LLM-hallucinated conversational turn.
+HALLUCINATED_TURN_RE = re.compile(r'(\n|\r\n|\r)\s*(User:|Assistant:)', re.IGNORECASE)
+_TURN_MARKERS = ("user:", "assistant:")
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
 
-def ollama_response(prompt, history=None):
+def trim_hallucinated_turns(content):
+    """Keeps only the text before the first hallucinated 'User:'/'Assistant:' line."""
+    match = HALLUCINATED_TURN_RE.search(content)
+    if match:
+        # If a match is found, trim the content at the start of the line break
+        return content[:match.start()].strip()
+    return content.strip()
+
+def _releasable_length(content, pending=None):
+    """
+    Returns how much of a partially streamed reply is safe to show: text after the last
+    line break is held back while it could still turn into a 'User:'/'Assistant:' marker,
+    and an object that is still open at `pending` is held back because it may be a tool call.
+    """
+    safe = len(content) if pending is None else pending
+
+    line_break = max(content.rfind('\n'), content.rfind('\r'))
+    if line_break != -1:
+        tail = content[line_break + 1:].lstrip().lower()
+        if any(marker.startswith(tail) for marker in _TURN_MARKERS):
+            safe = min(safe, line_break)
+    return safe
+
+
+def _outside_spans(content, start, end, spans):
+    """content[start:end] without the parts covered by the (start, end) spans of tool calls."""
+    pieces = []
+    for span_start, span_end in spans:
+        if span_end <= start or span_start >= end:
+            continue
+        pieces.append(content[start:span_start] if span_start > start else "")
+        start = max(start, span_end)
+    if start < end:
+        pieces.append(content[start:end])
+    return "".join(pieces)
+
+
+class SentenceSplitter:
+    """Buffers streamed text and returns sentences once their terminator and trailing space arrive."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        parts = SENTENCE_END_RE.split(self.buffer)
+        self.buffer = parts.pop()
+        return [part.strip() for part in parts if part.strip()]
+
+    def flush(self):
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest
+
+
+def _consume_stream(response, on_sentence=None, cancel_event=None, on_tool_call=None):
+    """
+    Reads Ollama's NDJSON chunks as they arrive, printing tokens and handing each completed
+    sentence to `on_sentence`. Each tool call is passed to `on_tool_call` as soon as its JSON
+    object closes; tool calls are never spoken, while other text in braces is released once
+    it turns out not to be one. Stops reading (and closes the connection, which makes Ollama
+    stop generating) as soon as a hallucinated conversational turn shows up or `cancel_event`
+    is set; a cancelled reply is not flushed.
+    """
+    role = "assistant"
+    content = ""
+    released = 0
+    started = False
+    splitter = SentenceSplitter()
+    extractor = ToolCallExtractor()
+    scanned = 0
+    complete = False
+    has_metrics = False
+
+    def release(upto):
+        nonlocal released, started
+        if upto <= released:
+            return
+        text = _outside_spans(content, released, upto, extractor.spans)
+        released = upto
+        if not started:
+            text = text.lstrip()
+            if not text:
+                return
+            _echo("Ishu says: ", end="")
+            started = True
+        _echo(text, end="", flush=True)
+        for sentence in splitter.feed(text):
+            if on_sentence:
+                on_sentence(sentence)
+
+    try:
+        lines = response.iter_lines()
+        for line in lines:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if not line:
+                continue
+            chunk = json.loads(line)
+            message = chunk.get("message") or {}
+            role = message.get("role", role)
+            content += message.get("content", "")
+
+            match = HALLUCINATED_TURN_RE.search(content)
+            if match:
+                content = content[:match.start()]
+
+            if len(content) > scanned:
+                for tool_call in extractor.feed(content[scanned:]):
+                    if on_tool_call:
+                        on_tool_call(tool_call)
+                scanned = len(content)
+            if match:
+                break
+
+            release(_releasable_length(content, extractor.pending))
+            if chunk.get("done"):
+                # Shown below, after the reply's line
+                has_metrics = _record_ollama_metrics(chunk, show=False)
+                complete = True
+                break
+        if complete:
+            # Read the end of the chunked body, so the keep-alive connection goes back to the pool
+            for _ in lines:
+                pass
+    finally:
+        response.close()
+
+    if cancel_event is not None and cancel_event.is_set():
+        if started:
+            _echo()
+        return {"role": role, "content": content.strip()}
+
+    # Nothing else is coming, so release whatever was held back, except an unfinished tool call
+    pending = extractor.pending
+    unfinished_tool_call = pending is not None and '"tool_call"' in content[pending:]
+    release(pending if unfinished_tool_call else len(content.rstrip()))
+    if started:
+        _echo()
+        rest = splitter.flush()
+        if rest and on_sentence:
+            on_sentence(rest)
+    if has_metrics:
+        _show_ollama_metrics()
+
+    return {"role": role, "content": content.strip()}
+
+
+def _record_ollama_metrics(data, show=True):
+    """
+    Stores prompt-eval vs eval timings from Ollama's final response fields. A small
+    prompt_eval_count on a long conversation means the KV cache prefix was reused.
+    """
+    if "eval_count" not in data and "prompt_eval_count" not in data:
+        return False
+    ns = 1e9
+    metrics = {
+        "load_s": data.get("load_duration", 0) / ns,
+        "prompt_eval_tokens": data.get("prompt_eval_count", 0),
+        "prompt_eval_s": data.get("prompt_eval_duration", 0) / ns,
+        "eval_tokens": data.get("eval_count", 0),
+        "eval_s": data.get("eval_duration", 0) / ns,
+        "total_s": data.get("total_duration", 0) / ns,
+    }
+    OLLAMA_METRICS.clear()
+    OLLAMA_METRICS.update(metrics)
+    TRACER.count("llm_prompt_tokens", metrics["prompt_eval_tokens"])
+    TRACER.count("llm_eval_tokens", metrics["eval_tokens"])
+    if show:
+        _show_ollama_metrics()
+    return True
+
+
+def _show_ollama_metrics():
+    """Prints the last timings to stderr (if OLLAMA_SHOW_METRICS), so they never split a streamed reply."""
+    if OLLAMA_SHOW_METRICS and OLLAMA_METRICS:
+        metrics = OLLAMA_METRICS
+        print(f"[ollama] prompt eval: {metrics['prompt_eval_tokens']} tok in {metrics['prompt_eval_s']:.2f}s | "
+              f"eval: {metrics['eval_tokens']} tok in {metrics['eval_s']:.2f}s | load: {metrics['load_s']:.2f}s",
+              file=sys.stderr)
+
+
+def warm_up_ollama(model=None, system_prompt=None):
+    """
+    Loads the model (OLLAMA_MODEL by default) and evaluates its system prompt before the first
+    user query, so the first turn starts from a loaded model and a cached prompt prefix.
+    """
+    payload = {
+        "model": model or OLLAMA_MODEL,
+        "messages": [{"role": "system", "content": system_prompt or OLLAMA_SYSTEM_PROMPT}],
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {**OLLAMA_OPTIONS, "num_predict": 1},
+    }
+    try:
+        response = http_client.post_json(OLLAMA_API_URL, payload)
+        if response.status_code == 200:
+            _record_ollama_metrics(response.json())
+        else:
+            print(f"Ollama warm-up failed (Code {response.status_code}).")
+    except http_client.RequestException as e:
+        print(f"Ollama warm-up skipped: {e}")
+
+
+def start_ollama_warmup():
+    """Runs warm_up_ollama in the background so it overlaps with the greeting (both tiers, if routed)."""
+    def warm_up():
+        warm_up_ollama()
+        if OLLAMA_TOOL_MODEL:
+            warm_up_ollama(OLLAMA_TOOL_MODEL, TOOL_MODEL_PROMPT)
+    threading.Thread(target=warm_up, name="ollama-warmup", daemon=True).start()
+
+
+def _replay_cached(content, on_sentence):
+    """Echoes a cached reply the way a stream would have, without the tool-call JSON."""
+    extractor = ToolCallExtractor()
+    extractor.feed(content)
+    spoken = _outside_spans(content, 0, len(content), extractor.spans).strip()
+    if not spoken:
+        return
+    _echo(f"Ishu says: {spoken}")
+    splitter = SentenceSplitter()
+    for sentence in splitter.feed(spoken) + [splitter.flush()]:
+        if sentence and on_sentence:
+            on_sentence(sentence)
+
+
+def ollama_response(prompt, history=None, stream=False, on_sentence=None, cancel_event=None, options=None,
+                    on_tool_call=None, model=None, format=None):
     """
     Sends a prompt to the local Ollama LLM and returns the response. 
     (Fixed: Implements post-processing to strip out LLM-hallucinated conversational turns.)
+    With stream=True, tokens are printed as they arrive and each finished sentence is passed
+    to `on_sentence` (e.g. speak) before generation completes. `on_tool_call` receives every
+    tool call in the reply (while streaming, as soon as each one is complete). `options` are
+    merged over OLLAMA_OPTIONS; deterministic requests are answered from RESPONSE_CACHE when possible.
+    `model` overrides OLLAMA_MODEL, and `format` (a JSON schema) constrains the reply to match it.
     """
     print(f"Ollama thinking...")
+    model = model or OLLAMA_MODEL
 
     # Build the messages list for the API call
     if history and len(history) > 0:
@@ -226,49 +665,69 @@ def ollama_response(prompt, history=None):
     if not messages or messages[-1].get('content') != prompt:
         messages.append({"role": "user", "content": prompt})
             
+    request_options = {**OLLAMA_OPTIONS, **(options or {})}
     payload = {
-        "model": OLLAMA_MODEL,
+        "model": model,
         "messages": messages, 
-        "stream": False, 
+        "stream": stream, 
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": request_options,
     }
+    if format is not None:
+        payload["format"] = format
 
-    try:
-        response = requests.post(OLLAMA_API_URL, json=payload)
+    cache_key = None
+    if RESPONSE_CACHE is not None and RESPONSE_CACHE.is_cacheable(request_options):
+        key_options = request_options if format is None else {**request_options, "format": format}
+        cache_key = response_cache.make_key(model, messages, key_options)
+        cached = RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            TRACER.count("llm_cache_hits")
+            print("(answered from the response cache)")
+            if stream:
+                _replay_cached(cached["content"], on_sentence)
+            if on_tool_call:
+                for tool_call in extract_tool_calls(cached["content"]):
+                    on_tool_call(tool_call)
+            return dict(cached)
+
+    # In server mode the request waits for its turn at the model; admission.Overloaded propagates
+    gate = OLLAMA_GATES.slot(model, current_user_id()) if OLLAMA_GATES is not None else nullcontext()
+    with gate:
+        TRACER.count("llm_calls", model=model)
+        try:
+            response = http_client.post_json(OLLAMA_API_URL, payload, stream=stream)
         
-        if response.status_code == 200:
-            data = response.json()
-            message = data.get("message", {"role": "assistant", "content":"Sorry, the LLM returned an empty response."})
-            
-            # --- CRITICAL FIX: POST-PROCESS THE LLM OUTPUT ---
-            content = message.get("content", "")
-            
-            # Find the first occurrence of "User:" or "Assistant:" 
-            # (preceded by a line break) and slice the string to keep only the part before it.
-            # Using regex for a robust check across different capitalizations/formats.
-            
-            # This regex looks for a line break (\n) followed by optional whitespace (\s*) and 
-            # then either 'User:' or 'Assistant:'
-            match = re.search(r'(\n|\r\n|\r)\s*(User:|Assistant:)', content, re.IGNORECASE)
-            
-            if match:
-                # If a match is found, trim the content at the start of the line break
-                clean_content = content[:match.start()].strip()
-            else:
-                # Otherwise, use the full content
-                clean_content = content.strip()
-            
-            message["content"] = clean_content
-            # --- END CRITICAL FIX ---
+            if response.status_code == 200:
+                if stream:
+                    message = _consume_stream(response, on_sentence, cancel_event, on_tool_call)
+                else:
+                    data = response.json()
+                    _record_ollama_metrics(data)
+                    message = data.get("message", {"role": "assistant", "content":"Sorry, the LLM returned an empty response."})
+                
+                    # --- CRITICAL FIX: POST-PROCESS THE LLM OUTPUT ---
+                    # (schema-constrained replies are JSON, never a conversation to trim)
+                    if format is None:
+                        message["content"] = trim_hallucinated_turns(message.get("content", ""))
+                    if on_tool_call:
+                        for tool_call in extract_tool_calls(message["content"]):
+                            on_tool_call(tool_call)
 
-            return message
-        else:
-            return {"role": "assistant", "content": f"Ollama API Error (Code {response.status_code}). Check your model name ({OLLAMA_MODEL}). Response text: {response.text[:100]}..."}
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                if cache_key and message.get("content") and not cancelled:
+                    RESPONSE_CACHE.put(cache_key, dict(message))
+                return message
+            else:
+                return {"role": "assistant", "content": f"Ollama API Error (Code {response.status_code}). Check your model name ({model}). Response text: {response.text[:100]}..."}
 
-    except requests.exceptions.ConnectionError:
-        return {"role": "assistant", "content": f"I can't connect to the local LLM. Please make sure Ollama is running on http://localhost:11434 and the model ('{OLLAMA_MODEL}') is created."}
-    except Exception as e:
-        print(f"Unexpected Ollama error: {e}")
-        return {"role": "assistant", "content": "An unexpected error occurred while processing the LLM request."}
+        except http_client.ConnectionError:
+            return {"role": "assistant", "content": f"I can't connect to the local LLM. Please make sure Ollama is running on http://localhost:11434 and the model ('{model}') is created."}
+        except http_client.Timeout:
+            return {"role": "assistant", "content": f"The local LLM ('{model}') took too long to answer. Please try again in a moment."}
+        except Exception as e:
+            print(f"Unexpected Ollama error: {e}")
+            return {"role": "assistant", "content": "An unexpected error occurred while processing the LLM request."}
     # ========== Routine Features with Robust Time Logic (TOOL FUNCTIONS) ==========
 
 def parse_time(timestr):
@@ -277,76 +736,447 @@ def parse_time(timestr):
     h, m = [int(part) for part in timestr.strip().split(":")]
     return time(hour=h, minute=m)
 
+MINUTES_PER_DAY = 24 * 60
+
+def to_minutes(timestr):
+    """Converts an HH:MM string into minutes after midnight (0-1439)."""
+    t = parse_time(timestr)
+    return t.hour * 60 + t.minute
+
+
+class RoutineIndex:
+    """
+    In-memory, read-optimised view of the routine.
+
+    Times are parsed once into minute-of-day integers. The day is split into
+    elementary segments (midnight-wrapping slots are split in two), each owned by
+    the first routine entry (in file order) that covers it. The segments are then
+    expanded into a 1440-slot minute-of-day timeline, so "current task" and "next
+    task" lookups are a single array index.
+
+    A transaction edits a copy() through add() and remove_matching(), which keep the
+    index up to date incrementally: entries are never re-parsed or re-sorted, and only
+    the minutes an edit covers change owner.
+    """
+
+    def __init__(self, routine):
+        # File order is kept because it decides which entry wins on overlaps.
+        self.entries = list(routine)
+        self._spans = [(to_minutes(e['start']), to_minutes(e['end'])) for e in self.entries]
+        self._build()
+
+    def _build(self):
+        spans = self._spans
+        order = sorted(range(len(spans)), key=lambda i: spans[i][0])  # stable, like list.sort
+        # A routine kept sorted by add_routine_entry is its own sorted view
+        self.sorted_entries = self.entries if order == list(range(len(order))) else [self.entries[i] for i in order]
+        self._starts = [spans[i][0] for i in order]
+        self._current_by_minute = self._build_timeline(*self._build_segments(spans))
+        self._refresh()
+
+    @staticmethod
+    def _covered(start, end):
+        """The [lo, hi) minute ranges an entry covers."""
+        if start < end:
+            return [(start, end)]
+        if start > end:  # wraps over midnight
+            return [(start, MINUTES_PER_DAY)] + ([(0, end)] if end > 0 else [])
+        return [(0, MINUTES_PER_DAY)]  # start == end covers the whole day (matches the old range check)
+
+    @classmethod
+    def _build_segments(cls, spans):
+        """Sweeps the day once and records which entry owns each elementary segment."""
+        segments = sorted((lo, hi, i) for i, (start, end) in enumerate(spans) for lo, hi in cls._covered(start, end))
+
+        points = sorted({0, MINUTES_PER_DAY} | {p for seg in segments for p in seg[:2]})
+        bounds, owners = [], []
+        active = []  # min-heap of (entry index, segment end)
+        pos = 0
+        for point in points[:-1]:
+            while pos < len(segments) and segments[pos][0] <= point:
+                heapq.heappush(active, (segments[pos][2], segments[pos][1]))
+                pos += 1
+            while active and active[0][1] <= point:
+                heapq.heappop(active)
+            owner = active[0][0] if active else -1
+            if not owners or owners[-1] != owner:
+                bounds.append(point)
+                owners.append(owner)
+        return bounds, owners
+
+    @staticmethod
+    def _build_timeline(bounds, owners):
+        """Per minute of the day, the owning entry (index into entries)."""
+        current = array('i', [-1]) * MINUTES_PER_DAY
+        bounds = bounds + [MINUTES_PER_DAY]
+        for start, end, owner in zip(bounds, bounds[1:], owners):
+            current[start:end] = array('i', [owner]) * (end - start)
+        return current
+
+    def _refresh(self):
+        """Recomputes the next-start timeline (index into sorted_entries) and the transition minutes."""
+        starts = self._starts
+        following = array('i', [-1]) * MINUTES_PER_DAY
+        if starts:
+            for minute in range(MINUTES_PER_DAY):
+                pos = bisect_left(starts, minute)
+                following[minute] = pos if pos < len(starts) else 0  # wraps to the first of the day
+        self._next_by_minute = following
+        # Minutes at which the current entry changes (a slot continuing over midnight is not a change)
+        current = self._current_by_minute
+        self.transitions = [minute for minute in range(MINUTES_PER_DAY) if current[minute] != current[minute - 1]]
+
+    def matching_activities(self, activity_keyword, limit=None):
+        """Up to `limit` activities containing the keyword (case-insensitive, as remove_matching matches)."""
+        keyword = activity_keyword.lower()
+        return list(islice((e['activity'] for e in self.entries if keyword in e['activity'].lower()), limit))
+
+    def copy(self):
+        """A private copy for a transaction to edit; readers of this index never see the edits."""
+        other = RoutineIndex.__new__(RoutineIndex)
+        other.entries = list(self.entries)
+        other.sorted_entries = other.entries if self.sorted_entries is self.entries else list(self.sorted_entries)
+        other._spans = list(self._spans)
+        other._starts = list(self._starts)
+        other._current_by_minute = array('i', self._current_by_minute)
+        other._next_by_minute = self._next_by_minute
+        other.transitions = self.transitions
+        return other
+
+    def add(self, entry):
+        """Inserts an entry where append + stable sort by start would put it (see routine_store.apply_ops)."""
+        start, end = to_minutes(entry['start']), to_minutes(entry['end'])
+        if self.sorted_entries is not self.entries:
+            # The file was not in start order (edited by hand): sort it once, as apply_ops does
+            order = sorted(range(len(self._spans)), key=lambda i: self._spans[i][0])
+            self.entries = [self.entries[i] for i in order]
+            self._spans = [self._spans[i] for i in order]
+            self._build()
+
+        pos = bisect_right(self._starts, start)
+        self.entries.insert(pos, entry)
+        self._spans.insert(pos, (start, end))
+        self._starts.insert(pos, start)
+        current = self._current_by_minute
+        for minute in range(MINUTES_PER_DAY):
+            if current[minute] >= pos:
+                current[minute] += 1
+        for lo, hi in self._covered(start, end):
+            for minute in range(lo, hi):
+                if current[minute] < 0 or current[minute] > pos:  # free, or owned by a later entry
+                    current[minute] = pos
+        self._refresh()
+
+    def remove_matching(self, activity_keyword):
+        """Removes every entry whose activity contains the keyword (case-insensitive); returns how many."""
+        keyword = activity_keyword.lower()
+        removed = [i for i, entry in enumerate(self.entries) if keyword in entry['activity'].lower()]
+        if not removed:
+            return 0
+        gone = set(removed)
+        kept = [i for i in range(len(self.entries)) if i not in gone]
+        if self.sorted_entries is self.entries:
+            self.entries = self.sorted_entries = [self.entries[i] for i in kept]
+            self._starts = [self._starts[i] for i in kept]
+        else:
+            gone_ids = {id(self.entries[i]) for i in removed}
+            pairs = [(e, s) for e, s in zip(self.sorted_entries, self._starts) if id(e) not in gone_ids]
+            self.sorted_entries, self._starts = [e for e, _ in pairs], [s for _, s in pairs]
+            self.entries = [self.entries[i] for i in kept]
+        self._spans = [self._spans[i] for i in kept]
+
+        # Renumber the owners that stay; the minutes of removed owners go to the first remaining entry covering them
+        current = self._current_by_minute
+        unowned = []
+        for minute in range(MINUTES_PER_DAY):
+            owner = current[minute]
+            if owner in gone:
+                unowned.append(minute)
+                current[minute] = -1
+            elif owner >= 0:
+                current[minute] = owner - bisect_left(removed, owner)
+        for i, (start, end) in enumerate(self._spans):
+            if not unowned:
+                break
+            for lo, hi in self._covered(start, end):
+                first, last = bisect_left(unowned, lo), bisect_left(unowned, hi)
+                for minute in unowned[first:last]:
+                    current[minute] = i
+                del unowned[first:last]
+        self._refresh()
+        return len(removed)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def current(self, minute):
+        """Returns the entry in progress at `minute`, or None."""
+        owner = self._current_by_minute[minute]
+        return self.entries[owner] if owner >= 0 else None
+
+    def next_after(self, minute):
+        """Returns the first entry starting at or after `minute`, wrapping to the first of the day."""
+        pos = self._next_by_minute[minute]
+        return self.sorted_entries[pos] if pos >= 0 else None
+
+    def next_transition(self, minute):
+        """
+        Returns the minute (after `minute`) at which the current entry next changes; values of
+        MINUTES_PER_DAY or more fall on the following day. None if the routine never changes.
+        """
+        if not self.transitions:
+            return None
+        pos = bisect_right(self.transitions, minute)
+        return self.transitions[pos] if pos < len(self.transitions) else self.transitions[0] + MINUTES_PER_DAY
+
+
+# One RoutineStore (snapshot + journal) per routine file path
+_ROUTINE_STORES = {}
+
+def get_routine_store():
+    path = routine_file_path()
+    store = _ROUTINE_STORES.get(path)
+    if store is None:
+        # Two first requests for the same user must end up sharing one store
+        with _routine_lock(path):
+            store = _ROUTINE_STORES.get(path)
+            if store is None:
+                store = routine_store.RoutineStore(path, sort_key=lambda x: to_minutes(x['start']),
+                                                   compact_every=ROUTINE_COMPACT_EVERY, lock=_routine_lock(path))
+                _ROUTINE_STORES[path] = store
+    return store
+
+# Cache of {path: (routine document, RoutineIndex)}; the document identity comes from
+# the RoutineStore, so the index is only rebuilt when the routine was re-read or edited.
+_ROUTINE_INDEX_CACHE = {}
+
+# One SqliteRoutineStore per database path (ROUTINE_BACKEND = "sqlite")
+_ROUTINE_DBS = {}
+
+def get_routine_db():
+    path = routine_db_path()
+    db = _ROUTINE_DBS.get(path)
+    if db is None:
+        with _routine_lock(routine_file_path()):
+            db = _ROUTINE_DBS.get(path)
+            if db is None:
+                db = routine_store.SqliteRoutineStore(path, to_minutes)
+                if not db and os.path.exists(routine_file_path()):
+                    db.import_entries(get_routine_store().load())
+                _ROUTINE_DBS[path] = db
+    return db
+
+def load_routine_index():
+    """
+    Returns the RoutineIndex for the current user's routine, rebuilding it only when the routine changed.
+    With the SQLite backend the database itself answers the same queries.
+    """
+    if ROUTINE_BACKEND == "sqlite":
+        return get_routine_db()
+    path = routine_file_path()
+    # Under the file's lock, so a reader (tool pool, reminder thread, server worker) never
+    # caches an index older than an edit committed at the same time
+    with _routine_lock(path):
+        routine = get_routine_store().load()
+        cached = _ROUTINE_INDEX_CACHE.get(path)
+        if cached and cached[0] is routine:
+            return cached[1]
+
+        index = RoutineIndex(routine)
+        _ROUTINE_INDEX_CACHE[path] = (routine, index)
+        if cached:  # changed on disk since the last read
+            _publish_routine_change(index)
+        return index
+
+class RoutineSaveError(Exception):
+    """A routine edit could not be written to disk, so it was not applied."""
+
+
+def save_routine(routine, ops=None, index=None):
+    """
+    Persists the routine and refreshes the cached index (`index` if the caller already has it).
+    With `ops` (the batch that produced it) only the batch is journaled; without, a full snapshot is written.
+    Returns False if the write failed.
+    """
+    path = routine_file_path()
+    store = get_routine_store()
+    try:
+        if ops is None:
+            store.write_snapshot(routine)
+        else:
+            store.append(ops, routine)
+    except OSError as e:
+        _ROUTINE_INDEX_CACHE.pop(path, None)
+        _ROUTINE_STORES.pop(path, None)
+        print(f"Error saving routine: {e}")
+        return False
+    _ROUTINE_INDEX_CACHE[path] = (routine, index or RoutineIndex(routine))
+    return True
+
+class RoutineTransaction:
+    """
+    Edits applied to a copy of the cached RoutineIndex and journaled as one batch on commit.
+    The copy is updated incrementally (see RoutineIndex.add), and becomes the cached index once saved.
+    """
+
+    def __init__(self, index):
+        self.index = index.copy()
+        self.ops = []
+
+    def add(self, entry):
+        self.index.add(entry)
+        self.ops.append({"op": "add", "entry": entry})
+
+    def remove_matching(self, activity_keyword):
+        removed_count = self.index.remove_matching(activity_keyword)
+        if removed_count:
+            self.ops.append({"op": "remove", "keyword": activity_keyword})
+        return removed_count
+
+    def commit(self):
+        """Journals the batch; returns False if it could not be written."""
+        if not self.ops:
+            return True
+        return save_routine(self.index.entries, self.ops, self.index)
+
+    def rollback(self):
+        # Nothing was written yet; the batch is simply dropped
+        self.ops = []
+
+    @property
+    def changed(self):
+        return bool(self.ops)
+
+
+# One lock and at most one open transaction per routine file, so users never wait on each other
+_ROUTINE_LOCKS = {}
+_ROUTINE_LOCKS_GUARD = threading.Lock()
+_ROUTINE_TRANSACTIONS = {}
+
+def _routine_lock(path):
+    with _ROUTINE_LOCKS_GUARD:
+        return _ROUTINE_LOCKS.setdefault(path, threading.RLock())
+
+@contextmanager
+def routine_transaction():
+    """
+    Groups routine edits into one journal append, applied incrementally to the cached index.
+    Nested use joins the outer transaction; the write happens when the outermost one exits,
+    and raises RoutineSaveError (nothing is applied) if it fails.
+    """
+    path = routine_file_path()
+    with _routine_lock(path):
+        if path in _ROUTINE_TRANSACTIONS:
+            yield _ROUTINE_TRANSACTIONS[path]
+            return
+        if ROUTINE_BACKEND == "sqlite":
+            transaction = get_routine_db().begin()
+        else:
+            transaction = RoutineTransaction(load_routine_index())
+        _ROUTINE_TRANSACTIONS[path] = transaction
+        try:
+            yield transaction
+        except BaseException:
+            transaction.rollback()
+            raise
+        else:
+            if not transaction.commit():
+                raise RoutineSaveError(f"Could not save {path}; the edits were dropped.")
+            if transaction.changed:
+                _publish_routine_change(transaction.store if ROUTINE_BACKEND == "sqlite" else transaction.index)
+        finally:
+            del _ROUTINE_TRANSACTIONS[path]
+
+
+# Callbacks notified with the new index whenever the routine changes (see on_routine_change)
+_ROUTINE_LISTENERS = []
+
+def on_routine_change(callback):
+    """
+    Registers callback(index), called after every committed edit and when an edit made on disk is
+    noticed. A scheduler sleeping until next_routine_transition() should recompute its wake-up time.
+    """
+    _ROUTINE_LISTENERS.append(callback)
+    return callback
+
+def _publish_routine_change(index):
+    for callback in list(_ROUTINE_LISTENERS):
+        try:
+            callback(index)
+        except Exception as e:
+            print(f"Routine change listener failed: {e}")
+
+def next_routine_transition(now=None):
+    """
+    Returns the datetime at which the current task next changes (a task starts or ends),
+    so a scheduler can sleep until then instead of polling. None if the routine never changes.
+    """
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    transition = load_routine_index().next_transition(minute)
+    if transition is None:
+        return None
+    return now.replace(second=0, microsecond=0) + timedelta(minutes=transition - minute)
+
+def start_reminders():
+    """Starts the reminder scheduler on first use and keeps it in step with routine edits."""
+    global REMINDER_SCHEDULER
+    if REMINDER_SCHEDULER is None:
+        scheduler = reminders.ReminderScheduler(lambda text: speak(text), to_minutes, refresh=load_routine_index)
+        scheduler.update(load_routine_index().sorted_entries)
+        path = routine_file_path()
+
+        @on_routine_change
+        def reschedule(index):
+            if routine_file_path() == path:  # in server mode other users' edits are published too
+                scheduler.update(index.sorted_entries)
+
+        REMINDER_SCHEDULER = scheduler.start()
+    return REMINDER_SCHEDULER
+
 def get_routine():
-    routine = load_json(ROUTINE_FILE_PATH, [])
-    if not routine:
+    index = load_routine_index()
+    if not index:
         return "You have not set your daily routine yet."
     
-    routine.sort(key=lambda x: parse_time(x['start']))
-    return json.dumps(routine)
+    return json.dumps(index.sorted_entries)
 
 def get_task_by_time(query_time=None):
-    routine = load_json(ROUTINE_FILE_PATH, [])
-    if not routine:
+    index = load_routine_index()
+    if not index:
         return json.dumps({"status": "error", "message": "No daily routine is set."})
     
     # 1. Use current system time if not specified
     if query_time is None:
         now_dt = datetime.now()
         query_time = now_dt.strftime('%H:%M')
+        query_minute = now_dt.hour * 60 + now_dt.minute
     else:
         # Validate time format
         try:
             # Clean query time for validation (LLM sometimes adds extra characters)
             clean_query_time = re.sub(r'[^0-9:]', '', query_time).strip()
             datetime.strptime(clean_query_time, '%H:%M')
-            now_dt = datetime.combine(datetime.today().date(), parse_time(clean_query_time))
+            query_minute = to_minutes(clean_query_time)
             query_time = clean_query_time
         except ValueError:
             return json.dumps({"status": "error", "message": "Invalid time format. Please use HH:MM."})
 
-    qt = now_dt.time()
-    
-    #  Check for task in progress (current task)
-    for slot in routine:
-        start = parse_time(slot['start'])
-        end = parse_time(slot['end'])
-        
-        if start < end:
-            in_range = start <= qt < end
-        else:  # wraps over midnight
-            in_range = qt >= start or qt < end
-            
-        if in_range:
-            return json.dumps({"status": "found", "time": query_time, "start": slot['start'], "end": slot['end'], "activity": slot['activity']})
+    # 2. Check for task in progress (current task)
+    slot = index.current(query_minute)
+    if slot:
+        return json.dumps({"status": "found", "time": query_time, "start": slot['start'], "end": slot['end'], "activity": slot['activity']})
             
-    # 3. Check for the next upcoming task
-    routine.sort(key=lambda x: parse_time(x['start']))
-    
-    next_task = None
-    
-    # Find the next task in the future (after the current time)
-    for slot in routine:
-        start_time = parse_time(slot['start'])
-        if start_time >= qt: 
-            next_task = slot
-            break
-    
+    # 3. Check for the next upcoming task (wraps around to the first task of the day)
+    next_task = index.next_after(query_minute)
     if next_task:
         return json.dumps({"status": "next_found", "time": query_time, "start": next_task['start'], "end": next_task['end'], "activity": next_task['activity']})
-        
-    # 4. Add wrap-around logic to find the next task (first task of the day)
-    if routine:
-        wrap_around_task = routine[0]
-        return json.dumps({"status": "next_found", "time": query_time, "start": wrap_around_task['start'], "end": wrap_around_task['end'], "activity": wrap_around_task['activity']})
     
     return json.dumps({"status": "not_found", "time": query_time, "message": "No activity found for the current or upcoming time."})
 
 
 def add_routine_entry(start, end, activity):
     """Adds a new routine entry if start/end times are valid (HH:MM)."""
-    routine = load_json(ROUTINE_FILE_PATH, [])
-    
     try:
         # Clean inputs before parsing
         clean_start = re.sub(r'[^0-9:]', '', start).strip()
@@ -361,25 +1191,23 @@ def add_routine_entry(start, end, activity):
         "end": clean_end,
         "activity": activity.strip()
     }
-    routine.append(new_entry)
-    routine.sort(key=lambda x: parse_time(x['start']))
-    save_json(ROUTINE_FILE_PATH, routine)
+    try:
+        with routine_transaction() as txn:
+            txn.add(new_entry)
+    except RoutineSaveError as e:
+        return json.dumps({"status": "error", "message": str(e)})
     
-    return json.dumps({"status": "success", "message": f"Added {activity} from {clean_start} to {clean_end}."})
+    return json.dumps({"status": "success", "message": f"Added {activity} from {clean_start} to {clean_end}.", **new_entry})
 
 def remove_routine_entry(activity_keyword):
     """Removes a routine entry based on a partial match of the activity name."""
-    routine = load_json(ROUTINE_FILE_PATH, [])
-    initial_count = len(routine)
-    
-    new_routine = [
-        entry for entry in routine 
-        if activity_keyword.lower() not in entry['activity'].lower()
-    ]
+    try:
+        with routine_transaction() as txn:
+            removed_count = txn.remove_matching(activity_keyword)
+    except RoutineSaveError as e:
+        return json.dumps({"status": "error", "message": str(e)})
     
-    if len(new_routine) < initial_count:
-        removed_count = initial_count - len(new_routine)
-        save_json(ROUTINE_FILE_PATH, new_routine)
+    if removed_count:
         return json.dumps({"status": "success", "removed_count": removed_count, "keyword": activity_keyword})
     else:
         return json.dumps({"status": "not_found", "keyword": activity_keyword})
@@ -402,8 +1230,9 @@ def set_favorite_color(color):
 
 def tell_joke():
     """Tells a joke using the local pyjokes library."""
-    if pyjokes is not None: 
+    if pyjokes_available(): 
         try:
+            import pyjokes
             return pyjokes.get_joke()
         except Exception as e:
             print(f"Error fetching joke from pyjokes: {e}")
@@ -421,8 +1250,8 @@ def tell_story(topic=""):
 
 def get_weather(city, api_key):
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric"
-        r = requests.get(url)
+        url = "http://api.openweathermap.org/data/2.5/weather"
+        r = http_client.get(url, params={"q": city, "appid": api_key, "units": "metric"})
         if r.status_code == 200:
             data = r.json()
             temp = data["main"]["temp"]
@@ -443,240 +1272,391 @@ TOOL_MAPPER = {
     "remove_routine_entry": remove_routine_entry,
 }
 
+# Routine edits change the file; everything else only reads it
+MUTATING_TOOLS = {"add_routine_entry", "remove_routine_entry"}
+TOOL_EXECUTOR = ToolExecutor(TOOL_MAPPER, mutating=MUTATING_TOOLS, transaction=routine_transaction)
+# The shape OLLAMA_TOOL_MODEL has to answer in: only known tools, with their exact arguments
+TOOL_CALL_SCHEMA = tool_call_schema(TOOL_MAPPER, time_arguments=("start", "end", "query_time"))
+
 # ========== Main Loop with Manual Tool Execution Logic ==========
 
-def main():
+# Routes control phrases and confidently-recognised routine queries without an LLM call
+INTENT_ROUTER = IntentRouter()
+
+def handle_control_command(query):
+    """
+    Handles mode switching and exit phrases.
+    Returns (reply, should_exit), or (None, False) if the query is not a control command.
+    """
     global CURRENT_MODE
 
-    # NOTE: You must replace this with your actual OpenWeatherMap API key
-    WEATHER_API_KEY = "YOUR_OPENWEATHERMAP_API_KEY"
-    
-    speak("Hello! I'm Ishu.")
-    select_initial_mode()
-    speak(f"Starting in {'Speech' if CURRENT_MODE == 'S' else 'Written'} mode. Say or type 'change mode' to switch.", blocking=True)
+    command = INTENT_ROUTER.control_command(query)
+    if command == "change_mode":
+        new_mode = 'W' if CURRENT_MODE == 'S' else 'S'
+        CURRENT_MODE = new_mode
+        return f"Mode switched to {'Speech' if CURRENT_MODE == 'S' else 'Written'} mode.", False
+    elif command == "thanks":
+        return "Mention not! Have a great day!", True
+    elif command == "exit":
+        return "Goodbye! Have a great day!", True
+    return None, False
 
-    chat_history = [
-        {"role": "system", "content": OLLAMA_SYSTEM_PROMPT},
-    ]
 
+def local_tool_reply(query):
+    """
+    Answers routine questions locally, bypassing Ollama.
+    Returns the reply text, or None if the query should go to the LLM.
+    """
+    # --- Local Query Interception (NOW/NEXT/AT Distinction) ---
+    # The routine is only searched if the router recognised a removal
+    intent = INTENT_ROUTER.route(query, find_activities=lambda keyword, limit:
+                                 load_routine_index().matching_activities(keyword, limit))
+    if intent is None:
+        return None
+
+    tool_to_call = intent.tool
+    TRACER.count("tool_calls", tool=tool_to_call, source="local")
+    is_next_task_query = intent.name == "task_next" # This will trigger the dual-task response
+
+    # Execute the function locally and bypass Ollama.
+    print(f"Executing Local Tool: {tool_to_call}({', '.join(f'{k}={v!r}' for k, v in intent.arguments.items())})")
     
-    while True:
+    # --- Local Output Handling ---
+    try:
+        output = ""
         
-        query = ""
-        if CURRENT_MODE == 'S':
-            speak("Listening...", blocking=True)
-            query = listen_whisper().lower()
-            if not query:
-                speak("Sorry, I didn't catch that. Can you repeat?", blocking=True)
-                continue
-        else: # CURRENT_MODE == 'W'
-            query = listen_written()
+        # 1. Handle get_routine()
+        if tool_to_call == "get_routine":
+            response_json_string = get_routine()
+            
+            if response_json_string.startswith('['):
+                task_list = json.loads(response_json_string)
+                # Format for clear console output
+                header = "| Start | End | Activity |\n|---|---|---|"
+                output_list = [f"| {t['start']} | {t['end']} | {t['activity']} |" for t in task_list]
+                output = f"## Your Full Daily Routine 🗓️\n{header}\n" + "\n".join(output_list)
+            else:
+                output = response_json_string 
         
-        print(f"User said: {query}")
+        # 2. Handle get_task_by_time() for an explicit time ("what am I doing at 11:30")
+        elif intent.name == "task_at":
+            task_data = json.loads(get_task_by_time(**intent.arguments))
+            asked_time = intent.arguments["query_time"]
 
-        # --- COMMAND HANDLING LOGIC ---
-        
-        if "change mode" in query:
-            new_mode = 'W' if CURRENT_MODE == 'S' else 'S'
-            CURRENT_MODE = new_mode
-            speak(f"Mode switched to {'Speech' if CURRENT_MODE == 'S' else 'Written'} mode.", blocking=True)
-            continue
-       
-        elif "thank you" in query:
-            speak("Mention not! Have a great day!", blocking=True)
-            break
-        elif "exit" in query or "quit" in query or "goodbye" in query or "stop listening" in query:
-            speak("Goodbye! Have a great day!", blocking=True)
-            break
-
-        # --- Local Query Interception (NOW/NEXT Distinction) ---
-        user_input_lower = query.lower()
-        
-        # Define phrases for NOW (simple current task)
-        time_query_now = [
-            "what should i do now", 
-            "what is my current task"
-        ]
-        
-        # Define phrases for NEXT (current task + next task)
-        time_query_next = [
-            "what should i do next",
-            "what's my next task",
-            "what is my next task"
-        ]
-        
-        routine_query_phrases = ["what is my routine", "show my routine", "daily schedule"]
-        
-        is_local_tool_query = False
-        tool_to_call = None
-        is_next_task_query = False 
-        
-        if any(phrase in user_input_lower for phrase in routine_query_phrases):
-            is_local_tool_query = True
-            tool_to_call = "get_routine"
-        elif any(phrase in user_input_lower for phrase in time_query_next):
-            is_local_tool_query = True
-            tool_to_call = "get_task_by_time"
-            is_next_task_query = True # This will trigger the dual-task response
-        elif any(phrase in user_input_lower for phrase in time_query_now):
-            is_local_tool_query = True
-            tool_to_call = "get_task_by_time"
-
-        if is_local_tool_query:
-            # Execute the function locally and bypass Ollama.
-            print(f"Executing Local Tool: {tool_to_call}()")
+            if task_data.get("status") == "found":
+                output = f"At {asked_time} you are scheduled for **{task_data['activity']}** ({task_data['start']} to {task_data['end']})."
+            elif task_data.get("status") == "next_found":
+                output = f"Nothing is scheduled at {asked_time}. Your next activity after that is **{task_data['activity']}** starting at {task_data['start']}."
+            else:
+                output = task_data.get("message", "No scheduled activity found for that time.")
+
+        # 3. Handle get_task_by_time() for now/next
+        elif tool_to_call == "get_task_by_time":
             
-            # --- Local Output Handling ---
-            try:
-                output = ""
-                
-                # 1. Handle get_routine()
-                if tool_to_call == "get_routine":
-                    response_json_string = get_routine()
-                    
-                    if response_json_string.startswith('['):
-                        task_list = json.loads(response_json_string)
-                        # Format for clear console output
-                        header = "| Start | End | Activity |\n|---|---|---|"
-                        output_list = [f"| {t['start']} | {t['end']} | {t['activity']} |" for t in task_list]
-                        output = f"## Your Full Daily Routine 🗓️\n{header}\n" + "\n".join(output_list)
-                    else:
-                        output = response_json_string 
+            # First call to find the current/next task based on current time
+            response_json_string = get_task_by_time() 
+            task_data = json.loads(response_json_string)
+            output = ""
+            
+            if task_data.get("status") == "found":
+                current_activity = task_data.get('activity')
+                current_end_time = task_data.get('end')
                 
-                # 2. Handle get_task_by_time()
-                elif tool_to_call == "get_task_by_time":
+                # --- LOGIC FOR "WHAT SHOULD I DO NEXT" ---
+                if is_next_task_query:
+                    # Search for the next one using the current task's end time
+                    next_task_json_string = get_task_by_time(query_time=current_end_time) 
+                    next_task_data = json.loads(next_task_json_string)
                     
-                    # First call to find the current/next task based on current time
-                    response_json_string = get_task_by_time() 
-                    task_data = json.loads(response_json_string)
-                    output = ""
-                    
-                    if task_data.get("status") == "found":
-                        current_activity = task_data.get('activity')
-                        current_end_time = task_data.get('end')
-                        
-                        # --- LOGIC FOR "WHAT SHOULD I DO NEXT" ---
-                        if is_next_task_query:
-                            # Search for the next one using the current task's end time
-                            next_task_json_string = get_task_by_time(query_time=current_end_time) 
-                            next_task_data = json.loads(next_task_json_string)
-                            
-                            if next_task_data.get("status") in ["found", "next_found"]:
-                                next_activity = next_task_data.get('activity')
-                                next_start_time = next_task_data.get('start')
-                                
-                                output = (
-                                    f"Your current task is **{current_activity}** (Ends at {current_end_time}). "
-                                    f"Your *next* scheduled task is **{next_activity}** starting at {next_start_time}."
-                                )
-                            else:
-                                output = f"You are currently doing **{current_activity}** (Ends at {current_end_time}). There is no further scheduled task after this."
-                        
-                        # LOGIC for "WHAT SHOULD I DO NOW"
-                        else: 
-                            output = f"Right now, you should be doing: **{current_activity}** (Ends at {current_end_time})."
+                    if next_task_data.get("status") in ["found", "next_found"]:
+                        next_activity = next_task_data.get('activity')
+                        next_start_time = next_task_data.get('start')
                         
-                    elif task_data.get("status") == "next_found":
-                        # If no task is found, but the next one is found (user is free)
-                        output = f"You are currently free! Your next scheduled activity is **{task_data.get('activity')}** starting at {task_data.get('start')}."
-                    
+                        output = (
+                            f"Your current task is **{current_activity}** (Ends at {current_end_time}). "
+                            f"Your *next* scheduled task is **{next_activity}** starting at {next_start_time}."
+                        )
                     else:
-                        output = "No scheduled activity found for the current or upcoming time. Enjoy the free time!"
-                
-                speak(output, blocking=False)
-                print(f"Ishu says: {output}")
+                        output = f"You are currently doing **{current_activity}** (Ends at {current_end_time}). There is no further scheduled task after this."
                 
-                continue 
+                # LOGIC for "WHAT SHOULD I DO NOW"
+                else: 
+                    output = f"Right now, you should be doing: **{current_activity}** (Ends at {current_end_time})."
                 
-            except json.JSONDecodeError:
-                print(f"Error processing local tool output for {tool_to_call}. Falling through to Ollama.")
-                pass 
-            # --- End of Local Output Handling ---
+            elif task_data.get("status") == "next_found":
+                # If no task is found, but the next one is found (user is free)
+                output = f"You are currently free! Your next scheduled activity is **{task_data.get('activity')}** starting at {task_data.get('start')}."
             
-        # --- End of Local Query Interception ---
+            else:
+                output = "No scheduled activity found for the current or upcoming time. Enjoy the free time!"
+
+        # 4. Handle add_routine_entry()
+        elif tool_to_call == "add_routine_entry":
+            result = add_routine_entry(**intent.arguments)
+            if result.startswith("ERROR"):
+                return None # Let the LLM sort out what the user meant
+            output = f"Done! {json.loads(result)['message']}"
+
+        # 5. Handle remove_routine_entry()
+        elif tool_to_call == "remove_routine_entry":
+            result = json.loads(remove_routine_entry(**intent.arguments))
+            keyword = intent.arguments["activity_keyword"]
+            if result.get("status") == "success":
+                count = result["removed_count"]
+                output = f"Removed {count} routine {'entry' if count == 1 else 'entries'} matching '{keyword}'."
+            else:
+                output = f"I couldn't find anything matching '{keyword}' in your routine."
         
-        # *** Default Command to Ollama LLM (Manual Tool Execution) ***
-        else:
-            # 1. Start the conversation with the user's query
-            # CRITICAL: Always append the current query to history for the LLM's first pass
-            current_messages = chat_history + [{"role": "user", "content": query}]
-            response_message = ollama_response(query, history=current_messages)
-            
-            response_content = response_message.get("content", "")
-            
-            # 2. Add the LLM's initial response to history
-            chat_history.append(response_message)
+        return output
+        
+    except json.JSONDecodeError:
+        print(f"Error processing local tool output for {tool_to_call}. Falling through to Ollama.")
+        return None
+    # --- End of Local Output Handling ---
+
+
+# How the reply after a tool call is written, per tool: "template" phrases the known outputs locally
+# (no second LLM round trip), "llm" asks the model to summarise. Unlisted tools, errors and
+# unexpected outputs always go to the LLM.
+TOOL_SUMMARY_MODES = {
+    "add_routine_entry": "template",
+    "remove_routine_entry": "template",
+    "get_task_by_time": "template",
+    "get_routine": "template",
+}
+TOOL_SUMMARIES = ToolSummaries(TOOL_SUMMARY_MODES)
+
+TOOL_SUMMARY_PROMPT = "Based ONLY on the tool results in the last messages, summarize the actions taken (added/removed tasks) and answer the user's original query in a friendly, conversational way."
+# The summary should only restate tool results, so it is generated greedily (and is cacheable)
+TOOL_SUMMARY_OPTIONS = {"temperature": 0}
+
+
+def new_chat_history():
+    """Creates the bounded chat history used for one conversation session."""
+    return ChatHistory(OLLAMA_SYSTEM_PROMPT, max_tokens=HISTORY_TOKEN_BUDGET, summary_tokens=HISTORY_SUMMARY_TOKENS)
+
+
+def respond(query, chat_history, on_sentence=None, cancel_event=None):
+    """
+    Produces Ishu's reply to one user query: local routine interception first, then the
+    LLM with manual tool execution. Returns the text that still has to be spoken; sentences
+    already streamed to `on_sentence` are not repeated. Setting `cancel_event` (barge-in)
+    stops generation and skips any remaining steps.
+    """
+    with TRACER.span("respond"):
+        return _respond(query, chat_history, on_sentence, cancel_event)
+
+
+def select_tools(query, chat_history, cancel_event=None):
+    """
+    Asks OLLAMA_TOOL_MODEL which tools answer the query. Its reply is constrained to
+    TOOL_CALL_SCHEMA; returns the validated calls ([] when no tool is needed), or None
+    if the model failed and the persona model should handle the turn as before.
+    """
+    recent = [m for m in chat_history.as_messages() if m.get("role") != "system"][-TOOL_MODEL_CONTEXT_MESSAGES:]
+    messages = [{"role": "system", "content": TOOL_MODEL_PROMPT}] + recent + [{"role": "user", "content": query}]
+    with TRACER.span("llm.tool_selection"):
+        message = ollama_response(query, history=messages, options=OLLAMA_TOOL_OPTIONS, cancel_event=cancel_event,
+                                  model=OLLAMA_TOOL_MODEL, format=TOOL_CALL_SCHEMA)
+    try:
+        return validate_tool_calls(json.loads(message.get("content") or ""), TOOL_MAPPER)
+    except ValueError as e:  # includes JSONDecodeError (error replies are plain text)
+        print(f"Tool model reply rejected: {e}")
+        TRACER.count("tool_selection_fallbacks")
+        return None
+
+
+def _respond(query, chat_history, on_sentence, cancel_event):
+    with TRACER.span("local_reply"):
+        output = local_tool_reply(query)
+    if output is not None:
+        return output
+    # --- End of Local Query Interception ---
+
+    # Routine requests the router could not answer go to the small tool model; one call picks the
+    # tools, the results are phrased from templates, and the persona model is not needed at all
+    if OLLAMA_TOOL_MODEL and INTENT_ROUTER.mentions_routine(query):
+        calls = select_tools(query, chat_history, cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            return ""
+        if calls:
+            chat_history.append({"role": "user", "content": query})
+            # Recorded in the persona model's own tool-call format, so later turns read naturally
+            for call in calls:
+                chat_history.append({"role": "assistant", "content": json.dumps({"tool_call": call})})
+            with TRACER.span("tools.wait"):
+                tool_results = TOOL_EXECUTOR.run(calls)
+            for result in tool_results:
+                TRACER.record(f"tool.{result['name']}", result["seconds"])
+                TRACER.count("tool_calls", tool=result["name"], source="tool_model")
+            return _answer_tool_results(tool_results, chat_history, on_sentence, cancel_event)
+
+    # *** Default Command to Ollama LLM (Manual Tool Execution) ***
+    # 1. Start the conversation with the user's query
+    # CRITICAL: Always append the current query to history for the LLM's first pass.
+    # History is append-only (system prompt first, every message kept in order), so each
+    # request extends the previous one and Ollama can reuse its KV cache for the prefix.
+    # It is recorded once the model has taken the turn: a turn refused by the admission gate
+    # (admission.Overloaded) must not leave an unanswered message in the session.
+    user_message = {"role": "user", "content": query}
+    current_messages = chat_history.as_messages() + [user_message]
+
+    # In streaming mode each finished sentence is handed over while the LLM keeps generating
+    streamed_sentences = []
+    def stream_sentence(sentence):
+        streamed_sentences.append(sentence)
+        if on_sentence:
+            on_sentence(sentence)
+
+    # Tool calls start executing as soon as their JSON is complete, while the reply is still streaming
+    tool_run = TOOL_EXECUTOR.start()
+    try:
+        with TRACER.span("llm.first_pass"):
+            response_message = ollama_response(query, history=current_messages, stream=OLLAMA_STREAM and on_sentence is not None,
+                                               on_sentence=stream_sentence, cancel_event=cancel_event,
+                                               on_tool_call=tool_run.submit)
+    finally:
+        with TRACER.span("tools.wait"):
+            tool_results = tool_run.finish()
+    chat_history.append(user_message)
+    for result in tool_results:
+        TRACER.record(f"tool.{result['name']}", result["seconds"])
+        TRACER.count("tool_calls", tool=result["name"], source="llm")
+    if cancel_event is not None and cancel_event.is_set():
+        return ""
+    
+    response_content = response_message.get("content", "")
+    
+    # 2. Add the LLM's initial response to history
+    chat_history.append(response_message)
+
+    if tool_results:
+        return _answer_tool_results(tool_results, chat_history, on_sentence, cancel_event)
+
+    # 6. Handle standard LLM conversation (No tool call returned)
+    if response_content:
+        # LLM spoke directly (joke, story, general question). Just speak the content.
+        return "" if streamed_sentences else response_content
+    else:
+        return "I received an empty response from the LLM. Please check your Ollama configuration or model."
+
+
+def _answer_tool_results(tool_results, chat_history, on_sentence, cancel_event):
+    """Records the tool results in the history and returns the reply that reports them."""
+    streamed_sentences = []
+    def stream_sentence(sentence):
+        streamed_sentences.append(sentence)
+        if on_sentence:
+            on_sentence(sentence)
+
+    # --- Multi-Tool Execution (batched mutations, concurrent reads) ---
+    print(f"Executed {len(tool_results)} tool call(s): {', '.join(str(r['name']) for r in tool_results)}")
+    executed_tools_summary = []
+    
+    for i, result in enumerate(tool_results):
+        func_name = result["name"]
+        
+        if result["output"] is not None:
+            if result["error"]:
+                executed_tools_summary.append(f"Tool {i+1} ({func_name}) FAILED.")
+            else:
+                executed_tools_summary.append(f"Tool {i+1} ({func_name}) Success: {result['output'][:50]}...")
             
-            tool_calls = []
+            # Add the Tool's output (as a function result) to history
+            chat_history.append({
+                "role": "tool",
+                "content": result["output"],
+            })
+        else:
+            executed_tools_summary.append(f"Tool {i+1} FAILED: {result['error']}")
             
-            # --- Robust Multi-Tool JSON Parsing ---
-            # Use regex to find all JSON blocks (handling chatty and batched responses)
-            json_matches = re.findall(r'(\s*\{.*?\}\s*)', response_content, re.DOTALL)
+    # 3. Known tool outputs are phrased locally, so the common case needs no second LLM call
+    summary = TOOL_SUMMARIES.render(tool_results)
+    TRACER.count("tool_summaries", source="template" if summary is not None else "llm")
+    if summary is not None:
+        chat_history.append({"role": "assistant", "content": summary})
+        return summary
+
+    # 4. Otherwise: Final Call to LLM for Conversational Summary
+    print(f"--- Execution Complete. Calling LLM for final answer. ---")
+    
+    # Use a specific, strong prompt for the final answer. It is recorded in the history
+    # (rather than sent on a filtered copy) so the prompt prefix stays identical and cacheable;
+    # the system prompt already tells the model to answer directly when given tool results.
+    summary_prompt = {"role": "user", "content": TOOL_SUMMARY_PROMPT}
+
+    with TRACER.span("llm.summary"):
+        final_response_message = ollama_response(
+            TOOL_SUMMARY_PROMPT, 
+            history=chat_history.as_messages() + [summary_prompt],
+            options=TOOL_SUMMARY_OPTIONS,
+            stream=OLLAMA_STREAM and on_sentence is not None,
+            on_sentence=stream_sentence,
+            cancel_event=cancel_event,
+        )
+    chat_history.append(summary_prompt)
+    if cancel_event is not None and cancel_event.is_set():
+        return ""
+    
+    # 5. Add final LLM response to history
+    chat_history.append(final_response_message)
+    # We ONLY speak the final, cleaned-up response from the LLM.
+    return "" if streamed_sentences else final_response_message["content"]
+
+
+def main():
+    global CURRENT_MODE
+
+    # NOTE: You must replace this with your actual OpenWeatherMap API key
+    WEATHER_API_KEY = "YOUR_OPENWEATHERMAP_API_KEY"
+    
+    # Load Whisper and the LLM while the greeting plays and the user picks a mode
+    preload_whisper()
+    start_ollama_warmup()
+    if ANNOUNCE_ROUTINE:
+        start_reminders()
+    speak("Hello! I'm Ishu.")
+    select_initial_mode()
+    speak(f"Starting in {'Speech' if CURRENT_MODE == 'S' else 'Written'} mode. Say or type 'change mode' to switch.", blocking=True)
+
+    chat_history = new_chat_history()
+
+    def speak_sentence(sentence):
+        # Queued, not awaited: the next tokens are read while this sentence is being spoken
+        speak(sentence, echo=False)
+    
+    while True:
+        # One traced turn per iteration: listen -> (control command | respond) -> speak
+        with TRACER.turn() as turn:
+            query = ""
+            with TRACER.span("listen"):
+                if CURRENT_MODE == 'S':
+                    speak("Listening...", blocking=True)
+                    query = listen_whisper().lower()
+                else: # CURRENT_MODE == 'W'
+                    query = listen_written()
+            if CURRENT_MODE == 'S' and not query:
+                speak("Sorry, I didn't catch that. Can you repeat?", blocking=True)
+                continue
             
-            for match in json_matches:
-                try:
-                    parsed_json = json.loads(match.strip())
-                    if "tool_call" in parsed_json:
-                        tool_calls.append(parsed_json["tool_call"])
-                except json.JSONDecodeError:
-                    # Ignore invalid JSON blocks
-                    pass
-
-            if tool_calls:
-                # --- Multi-Tool Execution Loop ---
-                executed_tools_summary = []
-                
-                for i, tool_call in enumerate(tool_calls):
-                    func_name = tool_call.get("name")
-                    func_args = tool_call.get("arguments", {})
-                    
-                    if func_name in TOOL_MAPPER:
-                        print(f"Executing Tool {i+1}/{len(tool_calls)}: {func_name} with args: {func_args}")
-                        
-                        try:
-                            if func_args is None:
-                                func_args = {}
-                                
-                            tool_output = TOOL_MAPPER[func_name](**func_args)
-                            executed_tools_summary.append(f"Tool {i+1} ({func_name}) Success: {tool_output[:50]}...")
-                        except Exception as e:
-                            tool_output = f"ERROR executing {func_name}: {e}"
-                            executed_tools_summary.append(f"Tool {i+1} ({func_name}) FAILED.")
-                        
-                        # Add the Tool's output (as a function result) to history
-                        # We temporarily add the SYSTEM prompt here to reinforce tool use discipline
-                        chat_history.append({"role": "system", "content": OLLAMA_SYSTEM_PROMPT})
-                        chat_history.append({
-                            "role": "tool",
-                            "content": tool_output,
-                        })
-                    else:
-                        executed_tools_summary.append(f"Tool {i+1} FAILED: Tool '{func_name}' is not implemented.")
-                        
-                # 3. Final Call to LLM for Conversational Summary
-                print(f"--- Execution Complete. Calling LLM for final answer. ---")
-                
-                # --- CRITICAL FIX: Clean the history before the final call ---
-                # Remove the strict SYSTEM prompt to allow conversational mode
-                history_for_final_call = [msg for msg in chat_history if msg['role'] != 'system'] 
-
-                # Use a specific, strong prompt for the final answer
-                final_response_message = ollama_response(
-                    "Based ONLY on the tool results in the last messages, summarize the actions taken (added/removed tasks) and answer the user's original query in a friendly, conversational way.", 
-                    history=history_for_final_call # Use the cleaned history!
-                )
-                
-                # 4. Add final LLM response to history and speak
-                chat_history.append(final_response_message)
-                # We ONLY speak the final, cleaned-up response from the LLM.
-                speak(final_response_message["content"], blocking=True)
-
-            # 5. Handle standard LLM conversation (No tool call returned)
-            elif response_content:
-                # LLM spoke directly (joke, story, general question). Just speak the content.
-                speak(response_message["content"], blocking=True) 
+            turn.query = query
+            print(f"User said: {query}")
+
+            # --- COMMAND HANDLING LOGIC ---
+            reply, should_exit = handle_control_command(query)
+            if reply:
+                speak(reply, blocking=True)
+                if should_exit:
+                    if RESPONSE_CACHE is not None:
+                        print(f"Response cache: {RESPONSE_CACHE.stats()}")
+                    break
+                continue
+
+            reply = respond(query, chat_history, on_sentence=speak_sentence)
+            if reply:
+                speak(reply, blocking=True)
             else:
-                speak("I received an empty response from the LLM. Please check your Ollama configuration or model.", blocking=True)
+                wait_for_speech()  # the streamed sentences finish before the mic opens again
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    tracing.run(main, TRACER, tracing.parse_args(description="Ishu, a time-aware voice assistant."))
@@ -0,0 +1,6 @@
+"""
+Performance benchmarks for Ishu. Run from the repository root:
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --quick --compare bench.json
+"""
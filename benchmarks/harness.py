@@ -0,0 +1,65 @@
+"""
+Minimal timing harness: repeated perf_counter measurements summarised per call.
+"""
+import contextlib
+import io
+import statistics
+import time
+
+
+def measure(fn, repeat=20, setup=None, min_time=0.0):
+    """
+    Calls fn() `repeat` times (and keeps going until min_time seconds were spent) and
+    returns timing statistics in microseconds. `setup` runs before every call, untimed.
+    Console output of both is suppressed.
+    """
+    samples = []
+    with quiet():
+        started = time.perf_counter()
+        while len(samples) < repeat or time.perf_counter() - started < min_time:
+            if setup is not None:
+                setup()
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1e6)
+    return summarise(samples)
+
+
+def summarise(samples):
+    """Timing statistics for a list of per-call durations in microseconds."""
+    samples = sorted(samples)
+    return {
+        "calls": len(samples),
+        "min_us": samples[0],
+        "median_us": statistics.median(samples),
+        "mean_us": statistics.fmean(samples),
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """Swallows the assistant's console output while a benchmark runs."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class Results:
+    """Collects named results and renders them for the console."""
+
+    def __init__(self):
+        self.benchmarks = {}
+
+    def add(self, name, stats, **params):
+        self.benchmarks[name] = {**stats, **params}
+        print(f"{name:<55} median {stats['median_us']:>12.1f} us   p95 {stats['p95_us']:>12.1f} us")
+
+
+def compare(current, baseline, threshold=1.25):
+    """Returns (name, baseline median, current median) for benchmarks that got slower than threshold x."""
+    regressions = []
+    for name, stats in current.items():
+        before = baseline.get(name)
+        if before and stats["median_us"] > before["median_us"] * threshold:
+            regressions.append((name, before["median_us"], stats["median_us"]))
+    return regressions
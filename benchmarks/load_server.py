@@ -0,0 +1,163 @@
+"""
+Load test for server.py against the stub Ollama /api/chat.
+
+    python -m benchmarks.load_server [--sessions 200] [--turns 3] [--transport ws|http] [--llm-slots 4]
+
+Starts the stub and an IshuServer in this process, opens `sessions` concurrent
+sessions (each its own user), runs `turns` chat turns on each, and reports the
+turn latency percentiles, throughput and how many turns were refused as busy.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import assistant
+import server
+from benchmarks.harness import quiet
+from benchmarks.stub_ollama import StubOllama
+
+CHAT_MESSAGE = "Tell me something encouraging about studying."
+
+
+# ========== Minimal clients ==========
+
+async def http_request(reader, writer, method, path, payload=None, token=None):
+    """One keep-alive request; returns (status, JSON reply)."""
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    auth = f"Authorization: Bearer {token}\r\n" if token else ""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: ishu\r\nContent-Type: application/json\r\n{auth}"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def ws_connect(host, port, user_id, token=None):
+    """Opens /ws/<user>; returns (reader, writer, session id)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    query = f"?token={token}" if token else ""
+    writer.write(f"GET /ws/{user_id}{query} HTTP/1.1\r\nHost: ishu\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 f"Sec-WebSocket-Key: aXNodS1sb2FkLXRlc3Q=\r\nSec-WebSocket-Version: 13\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+    _, _, payload = await server.read_frame(reader)
+    return reader, writer, json.loads(payload)["session"]
+
+
+async def ws_chat(reader, writer, message):
+    """Sends one message; returns the messages received up to the reply (or error)."""
+    writer.write(server.encode_frame(json.dumps({"message": message}), mask_key=os.urandom(4)))
+    await writer.drain()
+    received = []
+    while True:
+        _, _, payload = await server.read_frame(reader)
+        received.append(json.loads(payload))
+        if received[-1]["type"] in ("reply", "error"):
+            return received
+
+
+# ========== Load test ==========
+
+async def _session(host, port, user_id, turns, transport, latencies, refused):
+    reader, writer = await asyncio.open_connection(host, port) if transport == "http" else (None, None)
+    try:
+        if transport == "ws":
+            reader, writer, _ = await ws_connect(host, port, user_id)
+        else:
+            _, reply = await http_request(reader, writer, "POST", f"/users/{user_id}/sessions")
+            session_id = reply["session"]
+        for _ in range(turns):
+            start = time.perf_counter()
+            if transport == "ws":
+                busy = (await ws_chat(reader, writer, CHAT_MESSAGE))[-1]["type"] == "error"
+            else:
+                status, _ = await http_request(reader, writer, "POST", f"/sessions/{session_id}/chat",
+                                               {"message": CHAT_MESSAGE})
+                busy = status == 503
+            if busy:
+                refused.append(user_id)
+            else:
+                latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run_load(sessions, turns, transport, llm_slots, max_waiting, workers, data_dir):
+    server.configure_llm(llm_slots, max_waiting, queue_timeout=60)
+    ishu = server.IshuServer(data_dir, port=0, workers=workers, max_sessions=sessions)
+    host, port = await ishu.start()
+    latencies, refused = [], []
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(_session(host, port, f"user{i}", turns, transport, latencies, refused)
+                               for i in range(sessions)))
+    finally:
+        elapsed = time.perf_counter() - start
+        await ishu.close()
+    return latencies, refused, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--transport", choices=("ws", "http"), default="ws")
+    parser.add_argument("--llm-slots", type=int, default=4)
+    parser.add_argument("--max-waiting", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=128)
+    parser.add_argument("--first-token-latency", type=float, default=0.02, help="stub latency before the first token (s)")
+    parser.add_argument("--token-latency", type=float, default=0.001, help="stub latency between tokens (s)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    stub = StubOllama(first_token_latency=args.first_token_latency, token_latency=args.token_latency)
+    saved = (assistant.OLLAMA_API_URL, assistant.RESPONSE_CACHE, assistant.OLLAMA_GATES)
+    # Every turn should reach the stub, so the response cache is off
+    assistant.OLLAMA_API_URL, assistant.RESPONSE_CACHE = stub.url, None
+    try:
+        with stub, tempfile.TemporaryDirectory() as data_dir, quiet():
+            latencies, refused, elapsed = asyncio.run(run_load(args.sessions, args.turns, args.transport,
+                                                               args.llm_slots, args.max_waiting, args.workers, data_dir))
+    finally:
+        assistant.OLLAMA_API_URL, assistant.RESPONSE_CACHE, assistant.OLLAMA_GATES = saved
+
+    latencies.sort()
+    report = {
+        "sessions": args.sessions,
+        "transport": args.transport,
+        "llm_slots": args.llm_slots,
+        "turns": len(latencies),
+        "refused": len(refused),
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "llm_requests": stub.requests,
+    }
+    if latencies:
+        report.update({
+            "p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1),
+            "max_ms": round(latencies[-1] * 1000, 1),
+        })
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if latencies else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
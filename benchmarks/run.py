@@ -0,0 +1,256 @@
+"""
+Benchmark runner for the routine tools, LLM round trips, tool-call extraction and STT helpers.
+
+    python -m benchmarks.run [--quick] [--suite routine llm toolcalls stt] [--backend json sqlite]
+                             [--output results.json] [--compare baseline.json --threshold 1.25]
+
+Results are printed and, with --output, written as JSON. With --compare the run exits
+with status 1 when a benchmark's median is more than `threshold` times its baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.harness import Results, compare, measure, quiet, summarise
+from benchmarks.stub_ollama import StubOllama
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+QUICK_SIZES = (10, 100, 1000)
+
+
+def generate_routine(size, seed=0):
+    """A routine of `size` entries spread over the day, sorted by start time like add_routine_entry keeps it."""
+    rng = random.Random(seed)
+    routine = []
+    for i in range(size):
+        start = rng.randrange(24 * 60)
+        end = (start + rng.choice((15, 30, 45, 60, 90))) % (24 * 60)
+        routine.append({
+            "start": f"{start // 60:02d}:{start % 60:02d}",
+            "end": f"{end // 60:02d}:{end % 60:02d}",
+            "activity": f"{rng.choice(('Study', 'Gym', 'Lunch', 'Reading', 'Call', 'Walk'))} {i}",
+        })
+    routine.sort(key=lambda e: e["start"])
+    return routine
+
+
+# ========== Routine tools ==========
+
+def bench_routine(results, sizes, backends, repeat):
+    import assistant
+
+    results.add("parse_time", measure(lambda: assistant.parse_time("13:45"), repeat=1000))
+
+    saved = (assistant.ROUTINE_FILE_PATH, assistant.ROUTINE_DB_PATH, assistant.ROUTINE_BACKEND)
+    try:
+        for backend in backends:
+            for size in sizes:
+                with tempfile.TemporaryDirectory() as tmp:
+                    routine_path = os.path.join(tmp, "routine.json")
+                    with open(routine_path, "w") as f:
+                        json.dump(generate_routine(size), f)
+                    assistant.ROUTINE_FILE_PATH = routine_path
+                    assistant.ROUTINE_DB_PATH = os.path.join(tmp, "routine.db")
+                    assistant.ROUTINE_BACKEND = backend
+                    prefix = f"routine[{backend}, n={size}]"
+                    params = {"backend": backend, "entries": size}
+
+                    def reload():
+                        assistant._ROUTINE_INDEX_CACHE.clear()
+                        assistant._ROUTINE_STORES.clear()
+                    if backend == "json":
+                        results.add(f"{prefix} load", measure(assistant.load_routine_index, repeat=5, setup=reload), **params)
+                    else:
+                        # The first use imports routine.json into the database; timed on its own, not as a lookup
+                        results.add(f"{prefix} load", measure(assistant.load_routine_index, repeat=1), **params)
+
+                    results.add(f"{prefix} get_task_by_time", measure(
+                        lambda: assistant.get_task_by_time(query_time="10:30"), repeat=repeat), **params)
+                    results.add(f"{prefix} get_routine", measure(assistant.get_routine, repeat=5), **params)
+                    results.add(f"{prefix} add_routine_entry", measure(
+                        lambda: assistant.add_routine_entry("12:15", "12:20", "Snack"), repeat=repeat), **params)
+
+                    counter = iter(range(10 ** 9))
+                    keyword = []
+                    def add_victim():
+                        keyword[:] = [f"victim-{next(counter)}"]
+                        assistant.add_routine_entry("06:00", "06:05", keyword[0])
+                    results.add(f"{prefix} remove_routine_entry", measure(
+                        lambda: assistant.remove_routine_entry(keyword[0]), repeat=repeat, setup=add_victim), **params)
+                    results.add(f"{prefix} remove_routine_entry (no match)", measure(
+                        lambda: assistant.remove_routine_entry("no such activity"), repeat=repeat), **params)
+
+                    db = assistant._ROUTINE_DBS.pop(assistant.ROUTINE_DB_PATH, None)
+                    if db is not None:
+                        db.close()
+                    assistant._ROUTINE_STORES.clear()
+                    assistant._ROUTINE_INDEX_CACHE.clear()
+    finally:
+        assistant.ROUTINE_FILE_PATH, assistant.ROUTINE_DB_PATH, assistant.ROUTINE_BACKEND = saved
+
+
+# ========== LLM round trips (stub server) ==========
+
+def _time_to_first_sentence(assistant):
+    t0 = time.perf_counter()
+    seen = []
+    def on_sentence(sentence):
+        if not seen:
+            seen.append((time.perf_counter() - t0) * 1e6)
+    assistant.ollama_response("what next?", stream=True, on_sentence=on_sentence)
+    return seen
+
+
+def bench_llm(results, repeat, first_token_latency, token_latency):
+    import assistant
+
+    stub = StubOllama(first_token_latency=first_token_latency, token_latency=token_latency)
+    saved = (assistant.OLLAMA_API_URL, assistant.RESPONSE_CACHE, assistant.OLLAMA_SHOW_METRICS)
+    assistant.OLLAMA_API_URL, assistant.RESPONSE_CACHE, assistant.OLLAMA_SHOW_METRICS = stub.url, None, False
+    params = {"first_token_latency_s": first_token_latency, "token_latency_s": token_latency}
+    try:
+        with stub:
+            results.add("ollama_response (non-stream)", measure(
+                lambda: assistant.ollama_response("what next?"), repeat=repeat), **params)
+            results.add("ollama_response (stream, total)", measure(
+                lambda: assistant.ollama_response("what next?", stream=True, on_sentence=lambda s: None),
+                repeat=repeat), **params)
+
+            first_sentence = []
+            for _ in range(repeat):
+                with quiet():
+                    first_sentence.extend(_time_to_first_sentence(assistant))
+            results.add("ollama_response (stream, first sentence)", summarise(first_sentence), **params)
+    finally:
+        assistant.OLLAMA_API_URL, assistant.RESPONSE_CACHE, assistant.OLLAMA_SHOW_METRICS = saved
+
+
+# ========== Tool-call extraction ==========
+
+def synthetic_llm_output(tool_calls, chatter_words=40):
+    calls = [
+        json.dumps({"tool_call": {"name": "add_routine_entry",
+                                  "arguments": {"start": "18:00", "end": "19:30", "activity": f"Study {{block}} {i}"}}})
+        for i in range(tool_calls)
+    ]
+    chatter = " ".join(["Sure, let me update that for you."] * (chatter_words // 7 + 1))
+    return chatter + "\n" + "\n".join(calls) + "\n" + chatter
+
+
+def bench_toolcalls(results, repeat):
+    from tool_calls import ToolCallExtractor, extract_tool_calls
+
+    for count in (1, 5, 20):
+        text = synthetic_llm_output(count)
+        params = {"tool_calls": count, "chars": len(text)}
+        results.add(f"extract_tool_calls (n={count}, full text)", measure(
+            lambda: extract_tool_calls(text), repeat=repeat * 10), **params)
+
+        chunks = [text[i:i + 4] for i in range(0, len(text), 4)]  # roughly one token per chunk
+        def streamed():
+            extractor = ToolCallExtractor()
+            for chunk in chunks:
+                extractor.feed(chunk)
+        results.add(f"extract_tool_calls (n={count}, streamed)", measure(streamed, repeat=repeat * 10), **params)
+
+
+# ========== STT helpers ==========
+
+def bench_stt(results, repeat):
+    try:
+        import numpy
+    except ImportError:
+        print("numpy is not installed; skipping the STT benchmarks.")
+        return
+    import stt
+
+    rng = numpy.random.default_rng(0)
+    raw = (rng.standard_normal(44100 * 5) * 3000).astype("<i2").tobytes()  # 5 s at 44.1 kHz
+    results.add("pcm16_to_float32 (5 s, 44.1k -> 16k)", measure(
+        lambda: stt.pcm16_to_float32(raw, 44100), repeat=repeat), seconds=5)
+
+    frame = raw[:480 * 2]  # one 30 ms frame at 16 kHz
+    vad = stt.EnergyVAD()
+    results.add("EnergyVAD.is_speech (30 ms frame)", measure(lambda: vad.is_speech(frame), repeat=repeat * 50))
+
+    previous = "what should i do at six thirty in the evening today"
+    results.add("merge_overlap", measure(
+        lambda: stt.merge_overlap(previous, "in the evening today please tell me"), repeat=repeat * 50))
+
+
+# ========== Runner ==========
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", nargs="+", default=["routine", "llm", "toolcalls", "stt"],
+                        choices=["routine", "llm", "toolcalls", "stt"])
+    parser.add_argument("--sizes", nargs="+", type=int, help=f"routine sizes (default {DEFAULT_SIZES})")
+    parser.add_argument("--backend", nargs="+", default=["json"], choices=["json", "sqlite"])
+    parser.add_argument("--quick", action="store_true", help=f"fewer repeats, sizes {QUICK_SIZES}")
+    parser.add_argument("--repeat", type=int, help="calls per benchmark (default 20, 5 with --quick)")
+    parser.add_argument("--first-token-latency", type=float, default=0.05, help="stub server delay in seconds")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="stub server delay per token")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file from an earlier --output")
+    parser.add_argument("--threshold", type=float, default=1.25, help="allowed slowdown factor vs the baseline")
+    args = parser.parse_args(argv)
+
+    repeat = args.repeat or (5 if args.quick else 20)
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    results = Results()
+
+    with quiet():
+        import assistant  # noqa: F401 -- imported up front so its startup warnings stay out of the timings
+    if "routine" in args.suite:
+        bench_routine(results, sizes, args.backend, repeat)
+    if "llm" in args.suite:
+        bench_llm(results, repeat, args.first_token_latency, args.token_latency)
+    if "toolcalls" in args.suite:
+        bench_toolcalls(results, repeat)
+    if "stt" in args.suite:
+        bench_stt(results, repeat)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "args": vars(args),
+        },
+        "benchmarks": results.benchmarks,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(results.benchmarks)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["benchmarks"]
+        regressions = compare(results.benchmarks, baseline, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.1f} us -> {after:.1f} us ({after / before:.2f}x)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold}x against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
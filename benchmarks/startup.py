@@ -0,0 +1,98 @@
+"""
+Cold-start report for `import assistant`, in the style of `python -X importtime`.
+
+    python -m benchmarks.startup [--runs 5] [--top 15] [--budget-ms 200] [--output startup.json]
+
+Each run starts a fresh interpreter, so nothing is cached in-process. The report
+lists the slowest imports (cumulative), the total, and any heavy speech-stack
+module that was imported at startup although written mode never needs it. The
+exit status is 1 when the median import time is over budget or a heavy module
+was imported.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must only be imported on first use (speech mode, jokes, HTTP)
+HEAVY_MODULES = ("torch", "torchaudio", "numpy", "whisper", "speech_recognition", "pyjokes", "requests")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """Returns [(module, self_us, cumulative_us, depth)] from `-X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return rows
+
+
+def import_profile(module="assistant"):
+    """Imports `module` in a fresh interpreter; returns (import rows, heavy modules that got imported)."""
+    code = (f"import sys, json; import {module}; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True)
+    return parse_importtime(result.stderr), json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def startup_report(module="assistant", runs=5, top=15):
+    totals, rows, heavy = [], [], []
+    for _ in range(runs):
+        rows, heavy = import_profile(module)
+        totals.append(next(cumulative for name, _, cumulative, depth in rows if name == module and depth == 0))
+    slowest = sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": statistics.median(totals) / 1000,
+        "min_ms": min(totals) / 1000,
+        "heavy_modules_imported": heavy,
+        "slowest": [{"module": name, "self_ms": own / 1000, "cumulative_ms": cumulative / 1000}
+                    for name, own, cumulative, _ in slowest],
+    }
+
+
+def print_report(report):
+    print(f"import {report['module']}: median {report['median_ms']:.1f} ms, "
+          f"min {report['min_ms']:.1f} ms over {report['runs']} cold runs")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for row in report["slowest"]:
+        print(f"{row['cumulative_ms']:>14.1f} {row['self_ms']:>9.1f}  {row['module']}")
+    if report["heavy_modules_imported"]:
+        print(f"Heavy modules imported at startup: {', '.join(report['heavy_modules_imported'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="assistant")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=200.0)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = startup_report(args.module, args.runs, args.top)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if report["median_ms"] > args.budget_ms:
+        print(f"Over the {args.budget_ms:.0f} ms startup budget.")
+        return 1
+    return 1 if report["heavy_modules_imported"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
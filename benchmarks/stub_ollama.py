@@ -0,0 +1,93 @@
+"""
+Local stand-in for Ollama's /api/chat, for benchmarking the client side.
+
+The reply is split into tokens and sent as NDJSON when the request asks to stream,
+with `first_token_latency` before the first token and `token_latency` between tokens,
+so time-to-first-sentence and total time can be measured without a model.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "You have a study block from 18:00 to 19:30. After that comes dinner with the family. "
+    "Remember to take a short break before you start. You can do it!"
+)
+
+
+class StubOllama:
+    def __init__(self, reply=DEFAULT_REPLY, first_token_latency=0.0, token_latency=0.0):
+        self.reply = reply
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/api/chat"
+
+    def tokens(self):
+        words = self.reply.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like Ollama
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                stub.requests += 1
+                time.sleep(stub.first_token_latency)
+                tokens = stub.tokens()
+                if body.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for i, token in enumerate(tokens):
+                        if i:
+                            time.sleep(stub.token_latency)
+                        self._chunk({"message": {"role": "assistant", "content": token}, "done": False})
+                    self._chunk({"done": True, "eval_count": len(tokens)})
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    time.sleep(stub.token_latency * max(0, len(tokens) - 1))
+                    data = json.dumps({"message": {"role": "assistant", "content": stub.reply}, "done": True,
+                                       "eval_count": len(tokens)}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+            def _chunk(self, obj):
+                data = json.dumps(obj).encode() + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
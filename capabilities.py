@@ -0,0 +1,23 @@
+"""
+Capability probes for Ishu's optional, heavy dependencies.
+
+The speech stack (speech_recognition, whisper, torch, torchaudio, numpy) costs
+seconds and hundreds of MB to import, and written mode never uses it. Callers
+ask whether a module *could* be imported, which only looks it up on sys.path,
+and import it at the point of first use.
+"""
+import importlib.util
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def module_available(name):
+    """True if `name` is installed; checked without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def all_available(*names):
+    return all(module_available(name) for name in names)
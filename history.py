@@ -0,0 +1,109 @@
+"""
+Bounded chat history for Ishu.
+
+The whole history is re-sent to Ollama on every turn, so an unbounded list makes
+prompt processing slower the longer a session runs. ChatHistory keeps the system
+prompt exactly once, keeps a sliding window of recent messages within a token
+budget, and folds older messages into a short rolling summary.
+
+Between folds the message list only grows at the end, so Ollama can reuse its KV
+cache for the unchanged prefix. Folding is done in batches (down to a low-water
+mark) rather than one message per turn, which would change the prefix every turn.
+"""
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+CHARS_PER_TOKEN = 4        # rough estimate that holds well enough for English text
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(message):
+    """Approximates the prompt tokens one chat message costs."""
+    return len(message.get("content") or "") // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def _clip(text, limit):
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def extractive_summary(previous_summary, folded_messages, max_tokens):
+    """
+    Default summarizer: one clipped line per folded message appended to the previous summary,
+    keeping only the newest lines that fit in max_tokens. No LLM call is needed.
+    """
+    lines = previous_summary.splitlines() if previous_summary else []
+    lines += [f"{m['role']}: {_clip(m.get('content'), 160)}" for m in folded_messages if m.get("content")]
+
+    budget = max_tokens * CHARS_PER_TOKEN
+    kept = []
+    for line in reversed(lines):
+        budget -= len(line) + 1
+        if budget < 0:
+            break
+        kept.append(line)
+    return "\n".join(reversed(kept))
+
+
+class ChatHistory:
+    """
+    Sliding-window chat history with a token budget.
+
+    as_messages() returns what should be sent to the LLM: the system prompt, the rolling
+    summary (if any) and the recent messages. `summarize` may be swapped for an LLM-based
+    summarizer with the same signature as extractive_summary.
+    """
+
+    def __init__(self, system_prompt, max_tokens=2048, summary_tokens=256, min_recent=4,
+                 low_water=0.5, summarize=extractive_summary):
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.min_recent = min_recent
+        self.low_water = low_water
+        self.summarize = summarize
+        self.summary = ""
+        self.recent = []
+        self._recent_tokens = 0
+
+    def append(self, message):
+        # The system prompt is sent once at the top; repeated copies only cost prompt time
+        if message.get("role") == "system" and message.get("content") == self.system_prompt:
+            return
+        self.recent.append(message)
+        self._recent_tokens += estimate_tokens(message)
+        self._enforce_budget()
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def _enforce_budget(self):
+        # Room is reserved for the summary, so folding never pushes the prompt back over budget
+        limit = self.max_tokens - estimate_tokens({"content": self.system_prompt}) - self.summary_tokens
+        if self._recent_tokens <= limit:
+            return
+        # Fold well below the limit so the prefix then stays stable for many turns
+        target = limit * self.low_water
+        folded = []
+        while len(self.recent) > self.min_recent and self._recent_tokens > target:
+            message = self.recent.pop(0)
+            self._recent_tokens -= estimate_tokens(message)
+            folded.append(message)
+        if folded:
+            self.summary = self.summarize(self.summary, folded, self.summary_tokens)
+
+    @property
+    def token_count(self):
+        return sum(estimate_tokens(message) for message in self.as_messages())
+
+    def as_messages(self):
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{self.summary}"})
+        return messages + list(self.recent)
+
+    def __iter__(self):
+        return iter(self.as_messages())
+
+    def __len__(self):
+        return len(self.recent) + (2 if self.summary else 1)
@@ -0,0 +1,85 @@
+"""
+Shared, pooled HTTP client for Ishu.
+
+All outbound HTTP (Ollama on localhost, OpenWeatherMap) goes through one
+keep-alive requests.Session, so every turn reuses an open connection instead of
+paying a fresh TCP handshake, and nothing can block the main loop forever.
+"""
+import threading
+
+# ==============================
+# CLIENT CONFIGURATION
+# ==============================
+CONNECT_TIMEOUT = 3.05   # seconds to establish a connection
+READ_TIMEOUT = 120       # seconds to wait between bytes (LLM generation can be slow on a Pi)
+MAX_RETRIES = 2          # retries on connection errors and 502/503/504
+BACKOFF_FACTOR = 0.5     # sleeps 0.5s, 1s, 2s ... between retries
+POOL_CONNECTIONS = 4     # number of distinct hosts kept in the pool
+POOL_MAXSIZE = 8         # keep-alive connections kept per host
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _build_session():
+    # requests/urllib3 take ~100 ms to import, so they are loaded with the first session
+    # (the background Ollama warm-up), not when the assistant starts
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=0,  # never replay a request whose generation already started
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Returns the process-wide session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def close_session():
+    """Closes pooled connections (e.g. on shutdown or after changing the settings above)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def post_json(url, payload, stream=False, timeout=None):
+    """POSTs a JSON payload through the pooled session with the configured timeouts."""
+    return get_session().post(url, json=payload, stream=stream, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+
+def get(url, params=None, timeout=None):
+    """GETs a URL through the pooled session with the configured timeouts."""
+    return get_session().get(url, params=params, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+
+_EXCEPTIONS = ("RequestException", "ConnectionError", "Timeout")
+
+def __getattr__(name):
+    # http_client.ConnectionError etc. are requests' exception types, resolved on first use so
+    # `except http_client.Timeout:` works without importing requests at startup
+    if name in _EXCEPTIONS:
+        import requests
+        return getattr(requests.exceptions, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
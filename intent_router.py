@@ -0,0 +1,362 @@
+"""
+Local intent router for Ishu.
+
+Decides, without an LLM round trip, whether a query is a control command
+(change mode / exit) or a routine question that a TOOL_MAPPER tool can answer
+directly, and extracts the tool arguments (times, activity keywords).
+
+Layers, tried in order:
+  1. PhraseMatcher, an Aho-Corasick automaton over fixed phrases, finds every
+     known phrase in a single pass over the query.
+  2. IntentClassifier, a tiny TF-IDF nearest-centroid model over word and
+     character n-grams, trained at import time on the examples shipped below.
+     Imperative edits that start with a verb ("remove gym", "add reading from
+     21:00 to 22:00") get a bonus on top of the classifier's score.
+Anything that is not confidently routed goes to Ollama as before. Removals are
+only handled locally when the keyword names exactly one routine activity, and
+questions must not contain words the routine intents cannot explain ("what is
+next in the story").
+"""
+import math
+import re
+from collections import Counter, deque, namedtuple
+
+Intent = namedtuple("Intent", ["name", "tool", "arguments", "confidence"])
+
+
+# ========== Aho-Corasick phrase matcher ==========
+
+class PhraseMatcher:
+    """Aho-Corasick automaton: finds all registered phrases in one left-to-right pass."""
+
+    def __init__(self, phrases):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for phrase, value in phrases:
+            self._add(phrase, value)
+        self._build_failure_links()
+
+    def _add(self, phrase, value):
+        state = 0
+        for char in phrase:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._out[state].append((phrase, value))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text):
+        """Returns the (phrase, value) pairs found in text, in order of where they end."""
+        matches = []
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            matches.extend(self._out[state])
+        return matches
+
+
+# ========== Argument extraction ==========
+
+_TIME_RE = re.compile(
+    r'\b(?:(\d{1,2})[:.](\d{2})\s*(am|pm|a\.m\.|p\.m\.)?|(\d{1,2})\s*(am|pm|a\.m\.|p\.m\.)|(noon|midnight))(?!\w)'
+)
+
+def extract_times(text):
+    """Returns every time mentioned in text as a strict HH:MM string, in order."""
+    times = []
+    for match in _TIME_RE.finditer(text):
+        hour_text, minute_text, meridiem = match.group(1), match.group(2), match.group(3)
+        if hour_text is None and match.group(4) is not None:
+            hour_text, minute_text, meridiem = match.group(4), "00", match.group(5)
+        if match.group(6):
+            times.append("12:00" if match.group(6) == "noon" else "00:00")
+            continue
+
+        hour, minute = int(hour_text), int(minute_text)
+        if meridiem:
+            if not 1 <= hour <= 12:
+                continue
+            hour = hour % 12 + (12 if meridiem.startswith("p") else 0)
+        if hour > 23 or minute > 59:
+            continue
+        times.append(f"{hour:02d}:{minute:02d}")
+    return times
+
+
+_REMOVE_VERBS = ("remove", "delete", "cancel", "drop", "clear", "get rid of")
+_FILLER_WORDS = {
+    "please", "my", "the", "a", "an", "entry", "task", "activity", "slot", "from", "to", "at", "in",
+    "routine", "schedule", "daily", "between", "and", "until", "till", "for", "add", "new", "put",
+    "can", "you", "could", "i", "want", "me", "also", "it", "of", "set", "session", "block",
+}
+
+# Imperative routine edits ("remove gym", "add reading from 9 pm to 10 pm") start with the verb.
+# The verb only raises the classifier's score; it does not decide the intent on its own.
+_REMOVE_COMMAND_RE = re.compile(r'^(?:please\s+)?(?:remove|delete|cancel|drop|get rid of)\b')
+_ADD_COMMAND_RE = re.compile(r'^(?:please\s+)?(?:add|schedule|put|create)\b')
+COMMAND_BONUS = 0.25
+
+# A local removal needs a keyword this long that names exactly one activity as a whole word
+MIN_KEYWORD_LENGTH = 3
+_CATCH_ALL_WORDS = {"all", "everything", "every", "entire", "whole", "anything"}
+
+def _strip_times(text):
+    return _TIME_RE.sub(" ", text)
+
+def extract_activity(text, verbs=()):
+    """Strips command verbs, times and filler words, leaving the activity words."""
+    text = _strip_times(text.lower())
+    for verb in verbs:
+        text = re.sub(rf'\b{re.escape(verb)}\b', " ", text)
+    words = [w for w in re.findall(r"[a-z0-9'&/+-]+", text) if w not in _FILLER_WORDS]
+    return " ".join(words)
+
+
+# ========== Local n-gram classifier ==========
+
+# Training examples shipped with the project. "<time>" stands for any extracted time.
+TRAINING_EXAMPLES = {
+    "get_routine": [
+        "what is my routine", "show my routine", "daily schedule", "show me my schedule",
+        "what does my day look like", "list my tasks for today", "read my routine", "my full schedule",
+    ],
+    "task_now": [
+        "what should i do now", "what is my current task", "what am i doing right now",
+        "what am i supposed to be doing", "current activity", "what's happening now",
+    ],
+    "task_next": [
+        "what should i do next", "what is my next task", "what's my next task", "what comes next",
+        "what is after this", "next activity", "what's up next",
+    ],
+    "task_at": [
+        "what am i doing at <time>", "what is at <time>", "what do i have at <time>",
+        "what's scheduled at <time>", "what should i do at <time>", "what is my task at <time>",
+        "am i busy at <time>", "what is planned for <time>",
+    ],
+    "add_entry": [
+        "add gym from <time> to <time>", "add reading at <time> until <time>",
+        "schedule study from <time> to <time>", "put lunch between <time> and <time>",
+        "add a new task coding from <time> to <time>", "please add meditation <time> to <time>",
+        "create an entry for walk from <time> to <time>",
+    ],
+    "remove_entry": [
+        "remove gym", "delete lunch", "cancel the meeting", "remove my workout",
+        "delete the reading entry", "drop yoga from my routine", "remove review meeting from my schedule",
+        "get rid of dinner",
+    ],
+    "none": [
+        "tell me a joke", "tell me a story", "i feel sad today", "explain recursion",
+        "help me with data structures", "what is an operating system", "how are you",
+        "who created you", "motivate me", "what is the weather", "i am stressed about exams",
+        "what is dynamic programming", "tell me something fun", "hello",
+    ],
+}
+
+# Intents that only read the routine; their queries must consist of routine vocabulary
+QUERY_INTENTS = {"get_routine", "task_now", "task_next", "task_at"}
+
+INTENT_TOOLS = {
+    "get_routine": "get_routine",
+    "task_now": "get_task_by_time",
+    "task_next": "get_task_by_time",
+    "task_at": "get_task_by_time",
+    "add_entry": "add_routine_entry",
+    "remove_entry": "remove_routine_entry",
+}
+
+
+def _words(text):
+    return re.findall(r"<time>|[a-z']+", _TIME_RE.sub(" <time> ", text.lower()))
+
+
+def _features(text):
+    """Word unigrams/bigrams plus character trigrams, with times normalised to <time>."""
+    words = _words(text)
+    features = Counter(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    joined = f" {' '.join(words)} "
+    features.update(f"#{joined[i:i + 3]}" for i in range(len(joined) - 2))
+    return features
+
+
+# Every word a read-only routine question is expected to use; anything else ("physics", "story",
+# "french") means the question is about something else and goes to the LLM
+QUERY_VOCABULARY = _FILLER_WORDS | {
+    word for label in QUERY_INTENTS for text in TRAINING_EXAMPLES[label] for word in _words(text)
+} | {"what's", "is", "are", "do", "does", "right", "now", "next", "today", "then", "after", "up", "be"}
+
+
+class IntentClassifier:
+    """TF-IDF nearest-centroid classifier; tiny, dependency-free and trained in milliseconds."""
+
+    def __init__(self, examples):
+        documents = [(label, _features(text)) for label, texts in examples.items() for text in texts]
+        doc_freq = Counter(feature for _, features in documents for feature in features)
+        total = len(documents)
+        self.idf = {feature: math.log((1 + total) / (1 + df)) + 1 for feature, df in doc_freq.items()}
+
+        self.centroids = {}
+        for label in examples:
+            centroid = Counter()
+            for doc_label, features in documents:
+                if doc_label == label:
+                    centroid.update(self._vector(features))
+            self.centroids[label] = self._normalise(centroid)
+
+    def _vector(self, features):
+        return self._normalise({f: count * self.idf.get(f, 0.0) for f, count in features.items()})
+
+    @staticmethod
+    def _normalise(vector):
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {f: v / norm for f, v in vector.items()}
+
+    def scores(self, text):
+        vector = self._vector(_features(text))
+        return sorted(
+            ((sum(weight * centroid.get(f, 0.0) for f, weight in vector.items()), label)
+             for label, centroid in self.centroids.items()),
+            reverse=True,
+        )
+
+    def classify(self, text, bonus=None):
+        """Returns (label, score, margin over the runner-up). `bonus` adds to the scores of some labels."""
+        ranked = self.scores(text)
+        if bonus:
+            ranked = sorted(((score + bonus.get(label, 0.0), label) for score, label in ranked), reverse=True)
+        (best_score, best_label), (second_score, _) = ranked[0], ranked[1]
+        return best_label, best_score, best_score - second_score
+
+
+# ========== Router ==========
+
+# Fixed phrases, checked in priority order (matches the original command handling)
+CONTROL_PHRASES = [
+    ("change mode", "change_mode"),
+    ("thank you", "thanks"),
+    ("exit", "exit"), ("quit", "exit"), ("goodbye", "exit"), ("stop listening", "exit"),
+]
+CONTROL_PRIORITY = ["change_mode", "thanks", "exit"]
+
+TOOL_PHRASES = [
+    ("what is my routine", "get_routine"), ("show my routine", "get_routine"), ("daily schedule", "get_routine"),
+    ("what should i do next", "task_next"), ("what's my next task", "task_next"), ("what is my next task", "task_next"),
+    ("what should i do now", "task_now"), ("what is my current task", "task_now"),
+]
+TOOL_PRIORITY = ["get_routine", "task_next", "task_now"]
+
+# Words that make a query worth sending to the tool-selection model (see IntentRouter.mentions_routine).
+# Matched on the space-padded query, so " plan " does not fire inside "explanation".
+ROUTINE_WORDS = [(f" {word}", "routine") for word in (
+    "routine", "schedule", "task", "plan ", "plans ", "busy ", "free at", "agenda", "timetable", "calendar",
+    "slot", "add ", "remove ", "delete ", "cancel ", "move ", "reschedule", "what's next", "do next",
+)]
+
+
+class IntentRouter:
+    def __init__(self, min_confidence=0.35, min_margin=0.05):
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.control_matcher = PhraseMatcher(CONTROL_PHRASES)
+        self.tool_matcher = PhraseMatcher(TOOL_PHRASES)
+        self.routine_matcher = PhraseMatcher(ROUTINE_WORDS)
+        self.classifier = IntentClassifier(TRAINING_EXAMPLES)
+
+    @staticmethod
+    def _first_by_priority(matches, priority):
+        found = {value for _, value in matches}
+        for value in priority:
+            if value in found:
+                return value
+        return None
+
+    def control_command(self, query):
+        """Returns 'change_mode', 'thanks', 'exit' or None."""
+        return self._first_by_priority(self.control_matcher.find(query.lower()), CONTROL_PRIORITY)
+
+    def route(self, query, find_activities=None):
+        """
+        Returns an Intent for a tool that can answer the query locally, or None for the LLM.
+        find_activities(keyword, limit) returns up to `limit` names in the current routine that
+        contain the keyword; it is only asked once a removal was recognised, which must name
+        exactly one activity. Without it, removals always go to the LLM.
+        """
+        text = query.lower().strip()
+
+        phrase_intent = self._first_by_priority(self.tool_matcher.find(text), TOOL_PRIORITY)
+        if phrase_intent:
+            return Intent(phrase_intent, INTENT_TOOLS[phrase_intent], {}, 1.0)
+
+        bonus = {}
+        if _REMOVE_COMMAND_RE.match(text):
+            bonus["remove_entry"] = COMMAND_BONUS
+        elif _ADD_COMMAND_RE.match(text) and len(extract_times(text)) == 2:
+            bonus["add_entry"] = COMMAND_BONUS
+        label, score, margin = self.classifier.classify(text, bonus)
+        if label == "none" or score < self.min_confidence or margin < self.min_margin:
+            return None
+        if label in QUERY_INTENTS and any(word not in QUERY_VOCABULARY for word in _words(text)):
+            return None
+
+        arguments = self._arguments(label, text)
+        if arguments is None:
+            return None
+        if label == "remove_entry" and not self._names_one_activity(arguments["activity_keyword"], find_activities):
+            return None
+        return Intent(label, INTENT_TOOLS[label], arguments, min(score, 1.0))
+
+    @staticmethod
+    def _names_one_activity(keyword, find_activities):
+        """
+        Whether removing by `keyword` (a substring match, like remove_routine_entry) would delete
+        exactly one activity, and the keyword is a whole word or phrase of its name.
+        """
+        if find_activities is None or len(keyword) < MIN_KEYWORD_LENGTH or _CATCH_ALL_WORDS & set(keyword.split()):
+            return False
+        matches = find_activities(keyword, 2)  # a second match is enough to give up
+        return len(matches) == 1 and re.search(rf"\b{re.escape(keyword)}\b", matches[0].lower()) is not None
+
+    def mentions_routine(self, query, min_score=0.2):
+        """
+        Whether the query is probably about the routine even though route() could not answer it
+        locally (looser than route()): a routine word, a time, or a routine intent with a low score.
+        """
+        text = query.lower().strip()
+        padded = " " + re.sub(r"[^a-z0-9':]+", " ", text) + " "
+        if self.routine_matcher.find(padded) or extract_times(text):
+            return True
+        label, score, _ = self.classifier.classify(text)
+        return label != "none" and score >= min_score
+
+    @staticmethod
+    def _arguments(label, text):
+        """Extracts tool arguments; None means the query is missing something the tool needs."""
+        times = extract_times(text)
+        if label == "task_at":
+            return {"query_time": times[0]} if len(times) == 1 else None
+        if label == "add_entry":
+            activity = extract_activity(text, verbs=("create", "schedule", "add", "put"))
+            if len(times) != 2 or not activity:
+                return None
+            return {"start": times[0], "end": times[1], "activity": activity}
+        if label == "remove_entry":
+            keyword = extract_activity(text, verbs=_REMOVE_VERBS)
+            return {"activity_keyword": keyword} if keyword and not times else None
+        return {}
@@ -0,0 +1,214 @@
+"""
+Asyncio pipeline variant of Ishu's main loop.
+
+The sequential loop in assistant.main() listens, thinks and speaks one after
+another. Here each stage runs on its own and they are connected by queues:
+
+    capture -> transcribe -> think (LLM + tools) -> speak
+
+so the next utterance is captured while the previous answer is still being
+spoken, and a new query cancels the answer that is still being generated
+(barge-in). Turns still run one at a time: a barge-in query waits for the
+cancelled turn to return, so the shared chat history stays in order.
+
+The microphone stays open while Ishu speaks, so it also hears Ishu. A transcript
+that mostly repeats what was said in the last ECHO_WINDOW_SECONDS is dropped as
+echo instead of being treated as an interruption. Run with:  python pipeline.py
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import assistant
+import tracing
+
+# Transcripts heard while Ishu speaks, or this long after, are compared with what was said
+ECHO_WINDOW_SECONDS = 2.0
+# Share of a transcript's words that must come from Ishu's own speech for it to count as echo
+ECHO_OVERLAP = 0.6
+
+
+def _words(text):
+    return set(re.findall(r"[a-z0-9']+", text.lower()))
+
+
+class Pipeline:
+    def __init__(self):
+        self.loop = None
+        self.audio_queue = asyncio.Queue()
+        self.query_queue = asyncio.Queue()
+        self.speech_queue = asyncio.Queue()
+        self.chat_history = assistant.new_chat_history()
+        self.stopped = threading.Event()
+
+        # One worker per blocking stage keeps each stage's work ordered (for thinking: one turn
+        # at a time appends to chat_history)
+        self.transcribe_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ishu-stt")
+        self.think_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ishu-llm")
+        self.speak_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ishu-tts")
+
+        self._turn = None           # asyncio task of the answer being generated
+        self._turn_cancel = None    # threading.Event that stops its LLM stream
+
+        # What Ishu is saying or just said, for echo suppression (read by the capture thread)
+        self._echo_lock = threading.Lock()
+        self._recent_speech = deque(maxlen=8)
+        self._speaking = 0
+        self._spoke_at = 0.0
+
+    # ---------- Stage 1: capture (daemon thread, input() and the microphone block) ----------
+
+    def _capture_forever(self):
+        while not self.stopped.is_set():
+            if assistant.CURRENT_MODE == 'S':
+                if not (assistant.whisper_available() and assistant.speech_recognition_available() and assistant._ensure_whisper_model()):
+                    print("Speech input is unavailable; switching to Written mode.")
+                    self._put(self.query_queue, "change mode")
+                    self.stopped.wait(1)
+                    continue
+                if assistant.WHISPER_CONTINUOUS:
+                    # Transcription already overlaps with capture inside the listener
+                    text = assistant.listen_continuous()
+                    if text:
+                        self._heard(text)
+                    continue
+                audio = assistant.record_audio()
+                if audio is not None:
+                    self._put(self.audio_queue, audio)
+            else:
+                try:
+                    query = assistant.listen_written()
+                except EOFError:
+                    self._put(self.query_queue, "exit")
+                    return
+                self._put(self.query_queue, query)
+
+    def _put(self, queue, item):
+        try:
+            self.loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:  # the event loop already shut down
+            self.stopped.set()
+
+    # ---------- Stage 2: transcribe ----------
+
+    async def transcribe_stage(self):
+        while True:
+            audio = await self.audio_queue.get()
+            text = await self.loop.run_in_executor(self.transcribe_executor, assistant.transcribe_audio, audio)
+            if text:
+                self._heard(text)
+
+    def _heard(self, text):
+        """Queues a transcript as a query, unless it is Ishu's own voice picked up by the microphone."""
+        if self.is_echo(text):
+            print(f"(ignored echo: {text})")
+            assistant.TRACER.count("echo_suppressed")
+            return
+        self._put(self.query_queue, text.lower())
+
+    def is_echo(self, text):
+        with self._echo_lock:
+            if not self._speaking and time.monotonic() - self._spoke_at > ECHO_WINDOW_SECONDS:
+                self._recent_speech.clear()
+                return False
+            spoken = set().union(*self._recent_speech)
+        words = _words(text)
+        return bool(words) and len(words & spoken) >= ECHO_OVERLAP * len(words)
+
+    # ---------- Stage 3: think ----------
+
+    async def think_stage(self):
+        while True:
+            query = await self.query_queue.get()
+            print(f"User said: {query}")
+
+            # Barge-in: a new query supersedes the answer still being generated or spoken
+            self._cancel_turn()
+
+            reply, should_exit = assistant.handle_control_command(query)
+            if reply:
+                await self.speech_queue.put((reply, True))
+                if should_exit:
+                    await self.speech_queue.join()
+                    self.stopped.set()
+                    return
+                continue
+
+            self._turn_cancel = threading.Event()
+            self._turn = asyncio.create_task(self._think(query, self._turn_cancel))
+
+    async def _think(self, query, cancel_event):
+        def on_sentence(sentence):
+            if not cancel_event.is_set():
+                self._put(self.speech_queue, (sentence, False))  # already printed while streaming
+
+        reply = await self.loop.run_in_executor(self.think_executor, self._respond, query, on_sentence, cancel_event)
+        if reply and not cancel_event.is_set():
+            await self.speech_queue.put((reply, True))
+
+    def _respond(self, query, on_sentence, cancel_event):
+        # Capture, transcription and speech run on other threads, so a pipeline turn covers the thinking stage
+        with assistant.TRACER.turn(query):
+            return assistant.respond(query, self.chat_history, on_sentence, cancel_event)
+
+    def _cancel_turn(self):
+        if self._turn_cancel is not None:
+            self._turn_cancel.set()
+        if self._turn is not None and not self._turn.done():
+            self._turn.cancel()
+        # Drop sentences of the old answer that have not been spoken yet, and cut off the current one
+        while not self.speech_queue.empty():
+            self.speech_queue.get_nowait()
+            self.speech_queue.task_done()
+        assistant.stop_speaking()
+
+    # ---------- Stage 4: speak ----------
+
+    async def speak_stage(self):
+        while True:
+            text, echo = await self.speech_queue.get()
+            with self._echo_lock:
+                self._recent_speech.append(_words(text))
+                self._speaking += 1
+            try:
+                await self.loop.run_in_executor(self.speak_executor, assistant.speak, text, True, echo)
+            finally:
+                with self._echo_lock:
+                    self._speaking -= 1
+                    self._spoke_at = time.monotonic()
+                self.speech_queue.task_done()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        threading.Thread(target=self._capture_forever, name="ishu-capture", daemon=True).start()
+        stages = [
+            asyncio.create_task(self.transcribe_stage()),
+            asyncio.create_task(self.speak_stage()),
+        ]
+        try:
+            await self.think_stage()
+        finally:
+            self._cancel_turn()
+            for stage in stages:
+                stage.cancel()
+            for executor in (self.transcribe_executor, self.think_executor, self.speak_executor):
+                executor.shutdown(wait=False)
+
+
+async def main_async():
+    assistant.preload_whisper()
+    assistant.start_ollama_warmup()
+    if assistant.ANNOUNCE_ROUTINE:
+        assistant.start_reminders()
+    assistant.speak("Hello! I'm Ishu.")
+    assistant.select_initial_mode()
+    assistant.speak(f"Starting in {'Speech' if assistant.CURRENT_MODE == 'S' else 'Written'} mode. Say or type 'change mode' to switch.", blocking=True)
+    await Pipeline().run()
+
+
+if __name__ == "__main__":
+    args = tracing.parse_args(description="Ishu with concurrent capture, thinking and speech.")
+    tracing.run(lambda: asyncio.run(main_async()), assistant.TRACER, args)
@@ -0,0 +1,161 @@
+"""
+Proactive routine reminders: "Workout starts now", "Workout ends now".
+
+ReminderScheduler keeps a min-heap of the upcoming start and end times of every
+routine entry. A background thread sleeps until the earliest one, announces
+every event that is due, and schedules it again for the next day. Slots that
+wrap over midnight (22:00-07:00 sleep) simply end on the following day.
+
+update(entries) only schedules the entries that were added and invalidates the
+ones that were removed. Their events stay in the heap and are skipped when they
+surface, and the heap is compacted once most of it is stale.
+"""
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+# Upper bound on one sleep, so a suspended machine or a changed wall clock is noticed
+MAX_SLEEP_SECONDS = 300
+# Events overdue by more than this (the machine was asleep) are skipped, not announced late
+GRACE = timedelta(minutes=5)
+
+# At the same minute, an ending slot is announced before the one that starts
+_END, _START = 0, 1
+
+
+def next_occurrence(minute, after):
+    """The first datetime strictly after `after` whose time of day is `minute` (minutes after midnight)."""
+    candidate = after.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
+    if candidate <= after:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def announcement(kind, activity):
+    return f"{activity} starts now." if kind == _START else f"{activity} ends now."
+
+
+class ReminderScheduler:
+    """
+    Announces routine transitions through announce(text).
+
+    `to_minutes` converts "HH:MM" to minutes after midnight. `refresh`, if given, is called
+    on every wake-up so routine edits made on disk are picked up (it may call update()).
+    """
+
+    def __init__(self, announce, to_minutes, clock=datetime.now, refresh=None, announce_ends=True):
+        self.announce = announce
+        self.to_minutes = to_minutes
+        self.clock = clock
+        self.refresh = refresh
+        self.announce_ends = announce_ends
+        self._events = []               # heap of (due, kind, seq, key, generation)
+        self._generations = {}          # (start, end, activity) -> generation of its live events
+        self._next_generation = itertools.count(1)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    # ---------- Schedule ----------
+
+    def update(self, entries):
+        """Brings the schedule in line with `entries`, touching only the entries that changed."""
+        keys = {(e['start'], e['end'], e['activity']) for e in entries}
+        with self._cond:
+            now = self.clock()
+            for key in set(self._generations) - keys:
+                del self._generations[key]  # its events become stale
+            for key in keys - set(self._generations):
+                self._generations[key] = next(self._next_generation)
+                self._schedule(key, now)
+            if len(self._events) > 2 * self._live_events() + 64:
+                self._compact()
+            self._cond.notify()
+
+    def _schedule(self, key, now):
+        start, end, _ = key
+        generation = self._generations[key]
+        start_min, end_min = self.to_minutes(start), self.to_minutes(end)
+        self._push(next_occurrence(start_min, now), _START, key, generation)
+        if self.announce_ends and end_min != start_min:  # start == end is an all-day slot
+            self._push(next_occurrence(end_min, now), _END, key, generation)
+
+    def _push(self, due, kind, key, generation):
+        heapq.heappush(self._events, (due, kind, next(self._seq), key, generation))
+
+    def _is_live(self, event):
+        return self._generations.get(event[3]) == event[4]
+
+    def _live_events(self):
+        return len(self._generations) * (2 if self.announce_ends else 1)
+
+    def _compact(self):
+        self._events = [event for event in self._events if self._is_live(event)]
+        heapq.heapify(self._events)
+
+    def upcoming(self, limit=None):
+        """The live events in the order they will fire, as (due, "start"/"end", activity)."""
+        with self._cond:
+            events = sorted(event for event in self._events if self._is_live(event))
+        return [(due, "start" if kind == _START else "end", key[2]) for due, kind, _, key, _ in events[:limit]]
+
+    def pop_due(self, now=None):
+        """Removes the events due at `now`, schedules them for the next day and returns their announcements."""
+        now = now or self.clock()
+        messages = []
+        with self._cond:
+            while self._events and self._events[0][0] <= now:
+                due, kind, _, key, generation = heapq.heappop(self._events)
+                if self._generations.get(key) != generation:
+                    continue
+                if now - due <= GRACE:
+                    messages.append(announcement(kind, key[2]))
+                minute = self.to_minutes(key[0] if kind == _START else key[1])
+                self._push(next_occurrence(minute, now), kind, key, generation)
+        return messages
+
+    def _seconds_until_next(self, now):
+        with self._cond:
+            while self._events and not self._is_live(self._events[0]):
+                heapq.heappop(self._events)
+            if not self._events:
+                return MAX_SLEEP_SECONDS
+            return min(max((self._events[0][0] - now).total_seconds(), 0.0), MAX_SLEEP_SECONDS)
+
+    # ---------- Thread ----------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ishu-reminders", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            if self.refresh is not None:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Reminder refresh failed: {e}")
+            for message in self.pop_due():
+                try:
+                    self.announce(message)
+                except Exception as e:
+                    print(f"Reminder failed: {e}")
+            with self._cond:
+                if self._stopped:
+                    return
+                # update() and stop() notify, so an edit reschedules the wake-up immediately
+                self._cond.wait(self._seconds_until_next(self.clock()))
+                if self._stopped:
+                    return
@@ -0,0 +1,122 @@
+"""
+LRU + TTL cache for deterministic LLM responses.
+
+Keys are a hash of the model name, the normalised message list and the request
+options, so a repeated prompt (a story with no topic, a repeated general
+question, the summary pass after identical tool output) is answered from
+memory instead of being generated again. An optional SQLite file keeps entries
+across restarts.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalise_messages(messages):
+    """Keeps only role and content, with whitespace collapsed, so cosmetic differences still hit."""
+    return [
+        {"role": m.get("role", ""), "content": " ".join((m.get("content") or "").split())}
+        for m in messages
+    ]
+
+
+def make_key(model, messages, options=None):
+    payload = json.dumps(
+        {"model": model, "messages": normalise_messages(messages), "options": options or {}},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    In-memory LRU with per-entry expiry, plus an optional SQLite tier (db_path).
+
+    Only deterministic requests are cached by default: a request whose temperature is above
+    zero is skipped unless cache_nonzero_temperature is set.
+    """
+
+    def __init__(self, max_entries=256, ttl=6 * 3600, db_path=None, cache_nonzero_temperature=False,
+                 default_temperature=0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_nonzero_temperature = cache_nonzero_temperature
+        self.default_temperature = default_temperature
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    def is_cacheable(self, options=None):
+        temperature = (options or {}).get("temperature", self.default_temperature)
+        return temperature == 0 or self.cache_nonzero_temperature
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at),
+                )
+                self._db.commit()
+
+    def _remember(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,532 @@
+"""
+Crash-safe storage for the routine.
+
+The routine lives in two files:
+  * routine.json, the snapshot: the plain JSON list it always was, written only
+    through temp file + fsync + os.replace, so it is either the old or the new
+    version and never half-written;
+  * routine.json.journal, an append-only log of the add/remove batches committed
+    since that snapshot. A single edit costs one small fsync'ed append instead of a
+    rewrite of the whole file.
+
+Every journal line carries a CRC32 of its payload. Replay stops at the first line
+that is torn or fails its checksum (a crash mid-append) and truncates it away.
+The journal's first line records the checksum of the snapshot it applies to.
+Compaction appends a "compacted" record naming the new snapshot's checksum
+before replacing it, so a journal left behind by an interrupted compaction is
+recognised as already folded in and discarded instead of replayed twice. A
+journal whose base does not match for any other reason (routine.json was edited
+by hand) still holds edits that are in neither file: it is moved aside next to
+the routine, with a warning, rather than deleted.
+
+SqliteRoutineStore is an optional backend for large routines: the same reads and
+edits, answered from indexed SQLite tables instead of an in-memory list.
+"""
+import json
+import os
+from bisect import bisect_left
+import sqlite3
+import threading
+import time
+import zlib
+
+JOURNAL_SUFFIX = ".journal"
+
+
+def _signature(path):
+    """Returns (mtime_ns, size) for a file, or None if it cannot be stat'ed."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _fsync_directory(path):
+    """Makes a rename inside `path` durable (not supported on every platform)."""
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """Writes bytes to path via a fsync'ed temp file and os.replace."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    _fsync_directory(directory)
+
+
+def encode_record(record):
+    payload = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+    return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n".encode("utf-8")
+
+
+def decode_record(line):
+    """Returns the record stored in one journal line, or None if it is torn or corrupt."""
+    if not line.endswith(b"\n"):
+        return None
+    checksum, _, payload = line[:-1].partition(b" ")
+    try:
+        if int(checksum, 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def apply_ops(entries, ops, sort_key=None):
+    """Applies one committed batch of operations to a routine list, in place."""
+    for op in ops:
+        if op["op"] == "add":
+            entries.append(op["entry"])
+        elif op["op"] == "remove":
+            keyword = op["keyword"].lower()
+            entries[:] = [entry for entry in entries if keyword not in entry["activity"].lower()]
+    if sort_key is not None and any(op["op"] == "add" for op in ops):
+        entries.sort(key=sort_key)
+    return entries
+
+
+class RoutineStore:
+    """
+    Snapshot + journal storage for one routine file.
+
+    load() returns the current routine (re-reading only when either file changed on
+    disk); append() journals a committed batch; the journal is folded into a new
+    snapshot once it holds compact_every batches.
+    """
+
+    def __init__(self, path, sort_key=None, compact_every=200, lock=None):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.sort_key = sort_key
+        self.compact_every = compact_every
+        self.journal_records = 0
+        self._entries = None
+        self._base = None
+        self._signatures = None
+        # Held by load/append/compaction; callers that batch edits pass their own per-file lock
+        self._lock = lock or threading.RLock()
+
+    def _current_signatures(self):
+        return (_signature(self.path), _signature(self.journal_path))
+
+    def load(self):
+        """
+        Returns the routine list. The list is shared with the store; only mutate a copy.
+        A snapshot that is not valid JSON is moved aside (never silently replaced by []).
+        """
+        with self._lock:
+            signatures = self._current_signatures()
+            if self._entries is not None and signatures == self._signatures:
+                return self._entries
+
+            entries, self._base = self._read_snapshot()
+            self.journal_records = self._replay(entries)
+            self._entries = entries
+            self._signatures = self._current_signatures()
+            return entries
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        try:
+            entries = json.loads(data) if data.strip() else []
+            if not isinstance(entries, list):
+                raise ValueError("routine snapshot is not a list")
+        except ValueError as e:
+            corrupt_path = f"{self.path}.corrupt-{int(time.time())}"
+            print(f"Routine file is corrupt ({e}); moved it to {corrupt_path}.")
+            os.replace(self.path, corrupt_path)
+            return [], 0
+        return entries, zlib.crc32(data)
+
+    def _replay(self, entries):
+        """Applies the journal to entries and returns how many batches it held."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+
+        header = decode_record(lines[0]) if lines else None
+        if not header or header.get("base") != self._base:
+            self._discard_stale_journal(lines)
+            return 0
+
+        good_bytes = len(lines[0])
+        count = 0
+        for line in lines[1:]:
+            record = decode_record(line)
+            if record is None:
+                break
+            if "ops" in record:  # a "compacted" marker whose snapshot was never written adds nothing
+                apply_ops(entries, record["ops"], self.sort_key)
+                count += 1
+            good_bytes += len(line)
+
+        if good_bytes < sum(len(line) for line in lines):
+            print(f"Dropped a torn record at the end of {self.journal_path}.")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_bytes)
+                os.fsync(f.fileno())
+        return count
+
+    def _discard_stale_journal(self, lines):
+        """Handles a journal that does not apply to the current snapshot."""
+        records = [decode_record(line) for line in lines]
+        if any(record and record.get("compacted") == self._base for record in records):
+            os.remove(self.journal_path)  # an interrupted compaction: its edits are in the snapshot
+            return
+        batches = sum(1 for record in records if record and "ops" in record)
+        stale_path = f"{self.journal_path}.stale-{int(time.time())}"
+        os.replace(self.journal_path, stale_path)
+        print(f"{self.path} changed outside Ishu, so {batches} journaled edit(s) no longer apply to it. "
+              f"They were kept in {stale_path}.")
+
+    def append(self, ops, entries):
+        """
+        Durably records one committed batch. `entries` is the routine after applying it
+        (what apply_ops produces) and becomes the cached state.
+        """
+        with self._lock:
+            if self._entries is None:
+                self.load()
+            if self.journal_records >= self.compact_every:
+                self.write_snapshot(entries)
+                return
+
+            new_journal = _signature(self.journal_path) is None
+            self._append_records(([{"base": self._base}] if new_journal else []) + [{"ops": ops}])
+            if new_journal:
+                _fsync_directory(os.path.dirname(self.journal_path))
+
+            self.journal_records += 1
+            self._entries = entries
+            self._signatures = self._current_signatures()
+
+    def _append_records(self, records):
+        with open(self.journal_path, "ab") as f:
+            for record in records:
+                f.write(encode_record(record))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_snapshot(self, entries):
+        """Compaction: writes the full routine as a new snapshot and drops the journal."""
+        data = json.dumps(entries, indent=4).encode("utf-8")
+        with self._lock:
+            if _signature(self.journal_path) is not None:
+                # A crash between the snapshot write and the remove below leaves a journal whose base
+                # no longer matches; this marker tells load() that it was folded in, not edited around
+                self._append_records([{"compacted": zlib.crc32(data)}])
+            atomic_write(self.path, data)
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            self.journal_records = 0
+            self._base = zlib.crc32(data)
+            self._entries = entries
+            self._signatures = self._current_signatures()
+
+
+# ========== SQLite backend ==========
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def _spans(start_min, end_min):
+    """Splits an entry into the [lo, hi) minute spans it covers (wrapping slots become two)."""
+    if start_min < end_min:
+        return [(start_min, end_min)]
+    if start_min > end_min:
+        return [(start_min, MINUTES_PER_DAY)] + ([(0, end_min)] if end_min > 0 else [])
+    return [(0, MINUTES_PER_DAY)]  # start == end covers the whole day
+
+
+def _contains_ci(text, keyword):
+    return int(keyword.lower() in (text or "").lower())
+
+
+class SqliteRoutineStore:
+    """
+    SQLite-backed routine with the same read interface as RoutineIndex (len, sorted_entries,
+    current, next_after) and the same edit interface as RoutineTransaction (via begin()).
+
+      * routine(start_min, id) b-tree index: ordered listing and next-task lookup;
+      * routine_owner: the entry in progress at each of the 1440 minutes of the day (the
+        earliest-starting one on overlaps), kept up to date by every edit, so "current task"
+        is one primary-key lookup;
+      * routine_span R*Tree: the minute spans each entry covers, so an edit only looks at the
+        entries overlapping the minutes it changed;
+      * routine_text FTS5 trigram index: substring keyword matches for removals.
+    Entries are ordered by start time, ties by insertion order (what add_routine_entry's sort
+    produces for routine.json). Without R*Tree or FTS5 support the same queries fall back to
+    plain scans.
+    """
+
+    def __init__(self, db_path, to_minutes):
+        self.to_minutes = to_minutes
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.create_function("contains_ci", 2, _contains_ci, deterministic=True)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS routine (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start TEXT NOT NULL,
+                "end" TEXT NOT NULL,
+                activity TEXT NOT NULL,
+                start_min INTEGER NOT NULL,
+                end_min INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS routine_start ON routine (start_min, id);
+            CREATE INDEX IF NOT EXISTS routine_end ON routine (end_min);
+            CREATE TABLE IF NOT EXISTS routine_owner (minute INTEGER PRIMARY KEY, id INTEGER);
+            CREATE INDEX IF NOT EXISTS routine_owner_id ON routine_owner (id);
+        """)
+        self.has_rtree = self._try_execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS routine_span USING rtree(id, lo, hi)")
+        self.has_fts = self._try_execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS routine_text USING fts5("
+            "activity, content='routine', content_rowid='id', tokenize='trigram')")
+        if self._db.execute("SELECT COUNT(*) FROM routine_owner").fetchone()[0] != MINUTES_PER_DAY:
+            # A new database, or one written before routine_owner existed
+            with self.begin():
+                self._db.execute("DELETE FROM routine_owner")
+                self._db.executemany("INSERT INTO routine_owner (minute) VALUES (?)",
+                                     [(minute,) for minute in range(MINUTES_PER_DAY)])
+                self._refresh_owners(range(MINUTES_PER_DAY))
+
+    def _try_execute(self, sql):
+        try:
+            self._db.execute(sql)
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --- Reads ---
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM routine").fetchone()[0]
+
+    def __bool__(self):
+        # `if not index` is on every lookup's path; COUNT(*) would visit every row
+        with self._lock:
+            return self._db.execute("SELECT EXISTS (SELECT 1 FROM routine)").fetchone()[0] == 1
+
+    @staticmethod
+    def _entry(row):
+        return {"start": row[0], "end": row[1], "activity": row[2]} if row else None
+
+    @property
+    def sorted_entries(self):
+        with self._lock:
+            rows = self._db.execute('SELECT start, "end", activity FROM routine ORDER BY start_min, id').fetchall()
+        return [self._entry(row) for row in rows]
+
+    def current(self, minute):
+        """Returns the entry in progress at `minute`, or None (the earliest-starting one on overlaps)."""
+        with self._lock:
+            return self._entry(self._db.execute(
+                'SELECT r.start, r."end", r.activity FROM routine_owner o JOIN routine r ON r.id = o.id '
+                'WHERE o.minute = ?', (minute,)).fetchone())
+
+    def next_after(self, minute):
+        """Returns the first entry starting at or after `minute`, wrapping to the first of the day."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT start, "end", activity FROM routine WHERE start_min >= ? ORDER BY start_min, id LIMIT 1',
+                (minute,)).fetchone()
+            if row is None:
+                row = self._db.execute(
+                    'SELECT start, "end", activity FROM routine ORDER BY start_min, id LIMIT 1').fetchone()
+        return self._entry(row)
+
+    def next_transition(self, minute):
+        """Same contract as RoutineIndex.next_transition, walking the indexed start/end boundaries."""
+        def boundary_after(m):
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT MIN(b) FROM (SELECT MIN(start_min) AS b FROM routine WHERE start_min > :m "
+                    "UNION ALL SELECT MIN(end_min) FROM routine WHERE end_min > :m)", {"m": m}).fetchone()
+            return row[0]
+
+        owner = self.current(minute)
+        position = minute  # minutes since the start of today, may run into tomorrow
+        while True:
+            day_start = position - position % MINUTES_PER_DAY
+            boundary = boundary_after(position % MINUTES_PER_DAY)
+            if boundary is None:  # nothing later that day: continue from the next midnight
+                boundary = boundary_after(-1)
+                if boundary is None:
+                    return None
+                day_start += MINUTES_PER_DAY
+            position = day_start + boundary
+            if position > minute + MINUTES_PER_DAY:
+                return None
+            if self.current(boundary) != owner:
+                return position
+
+    # --- Edits ---
+
+    def begin(self):
+        """Starts a write transaction; the store stays locked until commit() or rollback()."""
+        return SqliteRoutineTransaction(self)
+
+    def _refresh_owners(self, minutes):
+        """Recomputes routine_owner for `minutes` (ascending) from the entries covering them."""
+        unowned = list(minutes)
+        if not unowned:
+            return
+        owners = {}
+        if self.has_rtree and len(unowned) < MINUTES_PER_DAY:
+            rows = self._db.execute(
+                "SELECT id, start_min, end_min FROM routine WHERE id IN "
+                "(SELECT id / 2 FROM routine_span WHERE lo < :hi AND hi > :lo) ORDER BY start_min, id",
+                {"lo": unowned[0], "hi": unowned[-1] + 1})
+        else:
+            rows = self._db.execute("SELECT id, start_min, end_min FROM routine ORDER BY start_min, id")
+        # In start order, each minute goes to the first entry that covers it
+        for entry_id, start_min, end_min in rows:
+            for lo, hi in _spans(start_min, end_min):
+                first, last = bisect_left(unowned, lo), bisect_left(unowned, hi)
+                for minute in unowned[first:last]:
+                    owners[minute] = entry_id
+                del unowned[first:last]
+            if not unowned:
+                break
+        rows.close()
+        self._db.executemany("UPDATE routine_owner SET id = ? WHERE minute = ?",
+                             [(owners.get(minute), minute) for minute in minutes])
+
+    def _insert(self, entries, owners=True):
+        for entry in entries:
+            start_min, end_min = self.to_minutes(entry["start"]), self.to_minutes(entry["end"])
+            entry_id = self._db.execute(
+                'INSERT INTO routine (start, "end", activity, start_min, end_min) VALUES (?, ?, ?, ?, ?)',
+                (entry["start"], entry["end"], entry["activity"], start_min, end_min)).lastrowid
+            if owners:
+                # The newest entry only takes the minutes whose owner starts later (ties keep the older one)
+                for lo, hi in _spans(start_min, end_min):
+                    self._db.execute(
+                        "UPDATE routine_owner SET id = :id WHERE minute >= :lo AND minute < :hi AND (id IS NULL "
+                        "OR (SELECT start_min FROM routine WHERE routine.id = routine_owner.id) > :start)",
+                        {"id": entry_id, "lo": lo, "hi": hi, "start": start_min})
+            if self.has_rtree:
+                self._db.executemany(
+                    "INSERT INTO routine_span (id, lo, hi) VALUES (?, ?, ?)",
+                    [(entry_id * 2 + part, lo, hi) for part, (lo, hi) in enumerate(_spans(start_min, end_min))])
+            if self.has_fts:
+                self._db.execute("INSERT INTO routine_text (rowid, activity) VALUES (?, ?)",
+                                 (entry_id, entry["activity"]))
+
+    def _matching_rows(self, activity_keyword, limit=-1):
+        """(id, activity) of up to `limit` entries whose activity contains the keyword (-1: all)."""
+        if self.has_fts and len(activity_keyword) >= 3:
+            # The trigram index narrows the candidates; contains_ci keeps Python's exact matching rules
+            phrase = '"' + activity_keyword.replace('"', '""') + '"'
+            return self._db.execute(
+                "SELECT id, activity FROM routine WHERE id IN "
+                "(SELECT rowid FROM routine_text WHERE routine_text MATCH ?) AND contains_ci(activity, ?) LIMIT ?",
+                (phrase, activity_keyword, limit)).fetchall()
+        return self._db.execute("SELECT id, activity FROM routine WHERE contains_ci(activity, ?) LIMIT ?",
+                                (activity_keyword, limit)).fetchall()
+
+    def matching_activities(self, activity_keyword, limit=None):
+        """Same as RoutineIndex.matching_activities, answered through the keyword index."""
+        with self._lock:
+            return [activity for _, activity in self._matching_rows(activity_keyword, -1 if limit is None else limit)]
+
+    def _remove_matching(self, activity_keyword):
+        rows = self._matching_rows(activity_keyword)
+        orphaned = set()
+        for entry_id, activity in rows:
+            orphaned.update(minute for (minute,) in self._db.execute(
+                "SELECT minute FROM routine_owner WHERE id = ?", (entry_id,)))
+            self._db.execute("DELETE FROM routine WHERE id = ?", (entry_id,))
+            if self.has_rtree:
+                self._db.execute("DELETE FROM routine_span WHERE id IN (?, ?)", (entry_id * 2, entry_id * 2 + 1))
+            if self.has_fts:
+                self._db.execute("INSERT INTO routine_text (routine_text, rowid, activity) VALUES ('delete', ?, ?)",
+                                 (entry_id, activity))
+        self._refresh_owners(sorted(orphaned))
+        return len(rows)
+
+    def import_entries(self, entries):
+        """Replaces the stored routine with `entries` (e.g. the contents of routine.json)."""
+        ordered = sorted(entries, key=lambda e: self.to_minutes(e["start"]))
+        with self.begin():
+            self._db.execute("DELETE FROM routine")
+            if self.has_rtree:
+                self._db.execute("DELETE FROM routine_span")
+            if self.has_fts:
+                self._db.execute("INSERT INTO routine_text (routine_text) VALUES ('delete-all')")
+            self._insert(ordered, owners=False)  # one sweep below instead of an update per entry
+            self._refresh_owners(range(MINUTES_PER_DAY))
+
+
+class SqliteRoutineTransaction:
+    """Routine edits inside one SQLite transaction; same add/remove_matching/commit API as RoutineTransaction."""
+
+    def __init__(self, store):
+        self.store = store
+        self.changed = False
+        store._lock.acquire()
+        try:
+            store._db.execute("BEGIN IMMEDIATE")
+        except Exception:
+            store._lock.release()
+            raise
+
+    def add(self, entry):
+        self.store._insert([entry])
+        self.changed = True
+
+    def remove_matching(self, activity_keyword):
+        removed_count = self.store._remove_matching(activity_keyword)
+        self.changed = self.changed or removed_count > 0
+        return removed_count
+
+    def commit(self):
+        try:
+            self.store._db.execute("COMMIT")
+        finally:
+            self.store._lock.release()
+        return True
+
+    def rollback(self):
+        try:
+            self.store._db.execute("ROLLBACK")
+        finally:
+            self.store._lock.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
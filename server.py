@@ -0,0 +1,539 @@
+"""
+Multi-user server mode for Ishu: one process serving many household devices.
+
+    python server.py [--host 127.0.0.1] [--port 8765] [--token SECRET] [--data-dir users] [--llm-slots 2] ...
+
+Every user gets their own routine files under <data-dir>/<user>/, every session
+its own bounded chat history, and all of them share the pooled Ollama client.
+Requests to a model wait in an admission.ModelGates queue, which is fair across
+users and bounded. When it is full the turn is refused with 503 (or a "busy"
+WebSocket message) instead of piling up.
+
+With a token (--token or ISHU_SERVER_TOKEN), every request except /health must
+send "Authorization: Bearer <token>"; browsers opening a WebSocket may pass
+?token=<token> instead. The server listens on localhost by default and refuses
+any other address without a token.
+
+HTTP (JSON bodies and replies):
+    GET    /health                       session count and LLM queue stats
+    GET    /users/<user>/routine         the user's routine
+    POST   /users/<user>/tools/<tool>    runs a routine tool with the JSON body as its arguments
+    POST   /users/<user>/sessions        opens a chat session -> {"session": id}
+    POST   /sessions/<id>/chat           {"message": ...} -> {"reply": ...}
+    DELETE /sessions/<id>                closes a session
+
+WebSocket:
+    GET /ws/<user>[?session=<id>]        send {"message": ...} (or plain text) and receive
+                                         {"type": "sentence", "text": ...} while the reply streams,
+                                         then {"type": "reply", "text": ..., "session": id}
+
+Connections are handled by asyncio; turns run on a thread pool, because the
+assistant's LLM and tool code is blocking.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import re
+import struct
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import admission
+import assistant
+import http_client
+from tool_calls import validate_tool_calls
+
+USER_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+MAX_BODY_BYTES = 1 << 20
+MAX_HEADERS = 100
+RETRY_AFTER_SECONDS = 2
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+               503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ========== WebSocket frames (RFC 6455) ==========
+
+def _mask(payload, key):
+    repeated = (key * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")).to_bytes(len(payload), "big")
+
+
+def encode_frame(payload, opcode=OP_TEXT, mask_key=None):
+    """One final frame. Clients must pass a 4-byte mask_key; servers send unmasked frames."""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    mask_bit = 0x80 if mask_key else 0
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, mask_bit | 127, length)
+    if mask_key:
+        return header + mask_key + _mask(payload, mask_key)
+    return header + payload
+
+
+async def read_frame(reader):
+    """Returns (fin, opcode, payload) of the next frame, unmasked."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "WebSocket frame too large")
+    key = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    return bool(first & 0x80), first & 0x0F, _mask(payload, key) if key else payload
+
+
+def websocket_accept(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+
+
+# ========== HTTP/1.1 ==========
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HTTPError(400, "The body is not valid JSON.")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "The body must be a JSON object.")
+        return data
+
+
+async def read_request(reader):
+    """Reads one request; None when the client closed the connection between requests."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line.")
+
+    headers = {}
+    for _ in range(MAX_HEADERS):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(400, "Too many headers.")
+
+    length = headers.get("content-length") or "0"
+    if not length.isdigit():
+        raise HTTPError(400, "Invalid Content-Length.")
+    length = int(length)
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large.")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+
+def encode_response(status, payload, keep_alive=True, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+             "Content-Type: application/json; charset=utf-8",
+             f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}",
+             *headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+# ========== Sessions ==========
+
+class Session:
+    def __init__(self, user_id):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.history = assistant.new_chat_history()  # token-budgeted, so bounded per session
+        self.lock = asyncio.Lock()                    # one turn at a time per session
+        self.last_used = time.monotonic()
+
+
+class SessionManager:
+    """Open sessions, most recently used last. The least recently used are dropped beyond max_sessions or when idle."""
+
+    def __init__(self, max_sessions=1000, idle_timeout=3600):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def open(self, user_id):
+        self._expire()
+        session = Session(user_id)
+        self._sessions[session.id] = session
+        if len(self._sessions) > self.max_sessions:
+            # Least recently used first, but never a session whose turn is still running
+            for old in list(self._sessions.values()):
+                if len(self._sessions) <= self.max_sessions:
+                    break
+                if old is not session and not old.lock.locked():
+                    del self._sessions[old.id]
+        return session
+
+    def get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, "Unknown or expired session.")
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def close(self, session_id):
+        return self._sessions.pop(session_id, None) is not None
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used >= cutoff or session.lock.locked():
+                break
+            del self._sessions[session.id]
+
+
+# ========== Server ==========
+
+class IshuServer:
+    def __init__(self, data_dir="users", host="127.0.0.1", port=8765, workers=64,
+                 max_sessions=1000, idle_timeout=3600, max_turns=None, token=None):
+        self.data_dir = data_dir
+        self.host = host
+        self.port = port
+        self.token = token
+        self.sessions = SessionManager(max_sessions, idle_timeout)
+        # Turns beyond this are refused at once; the LLM gate decides the order of the rest
+        self.max_turns = max_turns or 4 * workers
+        self.turns_in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ishu-turn")
+        self._server = None
+        self._routes = [
+            ("GET", re.compile(r"/health"), self.health),
+            ("GET", re.compile(r"/users/([^/]+)/routine"), self.get_routine),
+            ("POST", re.compile(r"/users/([^/]+)/tools/([^/]+)"), self.run_tool),
+            ("POST", re.compile(r"/users/([^/]+)/sessions"), self.open_session),
+            ("POST", re.compile(r"/sessions/([^/]+)/chat"), self.chat_request),
+            ("DELETE", re.compile(r"/sessions/([^/]+)"), self.close_session),
+        ]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        return self.host, self.port
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._executor.shutdown(wait=False)
+
+    # ---------- Running assistant code for a user ----------
+
+    def _user_paths(self, user_id):
+        if not USER_ID.fullmatch(user_id):
+            raise HTTPError(400, "User ids are 1-64 letters, digits, '-' or '_'.")
+        directory = os.path.join(self.data_dir, user_id)
+        return os.path.join(directory, "routine.json"), os.path.join(directory, "routine.db")
+
+    def _call_as(self, user_id, function, args):
+        routine_file, routine_db = self._user_paths(user_id)
+        os.makedirs(os.path.dirname(routine_file), exist_ok=True)
+        with assistant.user_context(user_id, routine_file, routine_db):
+            return function(*args)
+
+    async def run_as(self, user_id, function, *args):
+        """Runs blocking assistant code on the thread pool, on behalf of user_id."""
+        self._user_paths(user_id)  # validate before queueing
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call_as, user_id, function, args)
+
+    async def chat(self, session, message, on_sentence=None):
+        """
+        Runs one turn of `session`; on_sentence(text) is called on the event loop for every
+        sentence streamed before the reply is complete. Raises admission.Overloaded when refused.
+        """
+        if self.turns_in_flight >= self.max_turns:
+            raise admission.Overloaded(f"{self.turns_in_flight} turns in flight")
+        loop = asyncio.get_running_loop()
+        sentences = []
+
+        def stream_sentence(sentence):  # on a worker thread
+            sentences.append(sentence)
+            loop.call_soon_threadsafe(on_sentence, sentence)
+
+        def turn():
+            with assistant.TRACER.turn(message):
+                return assistant.respond(message, session.history, on_sentence=stream_sentence if on_sentence else None)
+
+        self.turns_in_flight += 1
+        try:
+            async with session.lock:
+                session.last_used = time.monotonic()
+                reply = await self.run_as(session.user_id, turn)
+        finally:
+            self.turns_in_flight -= 1
+        return reply or " ".join(sentences)
+
+    # ---------- HTTP handlers: (request, *path groups) -> JSON payload ----------
+
+    async def health(self, request):
+        gates = assistant.OLLAMA_GATES.stats() if assistant.OLLAMA_GATES is not None else {}
+        return {"status": "ok", "sessions": len(self.sessions), "turns_in_flight": self.turns_in_flight, "llm": gates}
+
+    async def get_routine(self, request, user_id):
+        return {"routine": _decode(await self.run_as(user_id, assistant.get_routine))}
+
+    async def run_tool(self, request, user_id, tool):
+        function = assistant.TOOL_MAPPER.get(tool)
+        if function is None:
+            raise HTTPError(404, f"Unknown tool '{tool}'.")
+        try:
+            # Same checks as the tool model's calls: the arguments must bind and have the right types
+            (call,) = validate_tool_calls({"tool_calls": [{"name": tool, "arguments": request.json()}]},
+                                          assistant.TOOL_MAPPER)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        output = await self.run_as(user_id, lambda: function(**call["arguments"]))
+        return {"output": _decode(output)}
+
+    async def open_session(self, request, user_id):
+        self._user_paths(user_id)
+        return {"session": self.sessions.open(user_id).id}
+
+    async def chat_request(self, request, session_id):
+        message = str(request.json().get("message", "")).strip()
+        if not message:
+            raise HTTPError(400, "'message' is required.")
+        session = self.sessions.get(session_id)
+        return {"session": session.id, "reply": await self.chat(session, message)}
+
+    async def close_session(self, request, session_id):
+        if not self.sessions.close(session_id):
+            raise HTTPError(404, "Unknown or expired session.")
+        return {"closed": session_id}
+
+    async def _dispatch(self, request):
+        allowed = False
+        for method, pattern, handler in self._routes:
+            match = pattern.fullmatch(request.path)
+            if match:
+                if method == request.method:
+                    return await handler(request, *match.groups())
+                allowed = True
+        raise HTTPError(405 if allowed else 404, f"No route for {request.method} {request.path}.")
+
+    # ---------- Connections ----------
+
+    def _check_token(self, request):
+        if self.token is None or request.path == "/health":
+            return
+        given = request.headers.get("authorization", "")
+        given = given[len("Bearer "):] if given.startswith("Bearer ") else request.query.get("token", "")
+        if not hmac.compare_digest(given.encode("utf-8"), self.token.encode("utf-8")):
+            raise HTTPError(401, "A valid token is required.")
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = None
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    self._check_token(request)
+                    if request.headers.get("upgrade", "").lower() == "websocket":
+                        match = re.fullmatch(r"/ws/([^/]+)", request.path)
+                        if request.method != "GET" or not match:
+                            raise HTTPError(404, "WebSocket endpoint is /ws/<user>.")
+                        await self._websocket(request, match.group(1), reader, writer)
+                        break
+                    status, payload, headers = 200, await self._dispatch(request), ()
+                except HTTPError as e:
+                    status, payload, headers = e.status, {"error": str(e)}, ()
+                    if e.status == 401:
+                        headers = ('WWW-Authenticate: Bearer realm="ishu"',)
+                except admission.Overloaded as e:
+                    status, payload = 503, {"error": "busy", "detail": str(e)}
+                    headers = (f"Retry-After: {RETRY_AFTER_SECONDS}",)
+                except Exception as e:
+                    print(f"Error handling {request.method + ' ' + request.path if request else 'a request'}: {e!r}")
+                    status, payload, headers = 500, {"error": "Internal server error."}, ()
+                keep_alive = request is not None and request.headers.get("connection", "").lower() != "close"
+                writer.write(encode_response(status, payload, keep_alive, headers))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _websocket(self, request, user_id, reader, writer):
+        key = request.headers.get("sec-websocket-key")
+        if not key:
+            raise HTTPError(400, "Missing Sec-WebSocket-Key.")
+        self._user_paths(user_id)
+        session_id = request.query.get("session")
+        session = self.sessions.get(session_id) if session_id else self.sessions.open(user_id)
+        if session.user_id != user_id:
+            raise HTTPError(404, "Unknown or expired session.")
+
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n").encode("latin-1"))
+
+        def send(payload):
+            writer.write(encode_frame(json.dumps(payload, ensure_ascii=False)))
+
+        send({"type": "session", "session": session.id})
+        await writer.drain()
+        fragments = []
+        while True:
+            try:
+                fin, opcode, payload = await read_frame(reader)
+            except HTTPError:
+                writer.write(encode_frame(struct.pack("!H", 1009), OP_CLOSE))  # message too big
+                await writer.drain()
+                return
+            if opcode == OP_CLOSE:
+                writer.write(encode_frame(payload[:2], OP_CLOSE))
+                await writer.drain()
+                return
+            if opcode == OP_PING:
+                writer.write(encode_frame(payload, OP_PONG))
+                continue
+            if opcode not in (OP_TEXT, OP_CONTINUATION):
+                continue
+            fragments.append(payload)
+            if not fin:
+                continue
+            text, fragments = b"".join(fragments).decode("utf-8", "replace"), []
+
+            try:
+                message = json.loads(text).get("message", "") if text.lstrip().startswith("{") else text
+            except ValueError:
+                message = text
+            message = str(message).strip()
+            if not message:
+                send({"type": "error", "error": "'message' is required."})
+                continue
+            try:
+                reply = await self.chat(session, message,
+                                        on_sentence=lambda sentence: send({"type": "sentence", "text": sentence}))
+                send({"type": "reply", "text": reply, "session": session.id})
+            except admission.Overloaded as e:
+                send({"type": "error", "error": "busy", "detail": str(e), "retry_after": RETRY_AFTER_SECONDS})
+            except Exception as e:
+                print(f"Error in a WebSocket turn for {user_id}: {e!r}")
+                send({"type": "error", "error": "Internal server error."})
+            await writer.drain()
+
+
+def _decode(output):
+    """Tool outputs are mostly JSON strings; embed them as JSON when they are."""
+    try:
+        return json.loads(output)
+    except (TypeError, ValueError):
+        return output
+
+
+# ========== Command line ==========
+
+def configure_llm(slots, max_waiting, queue_timeout):
+    """Shares one admission gate per model between all sessions and sizes the HTTP pool to match."""
+    assistant.OLLAMA_GATES = admission.ModelGates(slots, max_waiting=max_waiting, timeout=queue_timeout)
+    if http_client.POOL_MAXSIZE < slots:
+        http_client.POOL_MAXSIZE = slots
+        http_client.close_session()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ishu server: routine tools and chat for many users over HTTP/WebSocket.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token", default=os.environ.get("ISHU_SERVER_TOKEN"),
+                        help="bearer token clients must send (default: $ISHU_SERVER_TOKEN); required off localhost")
+    parser.add_argument("--data-dir", default="users", help="per-user routine files go to DATA_DIR/<user>/")
+    parser.add_argument("--llm-slots", type=int, default=2, help="concurrent requests per Ollama model")
+    parser.add_argument("--max-waiting", type=int, default=256, help="LLM requests allowed to queue per model")
+    parser.add_argument("--queue-timeout", type=float, default=60.0, help="seconds an LLM request may wait")
+    parser.add_argument("--workers", type=int, default=64, help="threads running turns and tools")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--idle-timeout", type=float, default=3600.0, help="seconds before an idle session is dropped")
+    return parser.parse_args(argv)
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+async def main_async(args):
+    if not args.token and not is_loopback(args.host):
+        raise SystemExit(f"Refusing to listen on {args.host} without a token: pass --token or set ISHU_SERVER_TOKEN.")
+    configure_llm(args.llm_slots, args.max_waiting, args.queue_timeout)
+    assistant.start_ollama_warmup()
+    server = IshuServer(args.data_dir, args.host, args.port, workers=args.workers,
+                        max_sessions=args.max_sessions, idle_timeout=args.idle_timeout, token=args.token or None)
+    host, port = await server.start()
+    print(f"Ishu server listening on http://{host}:{port} (WebSocket: ws://{host}:{port}/ws/<user>)")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main_async(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,317 @@
+"""
+Speech-to-text helpers for Ishu.
+
+WhisperModelManager loads the Whisper model in a background thread as soon as
+the assistant starts, so the first spoken command does not stall on a cold
+model load. The audio helpers turn recorded PCM straight into the float32
+16 kHz array Whisper expects, so no temporary WAV file or ffmpeg process is
+needed per command. ContinuousListener keeps the microphone open behind an
+energy VAD and transcribes overlapping chunks while the user is still talking.
+"""
+import threading
+
+WHISPER_MODEL_SIZES = ("tiny", "base", "small")
+WHISPER_SAMPLE_RATE = 16000
+
+
+class WhisperModelManager:
+    """
+    Loads (and optionally int8-quantizes and warms up) a Whisper model in the background.
+
+    state goes idle -> loading -> warming -> ready, or -> failed (see `error`).
+    Callers that need the model use wait(), which blocks only until loading finishes.
+    """
+
+    def __init__(self, size="base", quantize=False, warmup=True, device=None):
+        if size not in WHISPER_MODEL_SIZES:
+            raise ValueError(f"Unsupported Whisper model size '{size}'. Choose one of {WHISPER_MODEL_SIZES}.")
+        self.size = size
+        self.quantize = quantize
+        self.warmup = warmup
+        # Dynamic int8 quantization only runs on CPU
+        self.device = "cpu" if quantize else device
+        self.state = "idle"
+        self.error = None
+        self.model = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        """Starts loading in a daemon thread; calling it again is a no-op."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.state = "loading"
+            self._thread = threading.Thread(target=self._load, name="whisper-loader", daemon=True)
+            self._thread.start()
+
+    def _load(self):
+        try:
+            import whisper
+
+            print(f"Loading Whisper '{self.size}' model in the background...")
+            model = whisper.load_model(self.size, device=self.device)
+
+            if self.quantize:
+                import torch
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+            if self.warmup:
+                self.state = "warming"
+                import numpy
+                # One second of silence runs every kernel once so the first real query is fast
+                model.transcribe(numpy.zeros(16000, dtype=numpy.float32), fp16=False)
+
+            self.model = model
+            self.state = "ready"
+            print("Whisper model ready.")
+        except Exception as e:
+            self.error = e
+            self.state = "failed"
+            print(f"Error loading Whisper model: {e}")
+        finally:
+            self._done.set()
+
+    def is_ready(self):
+        return self.state == "ready"
+
+    def wait(self, timeout=None):
+        """Starts loading if needed and returns the model, or None if loading failed or timed out."""
+        self.start()
+        self._done.wait(timeout)
+        return self.model
+
+
+# ========== In-memory audio conversion ==========
+
+def resample(samples, rate, target_rate=WHISPER_SAMPLE_RATE):
+    """Resamples a float32 mono signal in-process (torchaudio when available, else linear)."""
+    import numpy
+
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    try:
+        import torch
+        import torchaudio
+        return torchaudio.functional.resample(torch.from_numpy(samples), rate, target_rate).numpy()
+    except ImportError:
+        target_length = int(round(len(samples) * target_rate / rate))
+        positions = numpy.linspace(0, len(samples) - 1, target_length)
+        return numpy.interp(positions, numpy.arange(len(samples)), samples).astype(numpy.float32)
+
+
+def pcm16_to_float32(raw, sample_rate, target_rate=WHISPER_SAMPLE_RATE):
+    """Converts little-endian 16-bit mono PCM bytes to a float32 array in [-1, 1) at target_rate."""
+    import numpy
+
+    samples = numpy.frombuffer(raw, dtype="<i2").astype(numpy.float32) / 32768.0
+    return resample(samples, sample_rate, target_rate)
+
+
+def audio_data_to_array(audio):
+    """Converts a speech_recognition AudioData into the array Whisper's transcribe() accepts."""
+    return pcm16_to_float32(audio.get_raw_data(convert_width=2), audio.sample_rate)
+
+
+# ========== Continuous capture: energy VAD + chunked incremental transcription ==========
+
+class EnergyVAD:
+    """
+    Lightweight energy-based voice activity detector over 16-bit PCM frames.
+
+    The noise floor is an exponential moving average of the RMS of non-speech frames and
+    is kept across turns, so there is no per-turn ambient-noise calibration.
+    """
+
+    def __init__(self, threshold_ratio=3.0, min_threshold=200.0, adapt_rate=0.05):
+        self.threshold_ratio = threshold_ratio
+        self.min_threshold = min_threshold
+        self.adapt_rate = adapt_rate
+        self.noise_floor = None
+
+    @staticmethod
+    def rms(frame):
+        import numpy
+
+        samples = numpy.frombuffer(frame, dtype="<i2").astype(numpy.float32)
+        return float(numpy.sqrt(numpy.mean(samples * samples))) if len(samples) else 0.0
+
+    def calibrate(self, frames):
+        """Seeds the noise floor from frames known to be silence."""
+        levels = [self.rms(frame) for frame in frames]
+        if levels:
+            self.noise_floor = sum(levels) / len(levels)
+
+    @property
+    def threshold(self):
+        return max(self.min_threshold, (self.noise_floor or 0.0) * self.threshold_ratio)
+
+    def is_speech(self, frame):
+        level = self.rms(frame)
+        if self.noise_floor is None:
+            self.noise_floor = level
+        speech = level > self.threshold
+        if not speech:
+            self.noise_floor += self.adapt_rate * (level - self.noise_floor)
+        return speech
+
+
+def merge_overlap(previous, new, max_words=8):
+    """Joins two transcripts, dropping words repeated because their audio chunks overlapped."""
+    old_words, new_words = previous.split(), new.split()
+
+    def normalise(words):
+        return [w.lower().strip(".,!?;:") for w in words]
+
+    for k in range(min(max_words, len(old_words), len(new_words)), 0, -1):
+        if normalise(old_words[-k:]) == normalise(new_words[:k]):
+            return " ".join(old_words + new_words[k:])
+    return " ".join(old_words + new_words)
+
+
+class StreamingTranscriber:
+    """
+    Transcribes an utterance while it is still being spoken.
+
+    Audio is cut into overlapping chunks; each chunk goes to Whisper as soon as it is full,
+    so when speech ends only the short tail is left to transcribe.
+    """
+
+    def __init__(self, get_model, sample_rate=WHISPER_SAMPLE_RATE, chunk_seconds=4.0,
+                 overlap_seconds=0.5, on_partial=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.get_model = get_model
+        self.sample_rate = sample_rate
+        self.chunk_bytes = int(chunk_seconds * sample_rate) * 2
+        self.overlap_bytes = int(overlap_seconds * sample_rate) * 2
+        self.on_partial = on_partial
+        self.text = ""
+        self._audio = bytearray()
+        self._chunk_start = 0
+        self._pending = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper-chunks")
+
+    def _transcribe(self, raw):
+        model = self.get_model()
+        if not model:
+            return
+        result = model.transcribe(
+            pcm16_to_float32(bytes(raw), self.sample_rate), fp16=False, initial_prompt=self.text or None
+        )
+        self.text = merge_overlap(self.text, result["text"].strip())
+        if self.on_partial:
+            self.on_partial(self.text)
+
+    def feed(self, frame):
+        self._audio.extend(frame)
+        while len(self._audio) - self._chunk_start >= self.chunk_bytes:
+            chunk = self._audio[self._chunk_start:self._chunk_start + self.chunk_bytes]
+            self._pending.append(self._executor.submit(self._transcribe, chunk))
+            self._chunk_start += self.chunk_bytes - self.overlap_bytes
+
+    def finish(self):
+        """Transcribes the remaining tail and returns the full transcript."""
+        if len(self._audio) - self._chunk_start > self.overlap_bytes or not self._pending:
+            self._pending.append(self._executor.submit(self._transcribe, self._audio[self._chunk_start:]))
+        for future in self._pending:
+            future.result()
+        self._executor.shutdown(wait=False)
+        return self.text.strip()
+
+
+class ContinuousListener:
+    """
+    Keeps the microphone open across turns and returns one transcribed utterance per listen().
+
+    Frames go through EnergyVAD; an utterance starts after a few voiced frames (with a short
+    pre-roll so the first syllable is not clipped) and ends after `silence_ms` of silence.
+    The microphone is opened at the device's native rate (many devices reject 16 kHz) and the
+    audio is resampled for Whisper; open() raises if the device cannot be opened at all.
+    """
+
+    def __init__(self, get_model, vad=None, frame_ms=30, start_frames=3, silence_ms=450,
+                 pre_roll_ms=300, start_timeout=5, max_utterance_seconds=15, on_partial=None):
+        self.get_model = get_model
+        self.vad = vad or EnergyVAD()
+        self.frame_ms = frame_ms
+        self.sample_rate = None
+        self.frame_samples = None
+        self.start_frames = start_frames
+        self.silence_frames = max(1, silence_ms // frame_ms)
+        self.pre_roll_frames = max(1, pre_roll_ms // frame_ms)
+        self.calibration_frames = max(1, 500 // frame_ms)
+        self.timeout_frames = int(start_timeout * 1000 / frame_ms)
+        self.max_frames = int(max_utterance_seconds * 1000 / frame_ms)
+        self.on_partial = on_partial
+        self._source = None
+
+    def open(self):
+        if self._source is None:
+            import speech_recognition as sr
+
+            source = sr.Microphone()  # the device's default sample rate
+            source.__enter__()
+            self._source = source
+            self.sample_rate = source.SAMPLE_RATE
+            self.frame_samples = int(self.sample_rate * self.frame_ms / 1000)
+            # Calibrate once (~0.5 s); afterwards the VAD keeps tracking the noise floor itself
+            try:
+                self.vad.calibrate([self._read() for _ in range(self.calibration_frames)])
+            except BaseException:
+                self.close()  # release the device, so a fallback can open it again
+                raise
+        return self._source
+
+    def _read(self):
+        return self._source.stream.read(self.frame_samples)
+
+    def _drain(self):
+        """Discards audio buffered while Ishu was talking, so it is not taken as a query."""
+        stream = getattr(self._source.stream, "pyaudio_stream", None)
+        if stream is not None:
+            available = stream.get_read_available()
+            if available:
+                self._source.stream.read(available)
+
+    def listen(self):
+        """Waits for one utterance and returns its transcript ("" on timeout)."""
+        from collections import deque
+
+        self.open()
+        self._drain()
+        print("Whisper Listening...")
+
+        pre_roll = deque(maxlen=self.pre_roll_frames)
+        voiced = 0
+        for _ in range(self.timeout_frames):
+            frame = self._read()
+            pre_roll.append(frame)
+            voiced = voiced + 1 if self.vad.is_speech(frame) else 0
+            if voiced >= self.start_frames:
+                break
+        else:
+            print("No speech detected within the timeout period.")
+            return ""
+
+        transcriber = StreamingTranscriber(self.get_model, sample_rate=self.sample_rate, on_partial=self.on_partial)
+        for frame in pre_roll:
+            transcriber.feed(frame)
+
+        silent = 0
+        for _ in range(self.max_frames):
+            frame = self._read()
+            transcriber.feed(frame)
+            silent = 0 if self.vad.is_speech(frame) else silent + 1
+            if silent >= self.silence_frames:
+                break
+
+        text = transcriber.finish()
+        print(f"User said: {text}")
+        return text
+
+    def close(self):
+        if self._source is not None:
+            self._source.__exit__(None, None, None)
+            self._source = None
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from admission import FairGate, ModelGates, Overloaded
+
+
+def _queue(gate, key, order):
+    def run():
+        with gate.slot(key):
+            order.append(key)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_for_waiting(gate, count):
+    while gate.stats()["waiting"] < count:
+        threading.Event().wait(0.001)
+
+
+def test_waiting_requests_are_admitted_round_robin_across_users():
+    """Test that a user with several queued requests cannot starve another user's single request."""
+    gate = FairGate(limit=1)
+    order = []
+    gate.acquire("holder")
+
+    threads = []
+    for key in ("alice", "alice", "alice", "bob"):
+        threads.append(_queue(gate, key, order))
+        _wait_for_waiting(gate, len(threads))
+    gate.release()
+    for thread in threads:
+        thread.join(2)
+
+    assert order == ["alice", "bob", "alice", "alice"]
+    assert gate.stats() == {"limit": 1, "active": 0, "waiting": 0, "admitted": 5, "rejected": 0}
+
+
+def test_requests_beyond_the_queue_bound_or_timeout_are_refused():
+    """Test admission control: a full queue refuses at once, and a queued request gives up after the timeout."""
+    gate = FairGate(limit=1, max_waiting=1, timeout=0.05)
+    gate.acquire("alice")
+    waiter = threading.Thread(target=lambda: pytest.raises(Overloaded, gate.acquire, "bob"))
+    waiter.start()
+    _wait_for_waiting(gate, 1)
+
+    with pytest.raises(Overloaded):
+        gate.acquire("carol")
+    waiter.join(2)
+
+    assert gate.stats()["waiting"] == 0
+    assert gate.stats()["rejected"] == 2
+
+
+def test_model_gates_limit_each_model_separately():
+    """Test that a busy model does not block requests to another model."""
+    gates = ModelGates(limit=1, max_waiting=0)
+
+    with gates.slot("ishu-companion", "alice"):
+        with gates.slot("other-model", "alice"):
+            with pytest.raises(Overloaded):
+                gates.gate("ishu-companion").acquire("bob")
+
+    assert set(gates.stats()) == {"ishu-companion", "other-model"}
@@ -1,9 +1,8 @@
 import json
-import os
 import pytest
 import datetime 
 # Import the function parse_time to use the real logic for comparison
-from assistant import get_routine, get_task_by_time, add_routine_entry, remove_routine_entry, parse_time 
+from assistant import get_routine, get_task_by_time, add_routine_entry, remove_routine_entry, parse_time, RoutineIndex, to_minutes
 
 # --- Setup Fixtures (Mock Data) ---
 
@@ -39,6 +38,12 @@ def mock_json_file(tmp_path, mock_routine_data, monkeypatch):
 
     yield
 
+@pytest.fixture(autouse=True)
+def quiet_ollama(monkeypatch):
+    """Every model call reaches the (mocked) client: no response cache, no metrics output."""
+    monkeypatch.setattr('assistant.RESPONSE_CACHE', None)
+    monkeypatch.setattr('assistant.OLLAMA_SHOW_METRICS', False)
+
 
 # --- Test Cases ---
 
@@ -192,4 +197,450 @@ def test_remove_routine_entry_not_found():
     # 2. Verify the list size is unchanged (original 5)
     routine_json_string = get_routine()
     routine = json.loads(routine_json_string)
-    assert len(routine) == 5
\ No newline at end of file
+    assert len(routine) == 5
+
+# --- Routine Index Tests ---
+
+def test_routine_index_midnight_wrap_and_overlap():
+    """Test that wrapping slots and overlapping entries resolve like the original linear scan."""
+    index = RoutineIndex([
+        {"start": "13:30", "end": "17:00", "activity": "Project block"},
+        {"start": "14:00", "end": "14:30", "activity": "review meeting"},
+        {"start": "22:00", "end": "07:00", "activity": "Sleep"},
+    ])
+
+    # The first entry in file order wins on overlaps
+    assert index.current(to_minutes("14:15"))["activity"] == "Project block"
+    # Midnight-wrapping slot is found on both sides of midnight
+    assert index.current(to_minutes("23:30"))["activity"] == "Sleep"
+    assert index.current(to_minutes("03:00"))["activity"] == "Sleep"
+    # Free time returns no current task, and the next task is found by start time
+    assert index.current(to_minutes("08:00")) is None
+    assert index.next_after(to_minutes("08:00"))["activity"] == "Project block"
+
+
+def test_routine_index_publishes_next_transition():
+    """Test transition minutes: overlaps only change at the owner's edges, and midnight is not a change."""
+    index = RoutineIndex([
+        {"start": "13:30", "end": "17:00", "activity": "Project block"},
+        {"start": "14:00", "end": "14:30", "activity": "review meeting"},
+        {"start": "22:00", "end": "07:00", "activity": "Sleep"},
+    ])
+
+    assert index.transitions == [to_minutes("07:00"), to_minutes("13:30"), to_minutes("17:00"), to_minutes("22:00")]
+    assert index.next_transition(to_minutes("14:10")) == to_minutes("17:00")  # the meeting is shadowed
+    assert index.next_transition(to_minutes("23:00")) == to_minutes("07:00") + 24 * 60  # tomorrow
+    assert RoutineIndex([]).next_transition(0) is None
+
+
+@pytest.mark.parametrize("sort_file", [True, False])
+def test_routine_index_edits_match_a_rebuilt_index(sort_file):
+    """Test that incremental adds and removals give the same index as rebuilding from the edited routine."""
+    import random
+    from routine_store import apply_ops
+    rng = random.Random(3)
+    def entry(i):
+        return {"start": f"{rng.randrange(24):02d}:{rng.choice([0, 30]):02d}",
+                "end": f"{rng.randrange(24):02d}:{rng.choice([0, 30]):02d}",
+                "activity": f"{rng.choice(['Gym', 'Read', 'Call'])} {i}"}
+    routine = [entry(i) for i in range(40)]
+    if sort_file:
+        routine.sort(key=lambda e: to_minutes(e["start"]))
+    base = RoutineIndex(routine)
+    index, ops = base.copy(), []
+
+    for i in range(40, 70):
+        if rng.random() < 0.6:
+            ops.append({"op": "add", "entry": entry(i)})
+            index.add(ops[-1]["entry"])
+        else:
+            ops.append({"op": "remove", "keyword": rng.choice(["gym", "read 1", "call 2"])})
+            index.remove_matching(ops[-1]["keyword"])
+
+    rebuilt = RoutineIndex(apply_ops(list(routine), ops, lambda e: to_minutes(e["start"])))
+    assert index.entries == rebuilt.entries and index.sorted_entries == rebuilt.sorted_entries
+    assert index.transitions == rebuilt.transitions
+    for minute in range(24 * 60):
+        assert index.current(minute) == rebuilt.current(minute)
+        assert index.next_after(minute) == rebuilt.next_after(minute)
+    assert base.entries == routine  # the copy was edited, not the index readers hold
+
+
+def test_failed_routine_write_is_reported_and_not_applied(mocker):
+    """Test that an edit whose journal append fails returns an error and leaves the routine as it was."""
+    mocker.patch("routine_store.RoutineStore.append", side_effect=OSError("disk full"))
+    before = get_routine()
+
+    result = json.loads(add_routine_entry("16:00", "16:30", "Tea"))
+
+    assert result["status"] == "error"
+    assert get_routine() == before
+
+
+def test_next_routine_transition_and_change_notifications(mocker):
+    """Test the wake-up datetime for a scheduler and that edits notify listeners with the new index."""
+    import assistant
+    mocker.patch("assistant._ROUTINE_LISTENERS", [])
+    seen = []
+    assistant.on_routine_change(lambda index: seen.append(index.next_transition(to_minutes("15:45"))))
+
+    now = datetime.datetime(2024, 5, 1, 10, 15, 42)
+    assert assistant.next_routine_transition(now) == datetime.datetime(2024, 5, 1, 11, 0)
+
+    add_routine_entry("16:00", "16:30", "Tea")
+    remove_routine_entry("nonexistent activity")  # no change, no notification
+
+    assert seen == [to_minutes("16:00")]
+
+
+def test_routine_index_refreshes_after_external_edit():
+    """Test that the cached index is rebuilt when routine.json changes on disk."""
+    assert json.loads(get_task_by_time(query_time="10:30"))["activity"] == "Breakfast and check emails"
+
+    import assistant
+    with open(assistant.ROUTINE_FILE_PATH, "w") as f:
+        json.dump([{"start": "10:00", "end": "11:00", "activity": "Changed on disk"}], f)
+
+    assert json.loads(get_task_by_time(query_time="10:30"))["activity"] == "Changed on disk"
+
+
+# --- JSON Cache Tests ---
+
+def test_load_json_reuses_parsed_document(tmp_path, mocker):
+    """Test that unchanged files are served from the cache and save_json writes through."""
+    import assistant
+    file_path = str(tmp_path / "favorites.json")
+    assistant.save_json(file_path, {"color": "blue"})
+
+    json_load = mocker.spy(assistant.json, "load")
+    first = assistant.load_json(file_path, {})
+    second = assistant.load_json(file_path, {})
+
+    assert first == {"color": "blue"}
+    assert first is second
+    assert json_load.call_count == 0  # served by the write-through from save_json
+
+
+# --- Streaming Tests ---
+
+def _ndjson_response(mocker, tokens):
+    """Builds a fake streamed /api/chat response that records how far it was read."""
+    read = []
+
+    def iter_lines():
+        for token in tokens:
+            read.append(token)
+            yield json.dumps({"message": {"role": "assistant", "content": token}, "done": False}).encode()
+        yield json.dumps({"done": True}).encode()
+
+    response = mocker.MagicMock(status_code=200)
+    response.iter_lines.side_effect = iter_lines
+    return response, read
+
+
+def test_ollama_response_streams_sentences_and_stops_at_hallucinated_turn(mocker):
+    """Test that sentences are emitted as they complete and reading stops at a 'User:' marker."""
+    import assistant
+    response, read = _ndjson_response(mocker, ["Hi there", "! Keep going.", "\nUser:", " more", " tokens"])
+    mocker.patch("assistant.http_client.post_json", return_value=response)
+
+    sentences = []
+    message = assistant.ollama_response("hello", stream=True, on_sentence=sentences.append)
+
+    assert message["content"] == "Hi there! Keep going."
+    assert sentences == ["Hi there!", "Keep going."]
+    assert read == ["Hi there", "! Keep going.", "\nUser:"]  # stopped before the remaining tokens
+    response.close.assert_called_once()
+
+
+def test_metrics_go_to_stderr_after_the_streamed_reply(mocker, capsys):
+    """Test that the timing line never lands inside the reply printed on stdout."""
+    import assistant
+    response = mocker.MagicMock(status_code=200)
+    response.iter_lines.return_value = iter([
+        json.dumps({"message": {"role": "assistant", "content": "Hi there!"}, "done": False}).encode(),
+        json.dumps({"done": True, "prompt_eval_count": 3, "eval_count": 2}).encode(),
+    ])
+    mocker.patch("assistant.http_client.post_json", return_value=response)
+    mocker.patch("assistant.OLLAMA_SHOW_METRICS", True)
+
+    assistant.ollama_response("hello", stream=True, on_sentence=lambda sentence: None)
+
+    out, err = capsys.readouterr()
+    assert "Ishu says: Hi there!\n" in out and "[ollama]" not in out
+    assert err.startswith("[ollama] prompt eval: 3 tok")
+
+
+def test_ollama_response_stream_does_not_speak_tool_calls(mocker):
+    """Test that streamed tool-call JSON is returned intact but never spoken."""
+    import assistant
+    response, _ = _ndjson_response(mocker, ['{"tool_call": {"name": "get_routine", ', '"arguments": {}}}'])
+    mocker.patch("assistant.http_client.post_json", return_value=response)
+
+    sentences = []
+    message = assistant.ollama_response("show my routine", stream=True, on_sentence=sentences.append)
+
+    assert json.loads(message["content"])["tool_call"]["name"] == "get_routine"
+    assert sentences == []
+
+
+def test_ollama_response_stream_speaks_around_tool_calls_and_other_braces(mocker):
+    """Test that text after a tool call, and braces that are not a tool call, are still spoken."""
+    import assistant
+    response, _ = _ndjson_response(mocker, [
+        "Sure! ", '{"tool_call": {"name": "get_routine", ', '"arguments": {}}}', " A set looks like {1, 2}. ", "Enjoy!",
+    ])
+    mocker.patch("assistant.http_client.post_json", return_value=response)
+
+    sentences = []
+    assistant.ollama_response("show my routine", stream=True, on_sentence=sentences.append)
+
+    assert sentences == ["Sure!", "A set looks like {1, 2}.", "Enjoy!"]
+
+
+def test_unbalanced_brace_does_not_silence_the_rest_of_the_stream(mocker):
+    """Test that sentences after a stray '{' are spoken while the reply is still streaming."""
+    import assistant
+    response, read = _ndjson_response(mocker, ["In C a block starts with { and ", "ends later. ", "Good luck! ", "Bye"])
+    mocker.patch("assistant.http_client.post_json", return_value=response)
+    spoken_at = []
+
+    assistant.ollama_response("explain blocks", stream=True, on_sentence=lambda sentence: spoken_at.append(len(read)))
+
+    assert spoken_at[:2] == [2, 3]  # each sentence as soon as its own token arrived
+
+
+def test_cancelled_stream_is_not_flushed(mocker):
+    """Test that the unfinished sentence is dropped, not spoken, once the turn is cancelled."""
+    import threading
+    import assistant
+    cancel = threading.Event()
+    response, read = _ndjson_response(mocker, ["Once upon a time", " there was", " a dragon."])
+    mocker.patch("assistant.http_client.post_json", return_value=response)
+
+    sentences = []
+    original = response.iter_lines.side_effect
+    def iter_lines():
+        for i, line in enumerate(original()):
+            if i == 1:
+                cancel.set()
+            yield line
+    response.iter_lines.side_effect = iter_lines
+
+    assistant.ollama_response("tell me a story", stream=True, on_sentence=sentences.append, cancel_event=cancel)
+
+    assert sentences == []
+    assert len(read) == 2
+
+
+# --- Prompt Prefix / KV Cache Tests ---
+
+def test_respond_keeps_prompt_prefix_append_only(mocker):
+    """Test that each Ollama request extends the previous one, so its KV cache can be reused."""
+    import assistant
+    replies = iter([
+        {"message": {"role": "assistant", "content": "Hello!"}},
+        {"message": {"role": "assistant", "content": "Keep going, you can do it."}, "prompt_eval_count": 12, "eval_count": 6},
+    ])
+    post = mocker.patch("assistant.http_client.post_json",
+                        side_effect=lambda url, payload, stream=False: mocker.MagicMock(status_code=200, json=lambda: next(replies)))
+
+    history = assistant.new_chat_history()
+    assert assistant.respond("hi", history) == "Hello!"
+    assert assistant.respond("i feel stuck on my assignment", history) == "Keep going, you can do it."
+
+    payloads = [c.args[1] for c in post.call_args_list]
+    for earlier, later in zip(payloads, payloads[1:]):
+        assert later["messages"][:len(earlier["messages"])] == earlier["messages"]
+    assert all(p["keep_alive"] == assistant.OLLAMA_KEEP_ALIVE for p in payloads)
+    assert assistant.OLLAMA_METRICS["prompt_eval_tokens"] == 12
+
+
+def test_local_reply_removes_entry_without_llm(mocker):
+    """Test that 'remove breakfast' is answered locally and never reaches Ollama."""
+    import assistant
+    post = mocker.patch("assistant.http_client.post_json")
+
+    reply = assistant.respond("remove breakfast", assistant.new_chat_history())
+
+    assert "Removed 1 routine entry" in reply
+    assert len(json.loads(get_routine())) == 4
+    post.assert_not_called()
+
+
+@pytest.mark.parametrize("query", ["remove e", "delete all", "cancel everything", "drop me a hint"])
+def test_vague_removals_never_delete_locally(mocker, query):
+    """Test that removals which do not name exactly one activity go to the LLM and keep the routine."""
+    import assistant
+    post = mocker.patch("assistant.http_client.post_json", return_value=mocker.MagicMock(
+        status_code=200, json=lambda: {"message": {"role": "assistant", "content": "Which entry do you mean?"}}))
+
+    reply = assistant.respond(query, assistant.new_chat_history())
+
+    assert reply == "Which entry do you mean?"
+    assert len(json.loads(get_routine())) == 5
+    post.assert_called_once()
+
+
+def test_deterministic_ollama_calls_are_served_from_cache(mocker):
+    """Test that a repeated temperature-0 request does not reach Ollama twice."""
+    import assistant
+    import response_cache
+    mocker.patch("assistant.RESPONSE_CACHE", response_cache.ResponseCache(default_temperature=0.6))
+    post = mocker.patch("assistant.http_client.post_json", return_value=mocker.MagicMock(
+        status_code=200, json=lambda: {"message": {"role": "assistant", "content": "You added a walk."}}))
+
+    first = assistant.ollama_response("summarize", options={"temperature": 0})
+    second = assistant.ollama_response("summarize", options={"temperature": 0})
+
+    assert first["content"] == second["content"] == "You added a walk."
+    assert post.call_count == 1
+
+
+def test_batched_routine_edits_write_once(mocker):
+    """Test that several adds/removes from one LLM response cost a single journal append."""
+    import assistant
+    save = mocker.spy(assistant.routine_store.RoutineStore, "append")
+
+    results = assistant.TOOL_EXECUTOR.run([
+        {"name": "add_routine_entry", "arguments": {"start": "16:00", "end": "16:30", "activity": "Tea"}},
+        {"name": "remove_routine_entry", "arguments": {"activity_keyword": "lunch"}},
+        {"name": "add_routine_entry", "arguments": {"start": "08:00", "end": "08:30", "activity": "Run"}},
+    ])
+
+    assert all(json.loads(r["output"])["status"] == "success" for r in results)
+    assert save.call_count == 1
+    routine = json.loads(get_routine())
+    assert [e["activity"] for e in routine][:2] == ["Run", "Wake up and meditate"]
+    assert not any("Lunch" in e["activity"] for e in routine)
+
+
+def test_respond_runs_nested_tool_call_while_streaming(mocker):
+    """Test that a streamed nested tool call is executed before the reply has finished."""
+    import assistant
+    import tool_executor
+    tool_ran_during_stream = []
+    response, read = _ndjson_response(mocker, [
+        '{"tool_call": {"name": "remove_routine_entry", ', '"arguments": {"activity_keyword": "lunch"}}}', " Done.",
+    ])
+    original_submit = tool_executor.ToolRun.submit
+
+    def submit(self, tool_call):
+        tool_ran_during_stream.append(list(read))
+        original_submit(self, tool_call)
+
+    mocker.patch("tool_executor.ToolRun.submit", submit)
+    summary = mocker.MagicMock(status_code=200, json=lambda: {"message": {"role": "assistant", "content": "Removed lunch."}})
+    mocker.patch("assistant.http_client.post_json", side_effect=[response, summary])
+    mocker.patch("assistant.OLLAMA_STREAM", True)
+
+    assistant.respond("what about lunch, drop it", assistant.new_chat_history(), on_sentence=lambda s: None)
+
+    assert tool_ran_during_stream and " Done." not in tool_ran_during_stream[0]
+    assert not any("Lunch" in e["activity"] for e in json.loads(get_routine()))
+
+
+def test_sqlite_backend_imports_routine_json_and_serves_the_tools(tmp_path, monkeypatch):
+    """Test that the tool functions behave the same on the SQLite backend, starting from routine.json."""
+    import assistant
+    monkeypatch.setattr("assistant.ROUTINE_BACKEND", "sqlite")
+    monkeypatch.setattr("assistant.ROUTINE_DB_PATH", str(tmp_path / "routine.db"))
+
+    assert len(json.loads(get_routine())) == 5
+    assert json.loads(get_task_by_time(query_time="10:30"))["activity"] == "Breakfast and check emails"
+    assert json.loads(add_routine_entry("12:15", "12:20", "Quick Snack Break"))["status"] == "success"
+    assert json.loads(remove_routine_entry("breakfast"))["removed_count"] == 1
+
+    activities = [e["activity"] for e in json.loads(get_routine())]
+    assert activities.index("Quick Snack Break") == activities.index("Lunch break") - 1
+    assert "Breakfast and check emails" not in activities
+    assistant._ROUTINE_DBS.pop(str(tmp_path / "routine.db")).close()
+
+
+def test_capability_flags_are_probed_lazily(mocker):
+    """Test that WHISPER_AVAILABLE is computed on access from the installed modules."""
+    import assistant
+    import capabilities
+    mocker.patch.object(capabilities, "module_available", side_effect=lambda name: name != "torch")
+
+    assert assistant.WHISPER_AVAILABLE is False
+    assert assistant.SPEECH_RECOGNITION_AVAILABLE is True
+
+
+def mock_ollama_replies(mocker, *contents):
+    """Patches the Ollama client so successive non-streamed chat requests get `contents` in order."""
+    replies = iter(contents)
+    return mocker.patch("assistant.http_client.post_json", side_effect=lambda url, payload, stream=False: mocker.MagicMock(
+        status_code=200, json=lambda: {"message": {"role": "assistant", "content": next(replies)}}))
+
+
+def test_tool_reply_is_templated_without_a_second_llm_call(mocker):
+    """Test that a known tool result is phrased locally, and the 'llm' switch restores the summary pass."""
+    import assistant
+    tool_call = '{"tool_call": {"name": "remove_routine_entry", "arguments": {"activity_keyword": "lunch"}}}'
+    post = mock_ollama_replies(mocker, tool_call, tool_call, "Nothing left to remove.")
+
+    reply = assistant.respond("can you help me tidy up my day", assistant.new_chat_history())
+
+    assert "'lunch'" in reply
+    assert post.call_count == 1
+
+    mocker.patch.dict(assistant.TOOL_SUMMARY_MODES, {"remove_routine_entry": "llm"})
+    reply = assistant.respond("can you help me tidy up my day", assistant.new_chat_history())
+
+    assert reply == "Nothing left to remove."
+    assert post.call_count == 3
+
+
+def test_routine_turn_goes_to_the_tool_model_with_a_schema(mocker):
+    """Test a routine query costs one constrained tool-model call, and chat still uses the persona model."""
+    import assistant
+    selection = json.dumps({"tool_calls": [{"name": "remove_routine_entry", "arguments": {"activity_keyword": "lunch"}}]})
+    post = mock_ollama_replies(mocker, selection, "Here is a joke for you.")
+    mocker.patch("assistant.OLLAMA_TOOL_MODEL", "tiny-tools")
+    history = assistant.new_chat_history()
+
+    reply = assistant.respond("i skipped lunch so drop it from my schedule", history)
+
+    assert "'lunch'" in reply
+    payload = post.call_args.args[1]
+    assert (payload["model"], payload["format"]) == ("tiny-tools", assistant.TOOL_CALL_SCHEMA)
+    assert "Lunch" not in get_routine()
+
+    reply = assistant.respond("tell me a joke", history)
+
+    assert reply == "Here is a joke for you."
+    payload = post.call_args.args[1]
+    assert payload["model"] == assistant.OLLAMA_MODEL and "format" not in payload
+    assert post.call_count == 2
+
+
+def test_invalid_tool_model_reply_falls_back_to_the_persona_model(mocker):
+    """Test a reply that does not validate is counted and the turn is answered as before."""
+    import assistant
+    post = mock_ollama_replies(mocker, '{"tool_calls": [{"name": "format_disk", "arguments": {}}]}',
+                               "Your plan looks good!")
+    mocker.patch("assistant.OLLAMA_TOOL_MODEL", "tiny-tools")
+    count = mocker.spy(assistant.TRACER, "count")
+
+    reply = assistant.respond("is my plan for today any good", assistant.new_chat_history())
+
+    assert reply == "Your plan looks good!"
+    assert post.call_args.args[1]["model"] == assistant.OLLAMA_MODEL
+    count.assert_any_call("tool_selection_fallbacks")
+
+
+@pytest.mark.parametrize("content", [
+    '{"tool_calls": [{"name": "remove_routine_entry", "arguments": {"activity_keyword": "lu',
+    '{"tool_calls": [{"name": "remove_routine_entry", "arguments": {}}]}',
+    '{"tool_calls": [{"name": "remove_routine_entry", "arguments": {"activity_keyword": "lunch", "force": true}}]}',
+    '{"calls": []}',
+])
+def test_select_tools_returns_none_for_malformed_or_off_schema_replies(mocker, content):
+    """Test that truncated JSON, missing or extra arguments and a wrong shape all make select_tools give up."""
+    import assistant
+    mock_ollama_replies(mocker, content)
+    mocker.patch("assistant.OLLAMA_TOOL_MODEL", "tiny-tools")
+
+    assert assistant.select_tools("i skipped lunch so drop it", assistant.new_chat_history()) is None
+    assert "Lunch" in get_routine()
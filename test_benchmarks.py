@@ -0,0 +1,57 @@
+import json
+
+from benchmarks import load_server, run, startup
+from benchmarks.harness import compare
+
+
+def test_benchmark_runner_writes_json_report(tmp_path):
+    """Test a minimal run of every suite against the stub server produces a JSON report."""
+    output = tmp_path / "bench.json"
+
+    status = run.main(["--sizes", "10", "--repeat", "1", "--backend", "json", "sqlite",
+                       "--first-token-latency", "0", "--token-latency", "0", "--output", str(output)])
+
+    report = json.loads(output.read_text())
+    assert status == 0
+    assert report["benchmarks"]["routine[sqlite, n=10] get_task_by_time"]["entries"] == 10
+    assert report["benchmarks"]["ollama_response (stream, first sentence)"]["calls"] == 1
+    assert "extract_tool_calls (n=5, streamed)" in report["benchmarks"]
+
+
+def test_compare_flags_only_slowdowns_beyond_threshold():
+    """Test that only medians above threshold x the baseline are reported; new benchmarks are ignored."""
+    baseline = {"a": {"median_us": 100.0}, "b": {"median_us": 100.0}}
+    current = {"a": {"median_us": 120.0}, "b": {"median_us": 200.0}, "new": {"median_us": 5.0}}
+
+    assert compare(current, baseline, threshold=1.25) == [("b", 100.0, 200.0)]
+
+
+def test_parse_importtime_reads_self_cumulative_and_depth():
+    """Test that -X importtime lines are parsed and the header and unrelated lines are skipped."""
+    stderr = ("import time: self [us] | cumulative | imported package\n"
+              "import time:       120 |        120 |   tool_calls\n"
+              "import time:       900 |       1020 | assistant\n"
+              "some warning\n")
+
+    assert startup.parse_importtime(stderr) == [("tool_calls", 120, 120, 1), ("assistant", 900, 1020, 0)]
+
+
+def test_importing_assistant_skips_heavy_modules():
+    """Test that a cold `import assistant` loads none of the speech stack, pyjokes or requests."""
+    rows, heavy = startup.import_profile("assistant")
+
+    assert heavy == []
+    assert any(name == "assistant" and depth == 0 for name, _, _, depth in rows)
+
+
+def test_server_load_test_runs_sessions_against_the_stub(tmp_path):
+    """Test a small load run: every turn reaches the stub LLM and none is refused."""
+    output = tmp_path / "load.json"
+
+    status = load_server.main(["--sessions", "5", "--turns", "2", "--first-token-latency", "0",
+                               "--token-latency", "0", "--output", str(output)])
+
+    report = json.loads(output.read_text())
+    assert status == 0
+    assert report["turns"] == report["llm_requests"] == 10
+    assert report["refused"] == 0
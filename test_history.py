@@ -0,0 +1,25 @@
+from history import ChatHistory, SUMMARY_HEADER
+
+
+def test_duplicate_system_prompts_are_dropped():
+    """Test that re-appending the system prompt does not grow the history."""
+    history = ChatHistory("You are Ishu.")
+    history.append({"role": "system", "content": "You are Ishu."})
+    history.append({"role": "tool", "content": "{\"status\": \"success\"}"})
+
+    messages = history.as_messages()
+    assert [m["role"] for m in messages] == ["system", "tool"]
+
+
+def test_history_stays_within_budget_and_folds_old_turns():
+    """Test that a long session keeps a flat token count and summarizes the oldest turns."""
+    history = ChatHistory("You are Ishu.", max_tokens=300, summary_tokens=60, min_recent=2)
+    for i in range(50):
+        history.append({"role": "user", "content": f"question number {i} " + "word " * 20})
+        history.append({"role": "assistant", "content": f"answer number {i} " + "word " * 20})
+
+    messages = history.as_messages()
+    assert history.token_count <= 300
+    assert messages[1]["content"].startswith(SUMMARY_HEADER)
+    assert "answer number 49" in messages[-1]["content"]
+    assert "question number 0 " not in " ".join(m["content"] for m in messages)
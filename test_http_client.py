@@ -0,0 +1,30 @@
+import pytest
+
+import http_client
+
+
+@pytest.fixture(autouse=True)
+def fresh_session():
+    """Makes every test start from a new pooled session."""
+    http_client.close_session()
+    yield
+    http_client.close_session()
+
+
+def test_session_is_shared_and_pooled():
+    """Test that callers share one session with the configured pool and retry policy."""
+    session = http_client.get_session()
+    assert http_client.get_session() is session
+
+    adapter = session.get_adapter("http://localhost:11434/api/chat")
+    assert adapter._pool_maxsize == http_client.POOL_MAXSIZE
+    assert adapter.max_retries.total == http_client.MAX_RETRIES
+
+
+def test_post_json_applies_default_timeouts(mocker):
+    """Test that requests never go out without a connect/read timeout."""
+    post = mocker.patch.object(http_client.get_session(), "post")
+
+    http_client.post_json("http://localhost:11434/api/chat", {"model": "x"})
+
+    assert post.call_args.kwargs["timeout"] == (http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT)
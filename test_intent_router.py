@@ -0,0 +1,104 @@
+import pytest
+
+from intent_router import IntentRouter, PhraseMatcher, extract_times
+
+
+ACTIVITIES = ["Gym", "Lunch break", "Evening reading", "Reading club", "Dinner"]
+
+
+def find_activities(keyword, limit):
+    return [activity for activity in ACTIVITIES if keyword in activity.lower()][:limit]
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter()
+
+
+def test_phrase_matcher_finds_overlapping_phrases():
+    """Test the Aho-Corasick matcher reports every phrase, including ones inside others."""
+    matcher = PhraseMatcher([("he", 1), ("she", 2), ("hers", 3)])
+    assert sorted(value for _, value in matcher.find("ushers")) == [1, 2, 3]
+
+
+def test_extract_times_normalises_to_hh_mm():
+    """Test 12-hour, 24-hour and named times all come out as strict HH:MM."""
+    assert extract_times("from 6 pm to 7:30pm") == ["18:00", "19:30"]
+    assert extract_times("at 11.30 or noon, not 25:00") == ["11:30", "12:00"]
+    assert extract_times("12 am") == ["00:00"]
+
+
+@pytest.mark.parametrize("query, tool, arguments", [
+    ("what am i doing at 11:30", "get_task_by_time", {"query_time": "11:30"}),
+    ("remove gym", "remove_routine_entry", {"activity_keyword": "gym"}),
+    ("add reading from 9 pm to 10 pm", "add_routine_entry", {"start": "21:00", "end": "22:00", "activity": "reading"}),
+    ("show my routine please", "get_routine", {}),
+])
+def test_routine_queries_are_routed_locally(router, query, tool, arguments):
+    """Test high-confidence routine queries map to tools with extracted arguments."""
+    intent = router.route(query, find_activities=find_activities)
+    assert intent is not None
+    assert (intent.tool, intent.arguments) == (tool, arguments)
+
+
+@pytest.mark.parametrize("query", [
+    "tell me a joke", "i am stressed about my exams", "how do i remove duplicates from a list", "remove 2 tasks at 10:00",
+])
+def test_other_queries_go_to_the_llm(router, query):
+    """Test chat, study questions and ambiguous edits are not intercepted."""
+    assert router.route(query, find_activities=find_activities) is None
+
+
+@pytest.mark.parametrize("query", [
+    "remove e", "delete all", "cancel everything", "drop me a hint", "remove duplicates from a list in python",
+    "remove reading", "remove din", "delete the dinner and gym",
+])
+def test_removals_must_name_exactly_one_activity(router, query):
+    """Test short, catch-all, unknown or ambiguous keywords are never removed locally."""
+    assert router.route(query, find_activities=find_activities) is None
+
+
+def test_removal_without_the_routine_goes_to_the_llm(router):
+    """Test a removal cannot be checked, so it is not handled, without a way to look up activities."""
+    assert router.route("remove gym") is None
+    assert router.route("remove gym", find_activities=find_activities).arguments == {"activity_keyword": "gym"}
+
+
+@pytest.mark.parametrize("query", [
+    "what is current in physics", "what is next in the story", "what is 10:30 in french",
+])
+def test_questions_about_other_topics_are_not_routine_questions(router, query):
+    """Test words outside the routine vocabulary send now/next/at questions to the LLM."""
+    assert router.route(query, find_activities=find_activities) is None
+
+
+def test_control_commands_keep_original_priority(router):
+    """Test 'change mode' beats exit words, and 'thank you' beats 'goodbye'."""
+    assert router.control_command("change mode and quit") == "change_mode"
+    assert router.control_command("thank you, goodbye") == "thanks"
+    assert router.control_command("stop listening") == "exit"
+    assert router.control_command("what is my routine") is None
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("move my workout to the evening", True),
+    ("what is on my schedule after lunch", True),
+    ("i want to study from 18:00 to 19:00", True),
+    ("tell me a joke", False),
+    ("give me an explanation of recursion", False),
+])
+def test_mentions_routine_is_looser_than_route(router, query, expected):
+    """Test routine words and times are noticed, while chat and words containing them are not."""
+    assert router.mentions_routine(query) is expected
+
+
+def test_activities_are_only_looked_up_for_removals(router, mocker):
+    """Test that the routine is searched only after a removal was recognised, and for its keyword."""
+    lookup = mocker.Mock(side_effect=find_activities)
+
+    router.route("what am i doing at 11:30", find_activities=lookup)
+    router.route("tell me a joke", find_activities=lookup)
+    lookup.assert_not_called()
+
+    router.route("remove gym", find_activities=lookup)
+    lookup.assert_called_once_with("gym", 2)
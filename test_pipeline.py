@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+from pipeline import Pipeline
+
+
+def test_new_query_cancels_in_flight_answer(mocker):
+    """Test barge-in: a second query cancels the first answer before it is spoken."""
+    first_started = threading.Event()
+    cancelled = []
+
+    def fake_respond(query, chat_history, on_sentence=None, cancel_event=None):
+        if query == "tell me a story":
+            first_started.set()
+            cancel_event.wait(2)
+            cancelled.append(cancel_event.is_set())
+            return "a very long story"
+        return "the weather is nice"
+
+    mocker.patch("assistant.respond", side_effect=fake_respond)
+    spoken = []
+    mocker.patch("assistant.speak", side_effect=lambda text, *args: spoken.append(text))
+
+    async def scenario():
+        pipeline = Pipeline()
+        pipeline.loop = asyncio.get_running_loop()
+        speaker = asyncio.create_task(pipeline.speak_stage())
+        thinker = asyncio.create_task(pipeline.think_stage())
+
+        await pipeline.query_queue.put("tell me a story")
+        await pipeline.loop.run_in_executor(None, first_started.wait, 2)
+        await pipeline.query_queue.put("how is the weather")
+        await asyncio.sleep(0.2)
+        await pipeline.query_queue.put("exit")
+        await asyncio.wait_for(thinker, 2)
+        speaker.cancel()
+
+    asyncio.run(scenario())
+
+    assert cancelled == [True]
+    assert spoken == ["the weather is nice", "Goodbye! Have a great day!"]
+
+
+def test_barge_in_turn_waits_for_the_cancelled_turn(mocker):
+    """Test that turns never overlap, so the shared chat history is appended in order."""
+    active, overlapped = [], []
+    first_started = threading.Event()
+
+    def fake_respond(query, chat_history, on_sentence=None, cancel_event=None):
+        overlapped.append(bool(active))
+        active.append(query)
+        if query == "tell me a story":
+            first_started.set()
+            cancel_event.wait(2)
+            time.sleep(0.1)  # still appending to the history after the cancel
+        active.remove(query)
+        return "ok"
+
+    mocker.patch("assistant.respond", side_effect=fake_respond)
+    mocker.patch("assistant.speak")
+
+    async def scenario():
+        pipeline = Pipeline()
+        pipeline.loop = asyncio.get_running_loop()
+        speaker = asyncio.create_task(pipeline.speak_stage())
+        thinker = asyncio.create_task(pipeline.think_stage())
+
+        await pipeline.query_queue.put("tell me a story")
+        await pipeline.loop.run_in_executor(None, first_started.wait, 2)
+        await pipeline.query_queue.put("how is the weather")
+        await asyncio.sleep(0.3)
+        await pipeline.query_queue.put("exit")
+        await asyncio.wait_for(thinker, 2)
+        speaker.cancel()
+
+    asyncio.run(scenario())
+
+    assert overlapped == [False, False]
+
+
+def test_own_speech_is_not_treated_as_a_barge_in(mocker):
+    """Test that a transcript repeating what Ishu is saying is dropped, and a real interruption is kept."""
+    released = threading.Event()
+    mocker.patch("assistant.speak", side_effect=lambda *args: released.wait(2))
+    mocker.patch("pipeline.ECHO_WINDOW_SECONDS", 0.1)
+
+    async def scenario():
+        pipeline = Pipeline()
+        pipeline.loop = asyncio.get_running_loop()
+        speaker = asyncio.create_task(pipeline.speak_stage())
+        await pipeline.speech_queue.put(("Your next task is the gym at six.", False))
+        await asyncio.sleep(0.05)
+
+        echo = pipeline.is_echo("your next task is the gym")
+        interruption = pipeline.is_echo("stop, tell me a joke instead")
+        released.set()
+        await pipeline.speech_queue.join()
+        await asyncio.sleep(0.2)
+        later = pipeline.is_echo("your next task is the gym")
+        speaker.cancel()
+        return echo, interruption, later
+
+    assert asyncio.run(scenario()) == (True, False, False)
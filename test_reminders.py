@@ -0,0 +1,102 @@
+import json
+import threading
+from datetime import datetime
+
+import assistant
+import reminders
+from assistant import to_minutes
+
+SLEEP = {"start": "22:00", "end": "07:00", "activity": "Sleep"}
+WORKOUT = {"start": "07:00", "end": "08:00", "activity": "Workout"}
+
+
+def make_scheduler(now, announce=print):
+    clock = [now]
+    scheduler = reminders.ReminderScheduler(announce, to_minutes, clock=lambda: clock[0])
+    return scheduler, clock
+
+
+def test_midnight_wrapping_slot_ends_the_next_day():
+    """Test that a 22:00-07:00 slot is scheduled to start tonight and end tomorrow morning."""
+    scheduler, _ = make_scheduler(datetime(2024, 5, 1, 21, 0))
+    scheduler.update([SLEEP])
+
+    assert scheduler.upcoming() == [(datetime(2024, 5, 1, 22, 0), "start", "Sleep"),
+                                    (datetime(2024, 5, 2, 7, 0), "end", "Sleep")]
+
+
+def test_due_events_are_announced_in_order_and_rescheduled():
+    """Test that an ending slot is announced before the one starting at the same minute, then both move a day."""
+    scheduler, _ = make_scheduler(datetime(2024, 5, 1, 6, 30))
+    scheduler.update([WORKOUT, SLEEP])
+
+    assert scheduler.pop_due(datetime(2024, 5, 1, 7, 0, 1)) == ["Sleep ends now.", "Workout starts now."]
+    assert scheduler.pop_due(datetime(2024, 5, 1, 7, 0, 2)) == []
+    assert (datetime(2024, 5, 2, 7, 0), "end", "Sleep") in scheduler.upcoming()
+
+
+def test_events_missed_beyond_grace_are_skipped():
+    """Test that events long overdue (machine asleep) are rescheduled without being announced."""
+    scheduler, _ = make_scheduler(datetime(2024, 5, 1, 6, 30))
+    scheduler.update([WORKOUT])
+
+    assert scheduler.pop_due(datetime(2024, 5, 1, 9, 0)) == []
+    assert scheduler.upcoming(1) == [(datetime(2024, 5, 2, 7, 0), "start", "Workout")]
+
+
+def test_update_only_schedules_changed_entries(mocker):
+    """Test that an edit schedules just the added entry and the removed one is never announced."""
+    scheduler, _ = make_scheduler(datetime(2024, 5, 1, 6, 0))
+    scheduler.update([WORKOUT, SLEEP])
+    schedule = mocker.spy(scheduler, "_schedule")
+
+    tea = {"start": "16:00", "end": "16:15", "activity": "Tea"}
+    scheduler.update([SLEEP, tea])
+
+    schedule.assert_called_once()
+    assert {activity for _, _, activity in scheduler.upcoming()} == {"Sleep", "Tea"}
+    assert scheduler.pop_due(datetime(2024, 5, 1, 7, 0)) == ["Sleep ends now."]
+
+
+def test_scheduler_thread_wakes_on_update_and_announces():
+    """Test that the background thread announces a due event after being woken by update()."""
+    announced = []
+    spoken = threading.Event()
+
+    def announce(text):
+        announced.append(text)
+        spoken.set()
+
+    scheduler, clock = make_scheduler(datetime(2024, 5, 1, 6, 59), announce)
+    scheduler.update([WORKOUT])
+    scheduler.start()
+    try:
+        clock[0] = datetime(2024, 5, 1, 7, 0)
+        scheduler.update([WORKOUT])
+        assert spoken.wait(2)
+        assert announced == ["Workout starts now."]
+    finally:
+        scheduler.stop()
+
+
+def test_start_reminders_follows_edits_on_the_sqlite_backend(tmp_path, monkeypatch):
+    """Test that the scheduler starts from, and is rescheduled by, a SqliteRoutineStore."""
+    routine_file = tmp_path / "routine.json"
+    routine_file.write_text(json.dumps([WORKOUT]))
+    monkeypatch.setattr("assistant.ROUTINE_BACKEND", "sqlite")
+    monkeypatch.setattr("assistant.ROUTINE_FILE_PATH", str(routine_file))
+    monkeypatch.setattr("assistant.ROUTINE_DB_PATH", str(tmp_path / "routine.db"))
+    monkeypatch.setattr("assistant.REMINDER_SCHEDULER", None)
+    monkeypatch.setattr("assistant._ROUTINE_LISTENERS", [])
+    monkeypatch.setattr("assistant.speak", lambda text: None)
+
+    scheduler = assistant.start_reminders()
+    try:
+        assert {activity for _, _, activity in scheduler.upcoming()} == {"Workout"}
+
+        assistant.add_routine_entry("22:00", "07:00", "Sleep")
+
+        assert {activity for _, _, activity in scheduler.upcoming()} == {"Workout", "Sleep"}
+    finally:
+        scheduler.stop()
+        assistant._ROUTINE_DBS.pop(str(tmp_path / "routine.db")).close()
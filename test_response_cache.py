@@ -0,0 +1,46 @@
+from response_cache import ResponseCache, make_key
+
+MESSAGES = [{"role": "user", "content": "Tell me a story"}]
+
+
+def test_key_ignores_whitespace_but_not_options():
+    """Test that cosmetic whitespace still hits while different options miss."""
+    spaced = [{"role": "user", "content": "  Tell me   a story "}]
+    assert make_key("m", MESSAGES) == make_key("m", spaced)
+    assert make_key("m", MESSAGES, {"temperature": 0}) != make_key("m", MESSAGES, {"temperature": 0.5})
+
+
+def test_lru_eviction_ttl_and_counters(mocker):
+    """Test least-recently-used eviction, expiry and hit/miss counting."""
+    clock = mocker.patch("response_cache.time.time", return_value=1000.0)
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put("a", {"content": "A"})
+    cache.put("b", {"content": "B"})
+    assert cache.get("a") == {"content": "A"}  # "a" is now most recently used
+    cache.put("c", {"content": "C"})           # evicts "b"
+
+    assert cache.get("b") is None
+    clock.return_value = 1061.0
+    assert cache.get("a") is None              # expired
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    """Test that entries written to the SQLite tier are found by a new cache instance."""
+    db_path = str(tmp_path / "cache.sqlite3")
+    first = ResponseCache(db_path=db_path)
+    first.put("k", {"role": "assistant", "content": "Once upon a time"})
+    first.close()
+
+    second = ResponseCache(db_path=db_path)
+    assert second.get("k")["content"] == "Once upon a time"
+    assert second.stats()["disk_hits"] == 1
+    second.close()
+
+
+def test_sampled_requests_are_opt_in():
+    """Test that temperature > 0 is only cached when explicitly allowed."""
+    assert not ResponseCache(default_temperature=0.6).is_cacheable({})
+    assert ResponseCache(default_temperature=0.6).is_cacheable({"temperature": 0})
+    assert ResponseCache(default_temperature=0.6, cache_nonzero_temperature=True).is_cacheable({})
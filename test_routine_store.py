@@ -0,0 +1,195 @@
+import json
+import threading
+
+import routine_store
+from routine_store import RoutineStore, SqliteRoutineStore, apply_ops
+
+SORT_KEY = lambda e: e["start"]
+
+
+def _store(tmp_path, **kwargs):
+    path = tmp_path / "routine.json"
+    path.write_text(json.dumps([{"start": "09:00", "end": "10:00", "activity": "Gym"}]))
+    return RoutineStore(str(path), sort_key=SORT_KEY, **kwargs), path
+
+
+def _commit(store, ops):
+    entries = apply_ops(list(store.load()), ops, SORT_KEY)
+    store.append(ops, entries)
+    return entries
+
+
+def test_edits_are_appended_and_replayed_without_rewriting_the_snapshot(tmp_path):
+    """Test that a commit only appends to the journal and a fresh store replays it."""
+    store, path = _store(tmp_path)
+    snapshot = path.read_bytes()
+
+    _commit(store, [{"op": "add", "entry": {"start": "08:00", "end": "08:30", "activity": "Run"}}])
+    _commit(store, [{"op": "remove", "keyword": "gym"}])
+
+    assert path.read_bytes() == snapshot
+    assert [e["activity"] for e in RoutineStore(str(path), sort_key=SORT_KEY).load()] == ["Run"]
+
+
+def test_torn_journal_tail_is_dropped(tmp_path):
+    """Test that a half-written last record (crash mid-append) is ignored and truncated away."""
+    store, path = _store(tmp_path)
+    _commit(store, [{"op": "add", "entry": {"start": "08:00", "end": "08:30", "activity": "Run"}}])
+    journal = tmp_path / "routine.json.journal"
+    good = journal.read_bytes()
+    journal.write_bytes(good + b'0badc0de {"ops": [{"op": "remove", "keyw')
+
+    entries = RoutineStore(str(path), sort_key=SORT_KEY).load()
+
+    assert [e["activity"] for e in entries] == ["Run", "Gym"]
+    assert journal.read_bytes() == good
+
+
+def test_compaction_writes_snapshot_and_stale_journal_is_not_replayed(tmp_path, mocker):
+    """Test that compaction folds the journal into routine.json and a journal it left behind is discarded."""
+    store, path = _store(tmp_path, compact_every=1)
+    _commit(store, [{"op": "add", "entry": {"start": "08:00", "end": "08:30", "activity": "Run"}}])
+    journal = tmp_path / "routine.json.journal"
+    leftover = []
+    write = routine_store.atomic_write
+    mocker.patch("routine_store.atomic_write", side_effect=lambda *args: (leftover.append(journal.read_bytes()), write(*args)))
+
+    _commit(store, [{"op": "add", "entry": {"start": "07:00", "end": "07:30", "activity": "Tea"}}])
+    assert [e["activity"] for e in json.loads(path.read_text())] == ["Tea", "Run", "Gym"]
+
+    journal.write_bytes(leftover[0])  # as if the crash happened between os.replace and removing the journal
+    assert len(RoutineStore(str(path), sort_key=SORT_KEY).load()) == 3
+    assert not journal.exists()
+    assert not list(tmp_path.glob("routine.json.journal.stale-*"))
+
+
+def test_journal_of_a_hand_edited_snapshot_is_kept_aside(tmp_path, capsys):
+    """Test that edits journaled before routine.json was edited by hand are moved aside, not deleted."""
+    store, path = _store(tmp_path)
+    _commit(store, [{"op": "add", "entry": {"start": "08:00", "end": "08:30", "activity": "Run"}}])
+    journal = tmp_path / "routine.json.journal"
+    pending = journal.read_bytes()
+
+    path.write_text(json.dumps([{"start": "10:00", "end": "11:00", "activity": "Swim"}]))
+
+    assert [e["activity"] for e in RoutineStore(str(path), sort_key=SORT_KEY).load()] == ["Swim"]
+    assert not journal.exists()
+    [stale] = tmp_path.glob("routine.json.journal.stale-*")
+    assert stale.read_bytes() == pending
+    assert "1 journaled edit(s)" in capsys.readouterr().out
+
+
+def test_load_waits_for_the_shared_lock(tmp_path):
+    """Test that load() holds the lock it was given, so it cannot interleave with a commit."""
+    lock = threading.RLock()
+    store, _ = _store(tmp_path, lock=lock)
+    loaded = threading.Event()
+
+    with lock:
+        threading.Thread(target=lambda: (store.load(), loaded.set()), daemon=True).start()
+        assert not loaded.wait(0.1)
+    assert loaded.wait(2)
+
+
+def test_corrupt_snapshot_is_moved_aside(tmp_path):
+    """Test that an unreadable routine.json is kept for inspection instead of being overwritten."""
+    path = tmp_path / "routine.json"
+    path.write_text('[{"start": "09:00", "end"')
+
+    assert RoutineStore(str(path)).load() == []
+    assert list(tmp_path.glob("routine.json.corrupt-*"))
+
+
+def _minutes(timestr):
+    hour, minute = timestr.split(":")
+    return int(hour) * 60 + int(minute)
+
+
+def test_sqlite_store_answers_like_the_in_memory_index(tmp_path):
+    """Test current/next/transition lookups and ordering against RoutineIndex, with and without the virtual tables."""
+    import random
+    from assistant import RoutineIndex
+
+    rng = random.Random(7)
+    routine = sorted(
+        ({"start": f"{rng.randrange(24):02d}:{rng.choice([0, 15, 30, 45]):02d}",
+          "end": f"{rng.randrange(24):02d}:{rng.choice([0, 15, 30, 45]):02d}",
+          "activity": f"task {i}"} for i in range(60)),
+        key=lambda e: _minutes(e["start"]),
+    )
+    index = RoutineIndex(routine)
+
+    for plain in (False, True):
+        store = SqliteRoutineStore(str(tmp_path / f"routine-{plain}.db"), _minutes)
+        if plain:
+            store.has_rtree = store.has_fts = False
+        store.import_entries(routine)
+
+        assert store.sorted_entries == index.sorted_entries
+        for minute in range(0, 24 * 60, 7):
+            assert store.current(minute) == index.current(minute)
+            assert store.next_after(minute) == index.next_after(minute)
+            assert store.next_transition(minute) == index.next_transition(minute)
+
+
+def test_sqlite_store_keyword_removal_and_rollback(tmp_path):
+    """Test case-insensitive substring lookup and removal (short and long keywords) and that a failed batch is undone."""
+    store = SqliteRoutineStore(str(tmp_path / "routine.db"), _minutes)
+    store.import_entries([
+        {"start": "09:00", "end": "10:00", "activity": "Morning Gym"},
+        {"start": "12:30", "end": "13:30", "activity": "Lunch break"},
+        {"start": "18:00", "end": "19:00", "activity": "Gymnastics club"},
+    ])
+    assert store.matching_activities("gym") == ["Morning Gym", "Gymnastics club"]
+    assert len(store.matching_activities("GYM", 1)) == 1
+
+    with store.begin() as txn:
+        assert txn.remove_matching("gym") == 2
+        assert txn.remove_matching("zz") == 0
+    assert [e["activity"] for e in store.sorted_entries] == ["Lunch break"]
+
+    try:
+        with store.begin() as txn:
+            txn.add({"start": "08:00", "end": "08:30", "activity": "Run"})
+            raise RuntimeError("tool failed")
+    except RuntimeError:
+        pass
+    assert len(store) == 1
+    assert store.current(_minutes("13:00"))["activity"] == "Lunch break"
+
+
+def test_sqlite_store_keeps_current_lookups_right_through_edits(tmp_path):
+    """Test that adds and removals keep the per-minute owners equal to a rebuilt index, also for an older database."""
+    import random
+    import sqlite3
+    from assistant import RoutineIndex
+    from routine_store import apply_ops
+
+    rng = random.Random(11)
+    def entry(i):
+        return {"start": f"{rng.randrange(24):02d}:{rng.choice([0, 30]):02d}",
+                "end": f"{rng.randrange(24):02d}:{rng.choice([0, 30]):02d}",
+                "activity": f"{rng.choice(['Gym', 'Read', 'Call'])} {i}"}
+    routine = sorted((entry(i) for i in range(30)), key=lambda e: _minutes(e["start"]))
+    path = str(tmp_path / "routine.db")
+    store = SqliteRoutineStore(path, _minutes)
+    store.import_entries(routine)
+    ops = []
+
+    for i in range(30, 60):
+        with store.begin() as txn:
+            if rng.random() < 0.6:
+                ops.append({"op": "add", "entry": entry(i)})
+                txn.add(ops[-1]["entry"])
+            else:
+                ops.append({"op": "remove", "keyword": rng.choice(["gym", "read 1", "call 2"])})
+                txn.remove_matching(ops[-1]["keyword"])
+    index = RoutineIndex(apply_ops(list(routine), ops, lambda e: _minutes(e["start"])))
+    expected = [index.current(minute) for minute in range(24 * 60)]
+    assert [store.current(minute) for minute in range(24 * 60)] == expected
+
+    store.close()
+    with sqlite3.connect(path) as db:
+        db.execute("DROP TABLE routine_owner")  # as written before the table existed
+    reopened = SqliteRoutineStore(path, _minutes)
+    assert reopened and [reopened.current(minute) for minute in range(24 * 60)] == expected
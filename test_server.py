@@ -0,0 +1,218 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import admission
+import assistant
+import server
+from benchmarks.load_server import http_request, ws_chat, ws_connect
+from benchmarks.stub_ollama import StubOllama
+
+
+def run_against_server(tmp_path, client, **server_options):
+    """Starts an IshuServer on a free port and runs `client(host, port)` against it."""
+    async def main():
+        ishu = server.IshuServer(str(tmp_path / "users"), port=0, **server_options)
+        host, port = await ishu.start()
+        try:
+            return await client(host, port)
+        finally:
+            await ishu.close()
+    return asyncio.run(main())
+
+
+def test_routine_tools_are_isolated_per_user(tmp_path):
+    """Test that each user's routine tools read and edit only that user's routine file."""
+    async def client(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        added = await http_request(reader, writer, "POST", "/users/alice/tools/add_routine_entry",
+                                   {"start": "07:00", "end": "08:00", "activity": "Workout"})
+        alice = await http_request(reader, writer, "GET", "/users/alice/routine")
+        bob = await http_request(reader, writer, "GET", "/users/bob/routine")
+        invalid = await http_request(reader, writer, "GET", "/users/../routine")
+        writer.close()
+        return added, alice, bob, invalid
+
+    added, alice, bob, invalid = run_against_server(tmp_path, client)
+
+    assert added == (200, {"output": {"status": "success", "message": "Added Workout from 07:00 to 08:00.",
+                                        "start": "07:00", "end": "08:00", "activity": "Workout"}})
+    assert alice == (200, {"routine": [{"start": "07:00", "end": "08:00", "activity": "Workout"}]})
+    assert bob == (200, {"routine": "You have not set your daily routine yet."})
+    assert invalid[0] in (400, 404)
+    assert (tmp_path / "users" / "alice" / "routine.json.journal").exists()
+    assert not (tmp_path / "users" / "bob" / "routine.json.journal").exists()
+
+
+def test_websocket_chat_streams_sentences_and_keeps_session_history(tmp_path, monkeypatch):
+    """Test that a WebSocket turn streams sentences from the LLM and the session remembers the conversation."""
+    monkeypatch.setattr(assistant, "RESPONSE_CACHE", None)
+    monkeypatch.setattr(assistant, "OLLAMA_SHOW_METRICS", False)
+
+    async def client(host, port):
+        reader, writer, session_id = await ws_connect(host, port, "alice")
+        first = await ws_chat(reader, writer, "Tell me something nice.")
+        second = await ws_chat(reader, writer, "And another thing?")
+        writer.close()
+        return session_id, first, second
+
+    with StubOllama(reply="Great job today. Keep going!") as stub:
+        monkeypatch.setattr(assistant, "OLLAMA_API_URL", stub.url)
+        session_id, first, second = run_against_server(tmp_path, client)
+
+    assert [m["type"] for m in first] == ["sentence", "sentence", "reply"]
+    assert first[0]["text"] == "Great job today."
+    assert first[-1] == {"type": "reply", "text": "Great job today. Keep going!", "session": session_id}
+    assert second[-1]["type"] == "reply"
+    assert stub.requests == 2
+
+
+def test_chat_is_refused_with_503_when_the_llm_queue_is_full(tmp_path, monkeypatch):
+    """Test admission control over HTTP: with no free LLM slot and no queue, a turn gets 503 and Retry-After."""
+    monkeypatch.setattr(assistant, "RESPONSE_CACHE", None)
+    server.configure_llm(slots=1, max_waiting=0, queue_timeout=1)
+    monkeypatch.setattr(assistant, "OLLAMA_GATES", assistant.OLLAMA_GATES)
+    assistant.OLLAMA_GATES.gate(assistant.OLLAMA_MODEL).acquire("someone-else")
+
+    async def client(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        _, opened = await http_request(reader, writer, "POST", "/users/alice/sessions")
+        refused = await http_request(reader, writer, "POST", f"/sessions/{opened['session']}/chat",
+                                     {"message": "Tell me something nice."})
+        writer.close()
+        return refused
+
+    try:
+        status, body = run_against_server(tmp_path, client)
+    finally:
+        assistant.OLLAMA_GATES.gate(assistant.OLLAMA_MODEL).release()
+
+    assert status == 503
+    assert body["error"] == "busy"
+
+
+def test_requests_without_the_token_are_refused(tmp_path):
+    """Test that a server with a token answers 401 to requests without it and serves the ones with it."""
+    async def client(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        missing = await http_request(reader, writer, "GET", "/users/alice/routine")
+        wrong = await http_request(reader, writer, "GET", "/users/alice/routine", token="guess")
+        right = await http_request(reader, writer, "GET", "/users/alice/routine", token="s3cret")
+        health = await http_request(reader, writer, "GET", "/health")
+        writer.close()
+        _, _, session_id = await ws_connect(host, port, "alice", token="s3cret")
+        return missing, wrong, right, health, session_id
+
+    missing, wrong, right, health, session_id = run_against_server(tmp_path, client, token="s3cret")
+
+    assert missing[0] == wrong[0] == 401
+    assert right == (200, {"routine": "You have not set your daily routine yet."})
+    assert health[0] == 200
+    assert session_id
+
+
+def test_server_refuses_a_public_address_without_a_token():
+    """Test that main_async will not listen beyond localhost unless a token is set."""
+    args = server.parse_args(["--host", "0.0.0.0"])
+    args.token = None
+
+    with pytest.raises(SystemExit):
+        asyncio.run(server.main_async(args))
+    assert server.is_loopback("127.0.0.1") and server.is_loopback("localhost") and server.is_loopback("::1")
+    assert not server.is_loopback("0.0.0.0")
+
+
+def test_server_turns_are_not_echoed_on_the_console(tmp_path, monkeypatch, capsys):
+    """Test that a user's streamed reply goes to their WebSocket only, not to the server's stdout."""
+    monkeypatch.setattr(assistant, "RESPONSE_CACHE", None)
+    monkeypatch.setattr(assistant, "OLLAMA_SHOW_METRICS", False)
+
+    async def client(host, port):
+        reader, writer, _ = await ws_connect(host, port, "alice")
+        reply = await ws_chat(reader, writer, "Tell me something nice.")
+        writer.close()
+        return reply
+
+    with StubOllama(reply="Great job today. Keep going!") as stub:
+        monkeypatch.setattr(assistant, "OLLAMA_API_URL", stub.url)
+        reply = run_against_server(tmp_path, client)
+
+    assert reply[-1]["text"] == "Great job today. Keep going!"
+    assert "Great job" not in capsys.readouterr().out
+
+
+def test_concurrent_first_requests_share_one_routine_store(tmp_path, mocker):
+    """Test that two threads opening a user's routine store at the same time get the same store."""
+    original = assistant.routine_store.RoutineStore
+    mocker.patch.object(assistant.routine_store, "RoutineStore",
+                        side_effect=lambda *args, **kwargs: time.sleep(0.05) or original(*args, **kwargs))
+    path = str(tmp_path / "routine.json")
+    mocker.patch.dict(assistant._ROUTINE_STORES, clear=True)
+    stores = []
+
+    def first_request():
+        with assistant.user_context("alice", path):
+            stores.append(assistant.get_routine_store())
+
+    threads = [threading.Thread(target=first_request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(stores) == 4 and all(store is stores[0] for store in stores)
+    assert assistant.routine_store.RoutineStore.call_count == 1
+
+
+def test_bad_arguments_and_requests_get_an_error_response(tmp_path, mocker):
+    """Test 400 for wrongly typed arguments and a bad Content-Length, and 500 when a tool fails unexpectedly."""
+    mocker.patch("assistant.get_routine", side_effect=RuntimeError("boom"))
+
+    async def client(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        wrong_type = await http_request(reader, writer, "POST", "/users/alice/tools/add_routine_entry",
+                                        {"start": "07:00", "end": "08:00", "activity": 5})
+        failed = await http_request(reader, writer, "GET", "/users/alice/routine")
+        writer.write(b"POST /users/alice/sessions HTTP/1.1\r\nContent-Length: lots\r\n\r\n")
+        bad_length = int((await reader.readline()).split()[1])
+        writer.close()
+        return wrong_type, failed, bad_length
+
+    wrong_type, failed, bad_length = run_against_server(tmp_path, client)
+
+    assert wrong_type[0] == 400 and "'activity' must be a string" in wrong_type[1]["error"]
+    assert failed == (500, {"error": "Internal server error."})
+    assert bad_length == 400
+
+
+def test_refused_turn_leaves_no_message_in_the_history(monkeypatch):
+    """Test that a turn refused at the admission gate does not record the user's message."""
+    monkeypatch.setattr(assistant, "RESPONSE_CACHE", None)
+    monkeypatch.setattr(assistant, "OLLAMA_GATES", admission.ModelGates(1, max_waiting=0, timeout=1))
+    assistant.OLLAMA_GATES.gate(assistant.OLLAMA_MODEL).acquire("someone-else")
+    history = assistant.new_chat_history()
+
+    with pytest.raises(admission.Overloaded):
+        assistant.respond("Tell me something nice.", history)
+
+    assert [m["role"] for m in history.as_messages()] == ["system"]
+
+
+def test_sessions_with_a_running_turn_are_not_evicted():
+    """Test that opening sessions beyond the limit skips a least-recently-used session whose turn holds its lock."""
+    async def main():
+        sessions = server.SessionManager(max_sessions=1)
+        busy = sessions.open("alice")
+        await busy.lock.acquire()
+        sessions.open("bob")
+        kept = sessions.get(busy.id) is busy
+        busy.lock.release()
+        sessions.open("carol")
+        return kept, len(sessions)
+
+    kept, count = asyncio.run(main())
+
+    assert kept
+    assert count == 1
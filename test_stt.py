@@ -0,0 +1,139 @@
+import sys
+
+import pytest
+
+import stt
+
+
+def test_whisper_manager_loads_in_background(mocker):
+    """Test that the model is loaded once in the background and handed out when ready."""
+    fake_whisper = mocker.MagicMock()
+    mocker.patch.dict(sys.modules, {"whisper": fake_whisper})
+
+    manager = stt.WhisperModelManager("tiny", warmup=False)
+    manager.start()
+    manager.start()  # second call must not start another load
+
+    assert manager.wait(timeout=2) is fake_whisper.load_model.return_value
+    assert manager.is_ready()
+    fake_whisper.load_model.assert_called_once_with("tiny", device=None)
+
+
+def test_whisper_manager_reports_failure(mocker):
+    """Test that a failed load is reported instead of raising in the caller."""
+    fake_whisper = mocker.MagicMock()
+    fake_whisper.load_model.side_effect = RuntimeError("no weights")
+    mocker.patch.dict(sys.modules, {"whisper": fake_whisper})
+
+    manager = stt.WhisperModelManager("base", warmup=False)
+
+    assert manager.wait(timeout=2) is None
+    assert manager.state == "failed"
+    assert "no weights" in str(manager.error)
+
+
+def test_whisper_manager_rejects_unknown_size():
+    """Test that only the supported model sizes can be configured."""
+    with pytest.raises(ValueError):
+        stt.WhisperModelManager("huge")
+
+
+def test_pcm16_to_float32_scales_and_resamples():
+    """Test that raw 16-bit PCM becomes float32 at Whisper's 16 kHz without touching disk."""
+    numpy = pytest.importorskip("numpy")
+    raw = numpy.array([0, 16384, -32768, 32767] * 2000, dtype="<i2").tobytes()
+
+    same_rate = stt.pcm16_to_float32(raw, 16000)
+    assert same_rate.dtype == numpy.float32
+    assert same_rate[:3].tolist() == [0.0, 0.5, -1.0]
+
+    resampled = stt.pcm16_to_float32(raw, 44100)
+    assert abs(len(resampled) - round(8000 * 16000 / 44100)) <= 1
+
+
+def test_energy_vad_tracks_noise_floor():
+    """Test that loud frames count as speech and the noise floor only follows silence."""
+    numpy = pytest.importorskip("numpy")
+    quiet = (numpy.ones(480) * 50).astype("<i2").tobytes()
+    loud = (numpy.ones(480) * 5000).astype("<i2").tobytes()
+
+    vad = stt.EnergyVAD()
+    vad.calibrate([quiet] * 5)
+
+    assert not vad.is_speech(quiet)
+    assert vad.is_speech(loud)
+    assert vad.noise_floor == pytest.approx(50, rel=0.01)
+
+
+def test_merge_overlap_drops_repeated_words():
+    """Test that words duplicated by overlapping chunks are only kept once."""
+    assert stt.merge_overlap("add gym at seven", "Seven. thirty please") == "add gym at seven thirty please"
+    assert stt.merge_overlap("", "hello") == "hello"
+
+
+def test_streaming_transcriber_transcribes_chunks_before_finish(mocker):
+    """Test that full chunks are transcribed while audio keeps arriving, leaving only the tail."""
+    pytest.importorskip("numpy")
+    model = mocker.MagicMock()
+    model.transcribe.side_effect = [{"text": "what am i"}, {"text": "i doing at noon"}]
+    partials = []
+
+    transcriber = stt.StreamingTranscriber(lambda: model, chunk_seconds=1.0, overlap_seconds=0.25,
+                                           on_partial=partials.append)
+    frame = b"\x00\x00" * 1600  # 0.1 s at 16 kHz
+    for _ in range(12):
+        transcriber.feed(frame)
+
+    assert transcriber.finish() == "what am i doing at noon"
+    assert partials[0] == "what am i"
+    assert model.transcribe.call_count == 2
+
+
+def test_continuous_listener_opens_the_microphone_at_its_native_rate(mocker):
+    """Test that no sample rate is forced on the device and frames and chunks follow its rate."""
+    pytest.importorskip("numpy")
+    fake_sr = mocker.MagicMock()
+    fake_sr.Microphone.return_value.SAMPLE_RATE = 48000
+    fake_sr.Microphone.return_value.stream.read.side_effect = lambda n: b"\x00\x00" * n
+    mocker.patch.dict(sys.modules, {"speech_recognition": fake_sr})
+    model = mocker.MagicMock()
+    model.transcribe.return_value = {"text": "hello"}
+
+    listener = stt.ContinuousListener(lambda: model, frame_ms=30)
+    listener.open()
+
+    fake_sr.Microphone.assert_called_once_with()
+    assert (listener.sample_rate, listener.frame_samples) == (48000, 1440)
+    transcriber = stt.StreamingTranscriber(lambda: model, sample_rate=listener.sample_rate)
+    transcriber.feed(listener._read())
+    transcriber.finish()
+    assert len(model.transcribe.call_args.args[0]) == 480  # 30 ms resampled to 16 kHz
+
+
+def test_continuous_listener_releases_the_microphone_when_calibration_fails(mocker):
+    """Test that a failed calibration read closes the opened stream instead of keeping the device busy."""
+    fake_sr = mocker.MagicMock()
+    fake_sr.Microphone.return_value.SAMPLE_RATE = 16000
+    fake_sr.Microphone.return_value.stream.read.side_effect = OSError("Input overflowed")
+    mocker.patch.dict(sys.modules, {"speech_recognition": fake_sr})
+    listener = stt.ContinuousListener(lambda: None)
+
+    with pytest.raises(OSError):
+        listener.open()
+
+    fake_sr.Microphone.return_value.__exit__.assert_called_once_with(None, None, None)
+    assert listener._source is None
+
+
+def test_continuous_mode_falls_back_to_recording_when_the_microphone_fails(mocker):
+    """Test that a device that cannot be opened switches back to the record-then-transcribe path."""
+    import assistant
+    mocker.patch("stt.ContinuousListener.open", side_effect=OSError("Invalid sample rate"))
+    mocker.patch("assistant._CONTINUOUS_LISTENER", None)
+    mocker.patch("assistant.WHISPER_CONTINUOUS", True)
+    mocker.patch("assistant.record_audio", return_value="audio")
+    mocker.patch("assistant.transcribe_audio", return_value="what is my routine")
+
+    assert assistant.listen_continuous() == "what is my routine"
+    assert assistant.WHISPER_CONTINUOUS is False
+    assert assistant._CONTINUOUS_LISTENER is None
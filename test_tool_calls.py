@@ -0,0 +1,123 @@
+import pytest
+
+from tool_calls import MAX_CALL_LENGTH, TIME_PATTERN, ToolCallExtractor, extract_tool_calls, tool_call_schema, validate_tool_calls
+
+
+def add_entry(start, end, activity):
+    pass
+
+
+def task_at(query_time=None):
+    pass
+
+
+TOOLS = {"add_entry": add_entry, "task_at": task_at}
+
+
+def test_nested_tool_calls_are_extracted_from_chatty_text():
+    """Test that nested arguments objects survive, which the old non-greedy regex could not parse."""
+    text = (
+        'Sure! {"tool_call": {"name": "add_routine_entry", "arguments": {"start": "16:00", "end": "16:30", '
+        '"activity": "Tea"}}} and then {"tool_call": {"name": "get_routine", "arguments": {}}} done.'
+    )
+
+    calls = extract_tool_calls(text)
+
+    assert [c["name"] for c in calls] == ["add_routine_entry", "get_routine"]
+    assert calls[0]["arguments"]["activity"] == "Tea"
+
+
+def test_braces_inside_strings_and_other_json_are_ignored():
+    """Test that braces in string values do not end an object and non-tool JSON is skipped."""
+    text = '{"note": "x"} {"tool_call": {"name": "remove_routine_entry", "arguments": {"activity_keyword": "a}b{\\"c"}}}'
+
+    calls = extract_tool_calls(text)
+
+    assert calls == [{"name": "remove_routine_entry", "arguments": {"activity_keyword": 'a}b{"c'}}]
+
+
+def test_streamed_text_yields_each_call_as_soon_as_it_closes():
+    """Test feeding one character at a time returns every call exactly once, at its closing brace."""
+    first = '{"tool_call": {"name": "get_routine", "arguments": {}}}'
+    text = first + ' ok {"tool_call": {"name": "get_task_by_time", "arguments": {"query_time": "now"}}}'
+    extractor = ToolCallExtractor()
+
+    found_at = []
+    for i, char in enumerate(text):
+        for call in extractor.feed(char):
+            found_at.append((i, call["name"]))
+
+    assert found_at == [(len(first) - 1, "get_routine"), (len(text) - 1, "get_task_by_time")]
+
+
+def test_schema_follows_the_tool_signatures():
+    """Test each tool gets a const name, its required arguments, no extras and the HH:MM pattern."""
+    schema = tool_call_schema(TOOLS, time_arguments=("start", "end", "query_time"))
+
+    add, task = schema["properties"]["tool_calls"]["items"]["anyOf"]
+    assert add["properties"]["name"] == {"const": "add_entry"}
+    arguments = add["properties"]["arguments"]
+    assert arguments["required"] == ["start", "end", "activity"]
+    assert arguments["additionalProperties"] is False
+    assert arguments["properties"]["start"] == {"type": "string", "pattern": TIME_PATTERN}
+    assert arguments["properties"]["activity"] == {"type": "string"}
+    assert task["properties"]["arguments"]["required"] == []
+
+
+def test_validate_returns_calls_that_bind():
+    """Test a reply in the schema's shape becomes plain tool calls."""
+    data = {"tool_calls": [{"name": "add_entry", "arguments": {"start": "07:00", "end": "07:30", "activity": "Run"}},
+                           {"name": "task_at", "arguments": {}}]}
+
+    assert validate_tool_calls(data, TOOLS) == data["tool_calls"]
+    assert validate_tool_calls({"tool_calls": []}, TOOLS) == []
+
+
+@pytest.mark.parametrize("data", [
+    {"calls": []},
+    {"tool_calls": [{"name": "delete_everything", "arguments": {}}]},
+    {"tool_calls": [{"name": "add_entry", "arguments": {"start": "07:00"}}]},
+    {"tool_calls": [{"name": "task_at", "arguments": {"when": "now"}}]},
+    {"tool_calls": [{"name": "add_entry", "arguments": {"start": "07:00", "end": "08:00", "activity": 5}}]},
+])
+def test_validate_rejects_unknown_tools_and_bad_arguments(data):
+    """Test malformed replies raise ValueError instead of reaching the tools."""
+    with pytest.raises(ValueError):
+        validate_tool_calls(data, TOOLS)
+
+
+def test_spans_and_pending_locate_tool_calls_in_the_stream():
+    """Test that found calls are reported by offset and an open object by where it starts."""
+    extractor = ToolCallExtractor()
+    call = '{"tool_call": {"name": "get_routine", "arguments": {}}}'
+
+    extractor.feed("Sure! " + call + ' and {"a": ')
+    assert extractor.spans == [(6, 6 + len(call))]
+    assert extractor.pending == 6 + len(call) + 5
+
+    extractor.feed("2} done")
+    assert extractor.pending is None
+    assert extractor.spans == [(6, 6 + len(call))]
+
+
+def test_brace_in_prose_is_given_up_at_once():
+    """Test that a '{' not followed by a key stops holding back text immediately."""
+    extractor = ToolCallExtractor()
+
+    extractor.feed("Use { to open a block")
+
+    assert extractor.pending is None
+
+
+def test_overlong_candidate_is_given_up_and_later_calls_are_still_found():
+    """Test that an unbalanced object is dropped at MAX_CALL_LENGTH and the scan resumes inside it."""
+    extractor = ToolCallExtractor()
+    call = '{"tool_call": {"name": "get_routine", "arguments": {}}}'
+
+    assert extractor.feed('Note {"unclosed": [' + call) == []
+    assert extractor.pending == 5
+
+    found = extractor.feed(" " * MAX_CALL_LENGTH)
+
+    assert found == [{"name": "get_routine", "arguments": {}}]
+    assert extractor.pending is None
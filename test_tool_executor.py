@@ -0,0 +1,102 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+from tool_executor import ToolExecutor
+
+
+def test_consecutive_mutations_share_one_transaction_and_keep_order():
+    """Test mutation runs are grouped, reads after them wait for the commit, and order is kept."""
+    log = []
+
+    @contextmanager
+    def transaction():
+        log.append("begin")
+        yield
+        log.append("commit")
+
+    tools = {
+        "add": lambda name: log.append(f"add {name}") or f"added {name}",
+        "read": lambda: log.append("read") or "routine",
+    }
+    executor = ToolExecutor(tools, mutating={"add"}, transaction=transaction)
+
+    results = executor.run([
+        {"name": "add", "arguments": {"name": "gym"}},
+        {"name": "add", "arguments": {"name": "walk"}},
+        {"name": "read", "arguments": {}},
+    ])
+
+    assert [r["output"] for r in results] == ["added gym", "added walk", "routine"]
+    assert log == ["begin", "add gym", "add walk", "commit", "read"]
+
+
+def test_read_only_tools_run_concurrently():
+    """Test that independent reads overlap instead of running one after another."""
+    barrier = threading.Barrier(3, timeout=2)
+    executor = ToolExecutor({"read": lambda: barrier.wait() is not None and "ok"})
+
+    results = executor.run([{"name": "read", "arguments": {}}] * 3)
+
+    assert [r["output"] for r in results] == ["ok"] * 3
+
+
+def test_unknown_tools_and_bad_arguments_are_reported():
+    """Test that failures are returned per call instead of aborting the batch."""
+    executor = ToolExecutor({"read": lambda: "ok"})
+
+    missing, bad, good = executor.run([
+        {"name": "nope"}, {"name": "read", "arguments": {"x": 1}}, {"name": "read", "arguments": None},
+    ])
+
+    assert missing["output"] is None and "not implemented" in missing["error"]
+    assert bad["output"].startswith("ERROR executing read")
+    assert good["output"] == "ok"
+
+
+def test_tools_run_in_the_submitting_context():
+    """Test that context variables set by the caller (e.g. the current user) reach every tool."""
+    user = contextvars.ContextVar("user", default=None)
+    executor = ToolExecutor({"whoami": lambda: user.get(), "rename": lambda: user.get()}, mutating={"rename"})
+
+    user.set("alice")
+    results = executor.run([{"name": "rename", "arguments": {}}, {"name": "whoami", "arguments": {}}])
+
+    assert [r["output"] for r in results] == ["alice", "alice"]
+
+
+def test_streamed_mutation_is_committed_without_waiting_for_the_next_call():
+    """Test that a submitted edit does not keep its transaction (and lock) open while the stream continues."""
+    committed = threading.Event()
+
+    @contextmanager
+    def transaction():
+        yield
+        committed.set()
+
+    executor = ToolExecutor({"add": lambda: "added"}, mutating={"add"}, transaction=transaction)
+    tool_run = executor.start()
+    tool_run.submit({"name": "add", "arguments": {}})
+
+    assert committed.wait(2)
+    assert [r["output"] for r in tool_run.finish()] == ["added"]
+
+
+def test_transaction_failures_become_error_results():
+    """Test that a transaction that cannot open or commit reports an error for its calls instead of killing the run."""
+    def broken_begin():
+        raise OSError("locked")
+
+    @contextmanager
+    def broken_commit():
+        yield
+        raise OSError("disk full")
+
+    for transaction, message in ((broken_begin, "locked"), (broken_commit, "disk full")):
+        executor = ToolExecutor({"add": lambda: "added", "read": lambda: "ok"}, mutating={"add"},
+                                transaction=transaction)
+
+        add, read = executor.run([{"name": "add", "arguments": {}}, {"name": "read", "arguments": {}}])
+
+        assert add["error"] == message and add["output"].startswith("ERROR executing add")
+        assert read["output"] == "ok"
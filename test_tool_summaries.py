@@ -0,0 +1,73 @@
+import json
+import random
+
+from tool_summaries import ToolSummaries, ADDED, FREE_AT, NOT_REMOVED, TASK_AT, TASK_NOW
+
+ALL_TEMPLATE = {name: "template" for name in
+                ("add_routine_entry", "remove_routine_entry", "get_task_by_time", "get_routine")}
+
+
+def result(name, output, **arguments):
+    return {"name": name, "arguments": arguments, "error": None,
+            "output": output if isinstance(output, str) else json.dumps(output)}
+
+
+def added(start, end, activity):
+    return result("add_routine_entry", {"status": "success", "message": f"Added {activity} from {start} to {end}.",
+                                        "start": start, "end": end, "activity": activity},
+                  start=start, end=end, activity=activity)
+
+
+def test_consecutive_adds_are_summarised_in_one_sentence():
+    """Test that a batch of adds becomes one templated sentence listing every entry."""
+    summaries = ToolSummaries(ALL_TEMPLATE, rng=random.Random(0))
+
+    reply = summaries.render([added("16:00", "16:30", "Tea"), added("08:00", "08:30", "Run")])
+
+    items = "Tea from 16:00 to 16:30 and Run from 08:00 to 08:30"
+    assert reply in [t.format(items=items, is_are="are") for t in ADDED]
+
+
+def test_task_and_removal_outputs_are_phrased_locally():
+    """Test the now/at distinction for get_task_by_time and the found/not found removal replies."""
+    summaries = ToolSummaries(ALL_TEMPLATE)
+    walk = {"time": "11:15", "start": "11:00", "end": "12:30", "activity": "Walk"}
+    now = result("get_task_by_time", dict(walk, status="found"))
+    at = result("get_task_by_time", dict(walk, status="found"), query_time="11:15")
+    free_at = result("get_task_by_time", dict(walk, status="next_found"), query_time="11:15")
+    removed = result("remove_routine_entry", {"status": "success", "removed_count": 2, "keyword": "walk"},
+                     activity_keyword="walk")
+    missing = result("remove_routine_entry", {"status": "not_found", "keyword": "yoga"}, activity_keyword="yoga")
+
+    assert summaries.render([now]) in [t.format(**walk) for t in TASK_NOW]
+    assert summaries.render([at]) in [t.format(**walk) for t in TASK_AT]
+    assert summaries.render([free_at]) in [t.format(**walk) for t in FREE_AT]
+    assert "2 entries matching 'walk'" in summaries.render([removed])
+    assert summaries.render([missing]) in [t.format(keyword="yoga") for t in NOT_REMOVED]
+
+
+def test_routine_listing_is_capped_and_empty_routine_is_handled():
+    """Test that long routines are cut off with 'N more' and the 'not set' text gets a friendly reply."""
+    summaries = ToolSummaries(ALL_TEMPLATE, rng=random.Random(2))
+    routine = [{"start": f"{h:02d}:00", "end": f"{h:02d}:30", "activity": f"Task {h}"} for h in range(12)]
+
+    listing = summaries.render([result("get_routine", routine)])
+    empty = summaries.render([result("get_routine", "You have not set your daily routine yet.")])
+
+    assert "Task 9 from 09:00 to 09:30, and 2 more." in listing
+    assert "Task 10" not in listing
+    assert "routine" in empty and "{" not in empty
+
+
+def test_errors_unknown_tools_and_llm_mode_fall_back_to_the_llm():
+    """Test that render returns None whenever the LLM summary pass should run instead."""
+    summaries = ToolSummaries({**ALL_TEMPLATE, "get_routine": "llm"})
+    bad_time = result("add_routine_entry", "ERROR: Invalid time format received.", start="7pm", end="8", activity="x")
+    failed = dict(added("07:00", "08:00", "Run"), error="disk full")
+    not_found = result("get_task_by_time", {"status": "error", "message": "No daily routine is set."})
+
+    assert summaries.render([bad_time]) is None
+    assert summaries.render([failed]) is None
+    assert summaries.render([not_found]) is None
+    assert summaries.render([result("get_weather", "Sunny")]) is None
+    assert summaries.render([added("07:00", "08:00", "Run"), result("get_routine", [])]) is None
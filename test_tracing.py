@@ -0,0 +1,74 @@
+import json
+import urllib.request
+
+import tracing
+
+
+def test_turn_is_exported_as_one_json_line(tmp_path):
+    """Test that spans and counters recorded inside a turn end up in its JSON line."""
+    trace_path = tmp_path / "trace.jsonl"
+    tracer = tracing.Tracer(jsonl_path=str(trace_path))
+
+    with tracer.turn("what is next") as turn:
+        with tracer.span("llm.first_pass"):
+            tracer.count("llm_calls")
+        tracer.record("tool.get_routine", 0.002)
+    tracer.count("llm_calls")  # outside any turn: only aggregated
+
+    line = json.loads(trace_path.read_text())
+    assert line["turn"] == turn.number == 1
+    assert line["query"] == "what is next"
+    assert [span["name"] for span in line["spans"]] == ["llm.first_pass", "tool.get_routine"]
+    assert line["counters"] == {"llm_calls": 1}
+
+
+def test_prometheus_endpoint_serves_counters_and_histograms():
+    """Test the /metrics text: labelled counters and cumulative span buckets."""
+    tracer = tracing.Tracer()
+    tracer.count("tool_calls", tool="get_routine", source="llm")
+    tracer.record("speak", 0.02)
+    tracer.record("speak", 3.0)
+
+    host, port = tracer.serve_metrics(0)
+    try:
+        text = urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5).read().decode()
+    finally:
+        tracer.close()
+
+    assert 'ishu_tool_calls_total{source="llm",tool="get_routine"} 1' in text
+    assert 'ishu_span_seconds_bucket{span="speak",le="0.025"} 1' in text
+    assert 'ishu_span_seconds_bucket{span="speak",le="+Inf"} 2' in text
+    assert 'ishu_span_seconds_count{span="speak"} 2' in text
+
+
+def test_respond_records_llm_and_tool_spans(mocker):
+    """Test that a tool-calling turn is traced through first pass, tool execution and summary."""
+    import assistant
+    tracer = tracing.Tracer()
+    mocker.patch("assistant.TRACER", tracer)
+    mocker.patch("assistant.OLLAMA_SHOW_METRICS", False)
+    mocker.patch("assistant.RESPONSE_CACHE", None)
+    replies = iter([
+        '{"tool_call": {"name": "get_favorite", "arguments": {}}}',
+        "You have no favorite color yet.",
+    ])
+    mocker.patch("assistant.http_client.post_json", side_effect=lambda *a, **k: mocker.MagicMock(
+        status_code=200, json=lambda content=next(replies): {"message": {"role": "assistant", "content": content}}))
+
+    with tracer.turn("tell me my favourite colour") as turn:
+        assistant.respond("tell me my favourite colour", assistant.new_chat_history())
+
+    names = [span["name"] for span in turn.spans]
+    assert names[:2] == ["local_reply", "llm.first_pass"]
+    assert {"tool.get_favorite", "llm.summary", "respond"} <= set(names)
+    assert turn.counters["llm_calls"] == 2 and turn.counters["tool_calls"] == 1
+
+
+def test_profile_flag_writes_stats_and_report(tmp_path):
+    """Test that --profile runs the session under cProfile and writes both files."""
+    profile_path = tmp_path / "session.prof"
+    args = tracing.parse_args(["--profile", str(profile_path)])
+
+    assert tracing.run(lambda: sum(range(1000)), tracing.Tracer(), args) == 499500
+    assert profile_path.exists()
+    assert "cumulative" in (tmp_path / "session.prof.txt").read_text()
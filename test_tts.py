@@ -0,0 +1,171 @@
+import io
+import sys
+import threading
+import time
+
+import tts
+
+
+class RecordingEngine(tts.NullEngine):
+    name = "recording"
+
+    def __init__(self, block_on=None):
+        self.spoken = []
+        self.stopped = threading.Event()
+        self.started = threading.Event()
+        self.block_on = block_on
+
+    def start(self, text):
+        self.spoken.append(text)
+        return text
+
+    def wait(self, text):
+        if text == self.block_on:
+            self.started.set()
+            self.stopped.wait(2)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def test_utterances_are_spoken_in_order_on_one_thread():
+    """Test that non-blocking calls queue up instead of overlapping, and wait=True returns after speaking."""
+    engine = RecordingEngine()
+    worker = tts.SpeechWorker(engine)
+
+    worker.speak("Hello!")
+    worker.speak("I'm Ishu.")
+    worker.speak("Starting.", wait=True)
+
+    assert engine.spoken == ["Hello!", "I'm Ishu.", "Starting."]
+    worker.close()
+
+
+def test_interrupt_stops_current_and_drops_queued_speech():
+    """Test barge-in: the current utterance is cut off and queued ones are never spoken."""
+    engine = RecordingEngine(block_on="a very long story")
+    worker = tts.SpeechWorker(engine)
+
+    worker.speak("a very long story")
+    queued = worker.speak("the end")
+    assert engine.started.wait(2)
+
+    worker.interrupt()
+    assert queued.done.wait(2)
+    worker.speak("the weather is nice", wait=True)
+
+    assert engine.spoken == ["a very long story", "the weather is nice"]
+    worker.close()
+
+
+def test_engine_is_detected_from_platform_and_installed_binaries(mocker, tmp_path):
+    """Test engine selection: say on macOS, espeak-ng elsewhere, file sink and no-op fallbacks."""
+    which = {"say": "/usr/bin/say", "espeak-ng": "/usr/bin/espeak-ng"}
+    mocker.patch("tts.shutil.which", side_effect=which.get)
+
+    mocker.patch("tts.platform.system", return_value="Darwin")
+    assert isinstance(tts.detect_engine(), tts.SayEngine)
+
+    mocker.patch("tts.platform.system", return_value="Linux")
+    mocker.patch("tts.espeak_library", return_value="libespeak-ng.so.1")
+    engine = tts.detect_engine()
+    assert isinstance(engine, tts.WorkerEngine) and engine.command[-2:] == ["espeak-lib", "libespeak-ng.so.1"]
+
+    tts.espeak_library.return_value = None
+    engine = tts.detect_engine()
+    assert isinstance(engine, tts.EspeakEngine) and engine.command[0] == "/usr/bin/espeak-ng"
+
+    assert isinstance(tts.detect_engine(file_path=str(tmp_path / "speech.txt")), tts.FileEngine)
+    which.clear()
+    assert isinstance(tts.detect_engine(), tts.NullEngine)
+
+
+def test_file_engine_writes_one_line_per_utterance(tmp_path):
+    """Test the headless sink used for tests and servers without audio."""
+    path = tmp_path / "speech.txt"
+    worker = tts.SpeechWorker(tts.FileEngine(str(path)))
+
+    worker.speak("First line\nwith a break.")
+    worker.speak("Second.", wait=True)
+
+    assert path.read_text().splitlines() == ["First line with a break.", "Second."]
+    worker.close()
+
+
+def test_worker_engine_reuses_one_process_until_interrupted(tmp_path):
+    """Test that utterances go to one long-lived process over a pipe, which outlives a stop."""
+    path = tmp_path / "speech.txt"
+    engine = tts.WorkerEngine(tts.serve_command("file", path))
+    worker = tts.SpeechWorker(engine)
+
+    worker.speak("One.")
+    worker.speak("Two.", wait=True)
+    first = engine._process.pid
+    worker.speak("Three.", wait=True)
+    assert engine._process.pid == first
+
+    worker.interrupt()
+    worker.speak("Four.", wait=True)
+
+    assert engine._process.pid == first
+    assert path.read_text().splitlines() == ["One.", "Two.", "Three.", "Four."]
+    worker.close()
+
+
+def test_worker_process_cuts_off_speech_on_a_stop_line():
+    """Test the worker loop: a stop line interrupts the utterance being spoken, which is still answered."""
+    engine = RecordingEngine(block_on="a very long story")
+    stdout = io.BytesIO()
+
+    def stdin():
+        yield b'{"text": "a very long story"}\n'
+        assert engine.started.wait(2)
+        yield b'{"stop": true}\n'
+        yield b'{"text": "the end"}\n'
+
+    tts.serve(engine, stdin(), stdout)
+
+    assert engine.stopped.is_set()
+    assert engine.spoken == ["a very long story", "the end"]
+    assert stdout.getvalue() == b"done\ndone\n"
+
+
+def test_crashing_worker_is_given_up_on(mocker, capsys):
+    """Test that a worker that keeps dying is restarted max_restarts times, then speech stops with an error."""
+    popen = mocker.spy(tts.subprocess, "Popen")
+    engine = tts.WorkerEngine([sys.executable, "-c", "pass"], max_restarts=2)
+    worker = tts.SpeechWorker(engine)
+
+    for _ in range(5):
+        worker.speak("Hello?", wait=True)
+        if engine._process is not None:
+            engine._process.wait()  # let it die before the next start() checks on it
+
+    assert popen.call_count == 2
+    assert "crashed 2 times in a row" in capsys.readouterr().out
+    worker.close()
+
+
+def test_interrupt_cannot_miss_an_utterance_being_started():
+    """Test that stop() waits for a start() in progress, so the new process is the one stopped."""
+    events = []
+    starting = threading.Event()
+
+    class SlowStartEngine(tts.NullEngine):
+        def start(self, text):
+            starting.set()
+            time.sleep(0.2)  # e.g. Popen still launching the synthesizer
+            events.append("start")
+            return text
+
+        def stop(self):
+            events.append("stop")
+
+    worker = tts.SpeechWorker(SlowStartEngine())
+    worker.speak("hello")
+    assert starting.wait(2)
+
+    worker.interrupt()
+
+    assert events == ["start", "stop"]
+    worker.close()
@@ -0,0 +1,199 @@
+"""
+Incremental extraction of {"tool_call": {...}} objects from LLM output.
+
+The scanner tracks brace depth, strings and escapes in a single pass, so nested
+objects like {"tool_call": {"name": ..., "arguments": {...}}} are found whole,
+and it can be fed token by token while Ollama is still streaming: each tool
+call is returned as soon as its closing brace arrives. `spans` and `pending`
+tell a streaming caller which parts of the text are tool calls (never spoken)
+and where an object that may still become one begins (held back for now).
+A '{' in ordinary prose would otherwise hold back the rest of the stream, so a
+candidate is given up as soon as it cannot be a JSON object (the first character
+after the brace is not '"' or '}') or once it grows past MAX_CALL_LENGTH; the
+scan then resumes right after its brace.
+
+For constrained generation, tool_call_schema() turns the tool signatures into a
+JSON schema for Ollama's `format` option, and validate_tool_calls() checks a
+reply (or any other caller's arguments) against the same signatures and types.
+"""
+import inspect
+import json
+
+_DECODER = json.JSONDecoder()
+
+# A tool call is a few hundred characters; an open object longer than this is not one
+MAX_CALL_LENGTH = 4096
+
+
+class ToolCallExtractor:
+    def __init__(self):
+        self.spans = []       # (start, end) offsets, in all text fed so far, of the tool calls found
+        self._buffer = ""
+        self._offset = 0      # offset of _buffer[0] in all text fed so far
+        self._pos = 0         # next character to scan
+        self._start = None    # index of the '{' that opened the current top-level object
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._expect_key = False  # the next non-space character must open a key (or close the object)
+
+    def feed(self, text):
+        """Adds streamed text and returns the tool calls completed by it, in order."""
+        self._buffer += text
+        found = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._start is not None and (
+                    i - self._start >= MAX_CALL_LENGTH
+                    or (self._expect_key and not char.isspace() and char not in '"}')):
+                i = self._abandon()
+                continue
+            if self._expect_key and not char.isspace():
+                self._expect_key = False
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                if self._depth:
+                    self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._start = i
+                    self._expect_key = True
+                self._depth += 1
+            elif char == "}" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    tool_call = self._decode(buffer[self._start:i + 1])
+                    if tool_call is not None:
+                        found.append(tool_call)
+                        self.spans.append((self._offset + self._start, self._offset + i + 1))
+                    self._start = None
+            i += 1
+        self._pos = len(buffer)
+
+        # Text outside an open object is never needed again
+        if self._start is None:
+            self._offset += len(buffer)
+            self._buffer, self._pos = "", 0
+        elif self._start:
+            self._offset += self._start
+            self._buffer = buffer[self._start:]
+            self._pos -= self._start
+            self._start = 0
+        return found
+
+    def _abandon(self):
+        """Gives up on the open object; returns where scanning resumes (just after its '{')."""
+        resume = self._start + 1
+        self._start = None
+        self._depth = 0
+        self._in_string = self._escaped = self._expect_key = False
+        return resume
+
+    @property
+    def pending(self):
+        """Offset of the '{' of an object that is still open (it may be a tool call), or None."""
+        return None if self._start is None else self._offset + self._start
+
+    @staticmethod
+    def _decode(candidate):
+        try:
+            parsed, _ = _DECODER.raw_decode(candidate)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(parsed, dict) and isinstance(parsed.get("tool_call"), dict):
+            return parsed["tool_call"]
+        return None
+
+
+def extract_tool_calls(text):
+    """Returns every tool call found in a complete LLM response."""
+    return ToolCallExtractor().feed(text)
+
+
+# ========== Constrained generation ==========
+
+TIME_PATTERN = "^([01][0-9]|2[0-3]):[0-5][0-9]$"
+_JSON_TYPES = {int: "integer", float: "number", bool: "boolean"}
+_PYTHON_TYPES = {"string": str, "integer": int, "number": (int, float), "boolean": bool}
+
+
+def _parameters(function):
+    return [p for p in inspect.signature(function).parameters.values()
+            if p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD)]
+
+
+def _has_type(value, json_type):
+    if isinstance(value, bool):  # a bool is an int to isinstance, never to the schema
+        return json_type == "boolean"
+    return isinstance(value, _PYTHON_TYPES[json_type])
+
+
+def tool_call_schema(tools, time_arguments=()):
+    """
+    JSON schema of {"tool_calls": [{"name": ..., "arguments": {...}}, ...]} in which every call
+    matches the signature of one of `tools` (name -> function). Arguments without a default are
+    required, no others are allowed, and the ones named in `time_arguments` must be HH:MM.
+    """
+    calls = []
+    for name, function in tools.items():
+        properties, required = {}, []
+        for parameter in _parameters(function):
+            schema = {"type": _JSON_TYPES.get(parameter.annotation, "string")}
+            if parameter.name in time_arguments:
+                schema["pattern"] = TIME_PATTERN
+            properties[parameter.name] = schema
+            if parameter.default is parameter.empty:
+                required.append(parameter.name)
+        calls.append({
+            "type": "object",
+            "properties": {
+                "name": {"const": name},
+                "arguments": {"type": "object", "properties": properties, "required": required,
+                              "additionalProperties": False},
+            },
+            "required": ["name", "arguments"],
+            "additionalProperties": False,
+        })
+    return {
+        "type": "object",
+        "properties": {"tool_calls": {"type": "array", "items": {"anyOf": calls}}},
+        "required": ["tool_calls"],
+        "additionalProperties": False,
+    }
+
+
+def validate_tool_calls(data, tools):
+    """
+    Returns the calls in a reply shaped like tool_call_schema() as [{"name", "arguments"}].
+    Raises ValueError if a call names an unknown tool, its arguments do not bind or one has
+    the wrong type (None is accepted where the default is None).
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("tool_calls"), list):
+        raise ValueError("expected an object with a 'tool_calls' list")
+    calls = []
+    for call in data["tool_calls"]:
+        if not isinstance(call, dict) or call.get("name") not in tools:
+            raise ValueError(f"unknown tool call: {call!r}")
+        arguments = call.get("arguments") or {}
+        if not isinstance(arguments, dict):
+            raise ValueError(f"arguments of {call['name']} are not an object")
+        try:
+            inspect.signature(tools[call["name"]]).bind(**arguments)
+        except TypeError as e:
+            raise ValueError(f"invalid arguments for {call['name']}: {e}")
+        for parameter in _parameters(tools[call["name"]]):
+            if parameter.name not in arguments:
+                continue
+            value, json_type = arguments[parameter.name], _JSON_TYPES.get(parameter.annotation, "string")
+            if not _has_type(value, json_type) and not (value is None and parameter.default is None):
+                raise ValueError(f"invalid arguments for {call['name']}: '{parameter.name}' must be a {json_type}")
+        calls.append({"name": call["name"], "arguments": arguments})
+    return calls
@@ -0,0 +1,140 @@
+"""
+Executes the tool calls from one LLM response.
+
+Calls are split into segments, keeping the order the model asked for:
+  * consecutive mutating calls (add/remove routine entries) that are already
+    queued run inside one transaction, so N edits cost one write;
+  * consecutive read-only calls run concurrently in a thread pool.
+A read that follows a mutation only starts after that mutation was committed.
+A transaction is committed as soon as no further call is waiting, so its lock is
+never held while the LLM is still streaming the rest of its reply. If it cannot
+be opened or committed, its calls get that failure as their error result.
+
+Calls can also be submitted one by one while the LLM is still streaming (see
+ToolExecutor.start), so execution starts before generation has finished.
+
+Calls run in the contextvars context of the thread that started the batch, so
+per-request state (e.g. which user's routine the tools edit) carries over.
+"""
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+
+class ToolExecutor:
+    def __init__(self, tools, mutating=(), transaction=nullcontext, max_workers=4):
+        self.tools = tools
+        self.mutating = set(mutating)
+        self.transaction = transaction
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ishu-tools")
+
+    @staticmethod
+    def _error(tool_call, e):
+        name = tool_call.get("name")
+        return {"name": name, "arguments": tool_call.get("arguments") or {}, "output": f"ERROR executing {name}: {e}",
+                "error": str(e), "seconds": 0.0}
+
+    def _call(self, tool_call):
+        name = tool_call.get("name")
+        arguments = tool_call.get("arguments") or {}
+        if name not in self.tools:
+            return {"name": name, "arguments": arguments, "output": None,
+                    "error": f"Tool '{name}' is not implemented.", "seconds": 0.0}
+        start = time.perf_counter()
+        try:
+            output, error = self.tools[name](**arguments), None
+        except Exception as e:
+            output, error = f"ERROR executing {name}: {e}", str(e)
+        return {"name": name, "arguments": arguments, "output": output, "error": error,
+                "seconds": time.perf_counter() - start}
+
+    def start(self, tool_calls=()):
+        """Returns a ToolRun that executes `tool_calls` and then calls as they are submitted."""
+        return ToolRun(self, tool_calls)
+
+    def run(self, tool_calls):
+        """Runs the calls and returns one result dict per call, in the original order."""
+        return self.start(tool_calls).finish()
+
+
+class ToolRun:
+    """
+    One batch of tool calls, executed by a worker thread in submission order.
+
+    A transaction opened for a mutation stays open only while more mutations are already
+    queued; it is committed as soon as the queue runs dry, a read-only call arrives or the
+    batch is finished.
+    """
+
+    def __init__(self, executor, tool_calls=()):
+        self.executor = executor
+        self._queue = queue.Queue()
+        self._results = {}
+        self._count = 0
+        for tool_call in tool_calls:  # queued up front, so a known batch shares one transaction
+            self.submit(tool_call)
+        context = contextvars.copy_context()
+        self._worker = threading.Thread(target=context.run, args=(self._work,), name="ishu-tool-run", daemon=True)
+        self._worker.start()
+
+    def submit(self, tool_call):
+        self._queue.put((self._count, tool_call))
+        self._count += 1
+
+    def finish(self):
+        """Waits for every submitted call and returns the results in submission order."""
+        self._queue.put(None)
+        self._worker.join()
+        return [self._results[i] for i in range(self._count)]
+
+    def _store(self, index, tool_call):
+        self._results[index] = self.executor._call(tool_call)
+
+    def _commit(self, transaction, edits):
+        """Commits the open transaction; if that fails, none of its edits happened."""
+        try:
+            transaction.__exit__(None, None, None)
+        except Exception as e:
+            for index in edits:
+                self._results[index] = self.executor._error(self._results[index], e)
+
+    def _work(self):
+        reads = []
+        transaction = None
+        edits = []  # calls made inside the open transaction
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                index, tool_call = item
+
+                if tool_call.get("name") in self.executor.mutating:
+                    if transaction is None:
+                        wait(reads)  # earlier reads must not observe this batch's edits
+                        reads = []
+                        try:
+                            transaction = self.executor.transaction()
+                            transaction.__enter__()
+                        except Exception as e:
+                            transaction = None
+                            self._results[index] = self.executor._error(tool_call, e)
+                            continue
+                    self._store(index, tool_call)
+                    edits.append(index)
+                    if self._queue.empty():
+                        # Nothing else has arrived yet: don't hold the routine lock while the LLM streams
+                        self._commit(transaction, edits)
+                        transaction, edits = None, []
+                else:
+                    if transaction is not None:
+                        self._commit(transaction, edits)
+                        transaction, edits = None, []
+                    reads.append(self.executor._pool.submit(contextvars.copy_context().run, self._store, index, tool_call))
+        finally:
+            if transaction is not None:
+                self._commit(transaction, edits)
+            wait(reads)
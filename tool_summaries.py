@@ -0,0 +1,161 @@
+"""
+Local phrasing of routine tool results, instead of a second LLM round trip.
+
+After a tool call the assistant used to send the results back to Ollama just to
+have them turned into a sentence. For the known outputs of the routine tools
+the reply is rendered here from templates. Each situation has a few phrasings,
+in Ishu's voice, picked at random. Anything the templates do not cover
+(errors, unknown tools, unexpected output, tools switched to "llm") returns
+None, and the caller falls back to the LLM summary.
+"""
+import json
+import random
+from itertools import groupby
+
+# How many entries of a full routine are read out before "and N more"
+MAX_LISTED_ENTRIES = 10
+
+ADDED = (
+    "Done! I've added {items} to your routine.",
+    "All set, {items} {is_are} on your schedule now.",
+    "Got it! {items} {is_are} in your routine. You've got this!",
+)
+REMOVED = (
+    "Done, I removed {entries} matching '{keyword}' from your routine.",
+    "Okay, I took {entries} matching '{keyword}' off your routine.",
+    "{Entries} matching '{keyword}' {is_are} gone from your routine now.",
+)
+NOT_REMOVED = (
+    "I couldn't find anything matching '{keyword}' in your routine.",
+    "Hmm, nothing in your routine matches '{keyword}', so I left it as it is.",
+)
+TASK_NOW = (
+    "Right now it's time for {activity}, until {end}.",
+    "You should be doing {activity} right now. It runs until {end}.",
+    "It's {activity} time! That goes on until {end}.",
+)
+TASK_AT = (
+    "At {time} you have {activity}, from {start} to {end}.",
+    "You're scheduled for {activity} at {time} ({start} to {end}).",
+)
+FREE_NOW = (
+    "You're free right now! Next up is {activity} at {start}.",
+    "Nothing scheduled at the moment. Your next activity is {activity} at {start}.",
+)
+FREE_AT = (
+    "Nothing is scheduled at {time}. Next up after that is {activity} at {start}.",
+    "You're free at {time}. Your next activity is {activity}, starting at {start}.",
+)
+ROUTINE = (
+    "Here's your day: {items}.",
+    "Your routine looks like this: {items}.",
+    "Here's what your day looks like: {items}.",
+)
+NO_ROUTINE = (
+    "You haven't set up a daily routine yet. Tell me an activity and a time, and I'll add it.",
+    "Your routine is still empty. Want to add your first activity?",
+)
+
+
+def _join(items):
+    if len(items) <= 2:
+        return " and ".join(items)
+    return ", ".join(items[:-1]) + ", and " + items[-1]
+
+
+def _plural(count, one, many):
+    return f"{count} {one if count == 1 else many}"
+
+
+def _parse(output):
+    """Tool outputs are JSON, except plain sentences such as get_routine's "not set yet"."""
+    try:
+        return json.loads(output)
+    except ValueError:
+        return output
+
+
+class ToolSummaries:
+    """
+    Renders replies for tool results. `modes` maps a tool name to "template" (phrase it
+    locally) or "llm" (always let the model summarise); unlisted tools use "llm".
+    """
+
+    def __init__(self, modes, rng=None):
+        self.modes = modes
+        self.rng = rng or random.Random()
+        self.renderers = {
+            "add_routine_entry": self._added,
+            "remove_routine_entry": self._removed,
+            "get_task_by_time": self._task,
+            "get_routine": self._routine,
+        }
+
+    def render(self, results):
+        """Returns the reply for these results (ToolExecutor dicts), or None if the LLM should write it."""
+        if not results or any(self.modes.get(r["name"]) != "template" or r["error"] for r in results):
+            return None
+        sentences = []
+        # Consecutive calls of the same tool are summarised together ("I've added A and B")
+        for name, group in groupby(results, key=lambda r: r["name"]):
+            renderer = self.renderers.get(name)
+            try:
+                calls = [(r["arguments"], _parse(r["output"])) for r in group]
+                sentence = renderer(calls) if renderer else None
+            except (TypeError, KeyError, AttributeError):
+                sentence = None
+            if sentence is None:
+                return None
+            sentences.append(sentence)
+        return " ".join(sentences)
+
+    def _pick(self, templates, **values):
+        return self.rng.choice(templates).format(**values)
+
+    # ---------- One renderer per tool: [(arguments, parsed output)] -> sentence or None ----------
+
+    def _added(self, calls):
+        if any(output.get("status") != "success" for _, output in calls):
+            return None
+        items = [f"{o['activity']} from {o['start']} to {o['end']}" for _, o in calls]
+        return self._pick(ADDED, items=_join(items), is_are="is" if len(items) == 1 else "are")
+
+    def _removed(self, calls):
+        sentences = []
+        for _, output in calls:
+            keyword = output["keyword"]
+            if output.get("status") == "success":
+                count = output["removed_count"]
+                entries = _plural(count, "entry", "entries")
+                sentences.append(self._pick(REMOVED, entries=entries, Entries=entries[0].upper() + entries[1:],
+                                            keyword=keyword, is_are="is" if count == 1 else "are"))
+            elif output.get("status") == "not_found":
+                sentences.append(self._pick(NOT_REMOVED, keyword=keyword))
+            else:
+                return None
+        return " ".join(sentences)
+
+    def _task(self, calls):
+        sentences = []
+        for arguments, output in calls:
+            status = output.get("status")
+            values = {key: output[key] for key in ("time", "start", "end", "activity") if key in output}
+            asked_now = not arguments.get("query_time")  # the tool fell back to the current time
+            if status == "found":
+                sentences.append(self._pick(TASK_NOW if asked_now else TASK_AT, **values))
+            elif status == "next_found":
+                sentences.append(self._pick(FREE_NOW if asked_now else FREE_AT, **values))
+            else:
+                return None
+        return " ".join(sentences)
+
+    def _routine(self, calls):
+        _, routine = calls[-1]
+        if isinstance(routine, str) or not routine:  # "You have not set your daily routine yet."
+            return self._pick(NO_ROUTINE)
+        if not isinstance(routine, list):
+            return None
+        items = [f"{e['activity']} from {e['start']} to {e['end']}" for e in routine[:MAX_LISTED_ENTRIES]]
+        if len(routine) > MAX_LISTED_ENTRIES:
+            items.append(f"{len(routine) - MAX_LISTED_ENTRIES} more")
+        return self._pick(ROUTINE, items=_join(items))
@@ -0,0 +1,219 @@
+"""
+Per-turn latency tracing and metrics for Ishu.
+
+A Tracer records timed spans ("listen", "stt.transcribe", "llm.first_pass",
+"tool.add_routine_entry", "speak", ...) and counters (LLM calls, tokens, tool
+invocations). Spans opened on a thread that is inside turn() are also attached to
+that turn, and when the turn ends it is written as one JSON line. Every span and
+counter is aggregated for the Prometheus text endpoint (serve_metrics).
+
+Command line support (shared by assistant.py and pipeline.py):
+    --trace FILE         append one JSON line per turn to FILE
+    --metrics-port PORT  serve Prometheus metrics on http://127.0.0.1:PORT/metrics
+    --profile FILE       run the session under cProfile; writes FILE and FILE.txt
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the span duration histogram buckets
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Turn:
+    def __init__(self, number, query):
+        self.number = number
+        self.query = query
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.spans = []
+        self.counters = defaultdict(float)
+
+    def add_span(self, name, start, seconds):
+        self.spans.append({"name": name, "offset_s": round(start - self._t0, 6), "duration_s": round(seconds, 6)})
+
+    def to_dict(self):
+        return {
+            "turn": self.number,
+            "timestamp": self.started,
+            "query": self.query,
+            "total_s": round(time.perf_counter() - self._t0, 6),
+            "spans": self.spans,
+            "counters": dict(self.counters),
+        }
+
+
+class Tracer:
+    def __init__(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+        self.turns = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = defaultdict(float)             # (name, labels) -> value
+        self._histograms = {}                           # span name -> [bucket counts..., +Inf count, sum]
+        self._server = None
+
+    # ---------- Recording ----------
+
+    @property
+    def current_turn(self):
+        return getattr(self._local, "turn", None)
+
+    @contextmanager
+    def turn(self, query=""):
+        """Groups the spans recorded on this thread into one turn and exports it when done."""
+        with self._lock:
+            self.turns += 1
+            turn = Turn(self.turns, query)
+        self._local.turn = turn
+        try:
+            yield turn
+        finally:
+            self._local.turn = None
+            self.count("turns")
+            self._export(turn)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, start)
+
+    def record(self, name, seconds, start=None):
+        """Records a span measured elsewhere (e.g. a tool call timed on a worker thread)."""
+        turn = self.current_turn
+        if turn is not None:
+            turn.add_span(name, start if start is not None else time.perf_counter() - seconds, seconds)
+        with self._lock:
+            histogram = self._histograms.setdefault(name, [0] * (len(SPAN_BUCKETS) + 1) + [0.0])
+            for i, bound in enumerate(SPAN_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[len(SPAN_BUCKETS)] += 1
+            histogram[-1] += seconds
+
+    def count(self, name, value=1, **labels):
+        turn = self.current_turn
+        if turn is not None:
+            turn.counters[name] += value
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def _export(self, turn):
+        if not self.jsonl_path:
+            return
+        line = json.dumps(turn.to_dict(), ensure_ascii=False)
+        with self._lock, open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    # ---------- Prometheus ----------
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((name, list(values)) for name, values in self._histograms.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"ishu_{name}_total"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value:g}")
+
+        if histograms:
+            lines.append("# TYPE ishu_span_seconds histogram")
+        for name, values in histograms:
+            for bound, bucket in zip(SPAN_BUCKETS, values):
+                lines.append(f'ishu_span_seconds_bucket{_labels((("span", name), ("le", f"{bound:g}")))} {bucket}')
+            lines.append(f'ishu_span_seconds_bucket{_labels((("span", name), ("le", "+Inf")))} {values[len(SPAN_BUCKETS)]}')
+            lines.append(f'ishu_span_seconds_sum{_labels((("span", name),))} {values[-1]:.6f}')
+            lines.append(f'ishu_span_seconds_count{_labels((("span", name),))} {values[len(SPAN_BUCKETS)]}')
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, port, host="127.0.0.1"):
+        """Serves prometheus_text() at http://host:port/metrics from a daemon thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # only needed with --metrics-port
+
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="ishu-metrics", daemon=True).start()
+        return self._server.server_address
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+# ========== Command line ==========
+
+def parse_args(argv=None, description=None):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--trace", metavar="FILE", help="append one JSON line of span timings per turn to FILE")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="run the session under cProfile; write the stats to FILE and a report to FILE.txt")
+    return parser.parse_args(argv)
+
+
+def run(main, tracer, args):
+    """Applies the tracing options to `tracer` and runs main(), profiled if requested."""
+    if args.trace:
+        tracer.jsonl_path = args.trace
+    if args.metrics_port:
+        host, port = tracer.serve_metrics(args.metrics_port)
+        print(f"Metrics at http://{host}:{port}/metrics")
+    if not args.profile:
+        return main()
+
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(main)
+    finally:
+        profiler.dump_stats(args.profile)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(40)
+        with open(f"{args.profile}.txt", "w") as f:
+            f.write(report.getvalue())
+        print(f"Profile written to {args.profile} and {args.profile}.txt")
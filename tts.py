@@ -0,0 +1,357 @@
+"""
+Text-to-speech for Ishu: one long-lived worker thread speaking an ordered queue.
+
+Utterances never overlap: speak() only enqueues, and the worker hands them to the
+engine one at a time. interrupt() drops everything still queued and cuts off the
+utterance being spoken (barge-in).
+
+The engine is detected once, when the worker is created:
+  * WorkerEngine  one long-lived `python tts.py --serve` process that keeps
+                  libespeak-ng loaded and speaks each utterance it is sent over a
+                  pipe, so the synthesizer starts once instead of per utterance;
+                  a stop goes down the same pipe and the process stays up
+  * SayEngine     macOS `say`, one process per utterance
+  * EspeakEngine  espeak-ng / espeak binary, one process per utterance (when the
+                  library cannot be found)
+  * FileEngine    appends each utterance to a text file (headless runs, tests)
+  * NullEngine    discards speech (no engine available)
+
+Engines start an utterance and then wait for it separately: the worker starts it
+under the same lock interrupt() stops it with, so a stop can never slip in before
+the process exists and be missed.
+"""
+import json
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+
+
+# ========== Engines ==========
+
+class NullEngine:
+    name = "none"
+
+    def start(self, text):
+        """Begins speaking text and returns a handle for wait(); must not block for long."""
+        return None
+
+    def wait(self, handle):
+        """Blocks until the utterance started with `handle` was spoken or stopped."""
+
+    def speak(self, text):
+        self.wait(self.start(text))
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileEngine(NullEngine):
+    """Writes every utterance as one line to `path` instead of playing it."""
+    name = "file"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def start(self, text):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(text.replace("\n", " ") + "\n")
+
+
+class ProcessEngine(NullEngine):
+    """
+    Plays each utterance with a command-line synthesizer. The `say` and `espeak-ng` binaries
+    offer no way to learn when a line fed through stdin has been spoken, so one process runs
+    per utterance and stop() terminates it.
+    """
+
+    def __init__(self, command):
+        self.command = list(command)
+        self._process = None
+        self._lock = threading.Lock()
+
+    def start(self, text):
+        with self._lock:
+            self._process = subprocess.Popen(self.command + [text], stdout=subprocess.DEVNULL,
+                                             stderr=subprocess.DEVNULL)
+            return self._process
+
+    def wait(self, process):
+        process.wait()
+
+    def stop(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+
+
+class SayEngine(ProcessEngine):
+    name = "say"
+
+    def __init__(self, executable="say"):
+        super().__init__([executable])
+
+
+class EspeakEngine(ProcessEngine):
+    name = "espeak"
+
+    def __init__(self, executable="espeak-ng", words_per_minute=170):
+        super().__init__([executable, "-s", str(words_per_minute)])
+
+
+class WorkerEngine(NullEngine):
+    """
+    Feeds utterances, one JSON line each, to a long-lived `tts.py --serve` process, which
+    answers "done" once it has spoken one. stop() sends {"stop": true} down the same pipe,
+    which cuts off the current utterance and keeps the process for the next one. A process
+    that died is restarted, but after max_restarts crashes in a row speech is given up on.
+    """
+
+    def __init__(self, command, name="worker", max_restarts=3):
+        self.command = list(command)
+        self.name = name
+        self.max_restarts = max_restarts
+        self._process = None
+        self._failures = 0  # crashes since the last utterance that was spoken
+        self._lock = threading.Lock()
+
+    def _running(self):
+        """The worker process, started or restarted if needed; None once it keeps crashing."""
+        if self._process is not None:
+            if self._process.poll() is None:
+                return self._process
+            self._process = None
+            self._failures += 1
+            if self._failures == self.max_restarts:
+                print(f"The {self.name} speech worker crashed {self._failures} times in a row; "
+                      f"speech is off until Ishu restarts.")
+        if self._failures >= self.max_restarts:
+            return None
+        try:
+            self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as e:
+            self._failures = self.max_restarts
+            print(f"Could not start the {self.name} speech worker: {e}")
+        return self._process
+
+    def _send(self, process, message):
+        try:
+            process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+            process.stdin.flush()
+        except OSError:  # it died; the next start() restarts it
+            return False
+        return True
+
+    def start(self, text):
+        with self._lock:
+            process = self._running()
+            if process is None or not self._send(process, {"text": text}):
+                return None
+            return process
+
+    def wait(self, process):
+        if process.stdout.readline():  # "done", spoken or cut off; b"" if the process died
+            with self._lock:
+                self._failures = 0
+
+    def stop(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._send(self._process, {"stop": True})
+
+    def close(self):
+        with self._lock:
+            if self._process is not None:
+                try:
+                    self._process.stdin.close()  # the server exits at end of input
+                except OSError:
+                    pass
+                self._process.wait(timeout=5)
+                self._process = None
+
+
+# ========== Worker process (python tts.py --serve ENGINE ...) ==========
+
+class LibEspeakSynth(NullEngine):
+    """
+    libespeak-ng loaded in-process through ctypes, playing on its own audio thread:
+    wait() returns once playback has finished, and stop() cancels it from any thread.
+    """
+    name = "espeak-lib"
+
+    AUDIO_OUTPUT_PLAYBACK = 0
+    ESPEAK_RATE = 1
+    POS_CHARACTER = 1
+    CHARS_UTF8 = 1
+
+    def __init__(self, library, words_per_minute=170):
+        import ctypes
+
+        lib = ctypes.CDLL(library)
+        lib.espeak_Initialize.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        lib.espeak_SetParameter.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int]
+        lib.espeak_Synth.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int,
+                                     ctypes.c_uint, ctypes.c_uint, ctypes.c_void_p, ctypes.c_void_p]
+        if lib.espeak_Initialize(self.AUDIO_OUTPUT_PLAYBACK, 0, None, 0) < 0:
+            raise OSError(f"could not initialise {library}")
+        lib.espeak_SetParameter(self.ESPEAK_RATE, words_per_minute, 0)
+        self.lib = lib
+
+    def start(self, text):
+        data = text.encode("utf-8") + b"\0"
+        self.lib.espeak_Synth(data, len(data), 0, self.POS_CHARACTER, 0, self.CHARS_UTF8, None, None)
+        return text
+
+    def wait(self, handle):
+        self.lib.espeak_Synchronize()
+
+    def stop(self):
+        self.lib.espeak_Cancel()
+
+
+def serve(synth, stdin, stdout):
+    """
+    The worker process loop. Each stdin line is {"text": ...}, answered with "done" once it was
+    spoken (or cut off), or {"stop": true}, which interrupts speech like SpeechWorker.interrupt().
+    """
+    worker = SpeechWorker(synth)
+    answers = queue.Queue()
+
+    def answer():
+        while True:
+            utterance = answers.get()
+            if utterance is None:
+                return
+            utterance.done.wait()
+            stdout.write(b"done\n")
+            stdout.flush()
+
+    answerer = threading.Thread(target=answer, name="ishu-tts-answers", daemon=True)
+    answerer.start()
+    for line in stdin:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = {}  # still answered, so the client never waits for it
+        if message.get("stop"):
+            worker.interrupt()
+        else:
+            answers.put(worker.speak(message.get("text", "")))
+    answers.put(None)
+    answerer.join()
+    worker.close()
+
+
+def serve_command(engine, *args):
+    """The command that starts a worker process serving `engine` ("espeak-lib" or "file")."""
+    return [sys.executable, os.path.abspath(__file__), "--serve", engine, *map(str, args)]
+
+
+def espeak_library():
+    import ctypes.util
+
+    return ctypes.util.find_library("espeak-ng") or ctypes.util.find_library("espeak")
+
+
+def detect_engine(preference="auto", file_path=None):
+    """Picks the speech engine once: an explicit preference, else by platform and installed binaries."""
+    if preference == "none":
+        return NullEngine()
+    if preference == "file" or (preference == "auto" and file_path):
+        return FileEngine(file_path or "speech.txt")
+
+    say = shutil.which("say")
+    espeak = shutil.which("espeak-ng") or shutil.which("espeak")
+    if preference in ("auto", "say") and say and platform.system() == "Darwin":
+        return SayEngine(say)
+    if preference in ("auto", "espeak"):
+        library = espeak_library()
+        if library:
+            return WorkerEngine(serve_command("espeak-lib", library), name="espeak")
+        if espeak:
+            return EspeakEngine(espeak)
+    return NullEngine()
+
+
+# ========== Worker ==========
+
+class Utterance:
+    def __init__(self, text, generation):
+        self.text = text
+        self.generation = generation
+        self.done = threading.Event()
+
+
+class SpeechWorker:
+    """Speaks queued utterances in order on a single daemon thread."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._queue = queue.Queue()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="ishu-tts", daemon=True)
+        self._thread.start()
+
+    def speak(self, text, wait=False):
+        """Queues text; with wait=True, returns once it was spoken (or interrupted)."""
+        with self._lock:
+            utterance = Utterance(text, self._generation)
+        self._queue.put(utterance)
+        if wait:
+            utterance.done.wait()
+        return utterance
+
+    def interrupt(self):
+        """Drops queued utterances and stops the one being spoken."""
+        with self._lock:
+            # Under the lock _run starts utterances with, so the stop cannot miss one being started
+            self._generation += 1
+            self.engine.stop()
+        while True:
+            try:
+                self._queue.get_nowait().done.set()
+            except queue.Empty:
+                break
+
+    def close(self):
+        self.interrupt()
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self.engine.close()
+
+    def _run(self):
+        while True:
+            utterance = self._queue.get()
+            if utterance is None:
+                return
+            try:
+                handle = None
+                with self._lock:
+                    if utterance.text and utterance.generation == self._generation:
+                        handle = self.engine.start(utterance.text)
+                if handle is not None:
+                    self.engine.wait(handle)
+            except Exception as e:
+                print(f"Speech failed ({self.engine.name}): {e}")
+            finally:
+                utterance.done.set()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "--serve":
+        sys.exit("usage: tts.py --serve espeak-lib LIBRARY [WORDS_PER_MINUTE] | --serve file PATH")
+    engine, args = sys.argv[2], sys.argv[3:]
+    out, sys.stdout = sys.stdout.buffer, sys.stderr  # stdout carries the protocol; messages go to stderr
+    if engine == "espeak-lib":
+        synth = LibEspeakSynth(args[0], *map(int, args[1:]))
+    else:
+        synth = FileEngine(args[0])
+    serve(synth, sys.stdin.buffer, out)